@@ -5,15 +5,34 @@ This module serves the web application, handling API requests for scraping
 and providing data to the frontend.
 """
 
-from flask import Flask, render_template, jsonify, request
-import pandas as pd
-from typing import Dict, Any, List
+import os
+import threading
 
-from src.scraper import get_listings
-from src import car_data
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
+
+from src.scraper import iter_listing_pages, prewarm_metadata
+from src.store import get_store
+from src.rollups import get_rollups
+from src.analytics import RunningSummary, summarize, summarize_arrays
+from src.export import DEFAULT_CHUNK_ROWS, MIMETYPES, check_format, iter_export, table_slices
+from src.result_cache import cached_result, get_result_cache, hit_events
+from src.result_sets import ResultSet, result_sets
+from src.watcher import DEFAULT_INTERVAL, get_watch_store, get_watcher
+from src.wire import MessageEncoder, StreamCompressor, negotiate
+from src.jobs import JobQueueFull, get_job_manager, normalize_params
+from src import metrics, throttle
+from src.metrics import EXPORT_BYTES, STREAM_BYTES, span
 
 app = Flask(__name__)
 
+# Optionally load makes and popular models into the metadata cache at startup
+if os.environ.get('OTOMOTO_PREWARM') == '1':
+    threading.Thread(target=prewarm_metadata, name='metadata-prewarm', daemon=True).start()
+
+# Poll saved searches from this process (several workers share the polls)
+if os.environ.get('OTOMOTO_WATCH') == '1':
+    get_watcher().start()
+
 @app.route('/')
 def index():
     """Render the main dashboard page."""
@@ -45,66 +64,451 @@ def get_generations_for_model(make, model):
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
     """
-    Trigger the scraping process based on usage params.
-    Returns a streamed response (NDJSON) with progress updates and final data.
-    """
-    data = request.json
-    
-    make = data.get('make')
-    model = data.get('model')
-    year_from = int(data.get('year_from', 2015))
-    year_to = int(data.get('year_to', 2024))
-    generation = data.get('generation')
-    max_pages = int(data.get('max_pages', 20))
-
-    # Additional filters
-    fuel_type = data.get('fuel_type')
-    gearbox = data.get('gearbox')
-    drive_type = data.get('drive_type')
-    first_owner = data.get('first_owner', False)
-    accident_free = data.get('accident_free', False)
-
-    if not make or not model:
-        return jsonify({'error': 'Make and Model are required'}), 400
+    Run (or join) a background scrape job for the given search.
+    Returns a streamed response (NDJSON): a 'job' message with the job id,
+    progress updates, one 'batch' message per scraped page as soon as it is
+    parsed, 'enrichment' messages with detail-page flags when the body sets
+    "enrich", then 'complete'. Disconnecting does not stop the job; follow it
+    again through /api/jobs/<id>/events. With OTOMOTO_PROFILING=1, ?profile=1
+    runs the scrape under cProfile (see /api/jobs/<id>/profile).
+    A search analysed recently (by any worker) is streamed straight from the
+    result cache as one batch, without a job; ?cache=0 or "incremental":
+    false skip the lookup.
+    """
+    try:
+        params = normalize_params(request.json or {})
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    if _cache_requested(params):
+        hit = cached_result(params)
+        if hit is not None:
+            table, stored_at = hit
+            result_id = result_sets.add(ResultSet(table, params=params))
+            return _stream_events(hit_events(table, result_id, stored_at))
+
+    try:
+        job, coalesced = get_job_manager().submit(params, profile=_profile_requested())
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+
+    return _stream_job(job, coalesced)
+
+def _cache_requested(params) -> bool:
+    """Whether an analysis may be answered from the result cache."""
+    return params['incremental'] and request.args.get('cache') not in ('0', 'false')
+
+def _stream_job(job, coalesced=False, start=0):
+    """Stream a job's events, after a 'job' message with its id."""
+    return _stream_events(job.iter_events(start), {
+        "type": "job",
+        "data": {'job_id': job.id, 'status': job.status, 'coalesced': coalesced}
+    })
+
+def _stream_events(events, head=None):
+    """
+    Stream analysis events with running analytics after each batch.
+    Layout (rows, columnar or Arrow IPC) and compression (gzip, brotli)
+    are negotiated from the Accept/Accept-Encoding headers or the
+    ?layout= / ?encoding= query parameters, see src/wire.py.
+    """
+    layout, encoding = negotiate(
+        request.headers.get('Accept'),
+        request.headers.get('Accept-Encoding'),
+        request.args.get('layout'),
+        request.args.get('encoding')
+    )
+    encoder = MessageEncoder(layout)
+    compressor = StreamCompressor(encoding)
+
+    def send(data: bytes) -> bytes:
+        with span('compress'):
+            data = compressor.compress(data)
+        STREAM_BYTES.inc(len(data), layout=layout, encoding=encoding)
+        return data
+
+    def message(event) -> bytes:
+        with span('serialize'):
+            data = encoder.message(event)
+        return send(data)
+
+    def analytics_message(update):
+        """The 'analytics' message of a RunningSummary update, if it produced one."""
+        with span('analytics'):
+            summary = update()
+        if summary is not None:
+            yield message({"type": "analytics", "data": summary})
 
     def generate():
-        import json
-        
-        # Progress callback to yield updates
-        def progress_callback(message):
-            # We yield a JSON string followed by a newline
-            yield json.dumps({"type": "progress", "message": message}) + "\n"
+        if head is not None:
+            yield message(head)
+
+        # Aggregates over everything streamed so far, refreshed as it grows
+        # and complete before the 'complete' message
+        running = RunningSummary()
+        for event in events:
+            if event['type'] == 'complete':
+                yield from analytics_message(running.flush)
+            yield message(event)
+            if event['type'] == 'batch':
+                yield from analytics_message(lambda: running.add(event['listings']))
+        yield from analytics_message(running.flush)
+        yield send(encoder.close()) + compressor.finish()
+
+    response = Response(stream_with_context(generate()), mimetype=encoder.mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
 
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a scrape job (same body as /api/analyze) without streaming it."""
+    try:
+        params = normalize_params(request.json or {})
+        job, coalesced = get_job_manager().submit(params, profile=_profile_requested())
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify(dict(job.to_dict(), coalesced=coalesced)), 202
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Return the status of a scrape job."""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/result')
+def get_job_result(job_id):
+    """Return the result of a finished job: its result set id and analytics."""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job.finished:
+        return jsonify(dict(job.to_dict(), error='Job has not finished yet')), 409
+    result_set = result_sets.get(job.result_id) if job.result_id else None
+    return jsonify(dict(
+        job.to_dict(),
+        analytics=summarize_arrays(result_set.price, result_set.mileage, result_set.region)
+        if result_set is not None else None
+    ))
+
+@app.route('/api/jobs/<job_id>/events')
+def follow_job(job_id):
+    """Stream a job's events (NDJSON, as /api/analyze), from index ?from=N."""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return _stream_job(job, start=request.args.get('from', 0, type=int))
+
+@app.route('/api/jobs/<job_id>/profile')
+def get_job_profile(job_id):
+    """
+    Return the cProfile report of a job submitted with ?profile=1, as text.
+    Query params: sort (pstats key, default cumulative), limit. The raw
+    profile is also written to OTOMOTO_PROFILE_DIR/<job_id>.prof.
+    """
+    job = get_job_manager().get(job_id)
+    if job is None or job.profile is None:
+        return jsonify({'error': 'No profile for this job'}), 404
+    if not job.finished:
+        return jsonify(dict(job.to_dict(), error='Job has not finished yet')), 409
+    try:
+        report = job.profile.summary(
+            limit=request.args.get('limit', 40, type=int),
+            sort=request.args.get('sort', 'cumulative')
+        )
+    except KeyError as e:
+        return jsonify({'error': f"Unknown sort key: {e}"}), 400
+    return Response(report, mimetype='text/plain')
+
+def _profile_requested() -> bool:
+    """Whether the request asks for a profiled scrape and profiling is enabled."""
+    return metrics.PROFILING_ENABLED and request.args.get('profile') in ('1', 'true')
+
+@app.route('/api/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    """Requeue a failed job; it continues after its last completed page."""
+    try:
+        job = get_job_manager().resume(job_id)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/analytics', methods=['POST'])
+def analytics():
+    """
+    Compute price aggregates for an arbitrary set of listings.
+    Accepts either {"listings": [...]} or compact columns
+    {"price": [...], "mileage": [...], "region": [...]}.
+    """
+    data = request.json or {}
+    if 'listings' in data:
+        return jsonify(summarize(data['listings']))
+
+    price = data.get('price')
+    mileage = data.get('mileage')
+    region = data.get('region')
+    if (price is None or mileage is None or len(price) != len(mileage)
+            or (region is not None and len(region) != len(price))):
+        return jsonify({'error': 'Provide listings or equal-length price, mileage and region columns'}), 400
+    return jsonify(summarize_arrays(price, mileage, region))
+
+@app.route('/api/results/<result_id>')
+def query_results(result_id):
+    """
+    Filter, sort and page a stored analysis result.
+    Query params: year_from, year_to, fuel, gearbox, drive, first_owner,
+    accident_free, sort, direction, page, page_size.
+    """
+    result_set = result_sets.get(result_id)
+    if result_set is None:
+        return jsonify({'error': 'Result expired or not found'}), 404
+
+    args = request.args
+    try:
+        result = result_set.query(
+            year_from=args.get('year_from', type=int),
+            year_to=args.get('year_to', type=int),
+            fuel=args.get('fuel') or None,
+            gearbox=args.get('gearbox') or None,
+            drive=args.get('drive') or None,
+            first_owner=args.get('first_owner') in ('1', 'true'),
+            accident_free=args.get('accident_free') in ('1', 'true'),
+            sort=args.get('sort') or None,
+            direction=args.get('direction', 'asc'),
+            page=args.get('page', 1, type=int),
+            page_size=args.get('page_size', 50, type=int),
+            include_analytics=args.get('analytics', '1') != '0'
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+@app.route('/api/results/<result_id>/export')
+def export_results(result_id):
+    """
+    Download a stored analysis result as a file, streamed in chunks.
+    Query params: format (csv, ndjson or parquet; default csv), the
+    /api/results filters (year_from, year_to, fuel, gearbox, drive,
+    first_owner, accident_free) and chunk_rows.
+    """
+    result_set = result_sets.get(result_id)
+    if result_set is None:
+        return jsonify({'error': 'Result expired or not found'}), 404
+    try:
+        fmt, chunk_rows = _export_options()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    args = request.args
+    table = result_set.table
+    filters = dict(
+        year_from=args.get('year_from', type=int),
+        year_to=args.get('year_to', type=int),
+        fuel=args.get('fuel') or None,
+        gearbox=args.get('gearbox') or None,
+        drive=args.get('drive') or None,
+        first_owner=args.get('first_owner') in ('1', 'true'),
+        accident_free=args.get('accident_free') in ('1', 'true')
+    )
+    if any(filters.values()):
+        table = table.take(result_set.mask(**filters))
+    return _export_response(table_slices(table, chunk_rows), result_set.params, result_id, fmt, chunk_rows)
+
+@app.route('/api/export', methods=['POST'])
+def export_search():
+    """
+    Scrape a search (same body as /api/analyze, without "enrich") and
+    stream its listings as a file while the pages come in, without keeping
+    them. Query params: format (csv, ndjson or parquet; default csv),
+    chunk_rows.
+    """
+    try:
+        params = normalize_params(request.json or {})
+        fmt, chunk_rows = _export_options()
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    if params.pop('enrich'):
+        return jsonify({'error': 'Exports of live searches cannot be enriched; export an enriched result instead'}), 400
+
+    # A failed page aborts the download rather than silently truncating the
+    # file; the first page is scraped before answering, so a search that
+    # fails right away gets an error status instead
+    pages = iter_listing_pages(**params, store=get_store(), raise_on_error=True, rollups=get_rollups())
+    try:
+        first = next(pages, None)
+    except Exception as e:
+        pages.close()
+        return jsonify({'error': f"Scraping failed: {e}"}), 502
+
+    def tables():
         try:
-            listings = get_listings(
-                make=make,
-                model=model,
-                year_from=year_from,
-                year_to=year_to,
-                fuel_type=fuel_type,
-                gearbox=gearbox,
-                drive_type=drive_type,
-                first_owner=first_owner,
-                accident_free=accident_free,
-                generation_slug=generation,
-                max_pages=max_pages,
-                progress_callback=progress_callback 
-            )
-
-            # Final data
-            yield json.dumps({
-                "type": "complete", 
-                "data": {
-                    'count': len(listings),
-                    'listings': listings
-                }
-            }) + "\n"
-
-        except Exception as e:
-            yield json.dumps({"type": "error", "message": str(e)}) + "\n"
-
-    from flask import Response, stream_with_context
-    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+            if first is not None:
+                yield first.listings
+            for batch in pages:
+                yield batch.listings
+        finally:
+            pages.close()
+
+    return _export_response(tables(), params, 'search', fmt, chunk_rows)
+
+def _export_options():
+    """The export format and chunk size from ?format= and ?chunk_rows=; ValueError if invalid."""
+    fmt = request.args.get('format', 'csv').lower()
+    check_format(fmt)
+    chunk_rows = request.args.get('chunk_rows', DEFAULT_CHUNK_ROWS, type=int)
+    if chunk_rows <= 0:
+        raise ValueError("chunk_rows must be positive")
+    return fmt, chunk_rows
+
+def _export_response(tables, params, name, fmt, chunk_rows):
+    """Chunked download of iter_export over tables."""
+    pieces = iter_export(tables, fmt, chunk_rows)
+    filename = '-'.join(str(part) for part in ('otomoto', params.get('make'), params.get('model'), name) if part)
+
+    def generate():
+        try:
+            for piece in pieces:
+                EXPORT_BYTES.inc(len(piece), format=fmt)
+                yield piece
+        finally:
+            pieces.close()
+
+    response = Response(stream_with_context(generate()), mimetype=MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+@app.route('/api/trends')
+def get_trends():
+    """
+    Price trend of a search from the precomputed rollups (no scraping).
+    Query params: make, model (required), generation, year_from, year_to,
+    fuel, gearbox, from, to (scrape days, YYYY-MM-DD), interval (day, week,
+    month or quarter).
+    """
+    args = request.args
+    if not args.get('make') or not args.get('model'):
+        return jsonify({'error': 'Make and Model are required'}), 400
+    try:
+        trend = get_rollups().trend(
+            args['make'],
+            args['model'],
+            generation=args.get('generation') or None,
+            year_from=args.get('year_from', type=int),
+            year_to=args.get('year_to', type=int),
+            fuel=args.get('fuel') or None,
+            gearbox=args.get('gearbox') or None,
+            day_from=args.get('from') or None,
+            day_to=args.get('to') or None,
+            interval=args.get('interval', 'day')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(trend)
+
+@app.route('/api/listings/<listing_id>/history')
+def get_listing_history(listing_id):
+    """Return a stored listing with its price-change history."""
+    store = get_store()
+    listing = store.get_listing(listing_id)
+    if listing is None:
+        return jsonify({'error': 'Listing not found'}), 404
+    return jsonify({
+        'listing': listing,
+        'price_history': store.get_price_history(listing_id)
+    })
+
+@app.route('/api/throttle')
+def get_throttle_state():
+    """
+    State of the adaptive request controller: in-flight window and bound,
+    latency baseline, counters and its most recent decisions.
+    """
+    return jsonify(throttle.controller.state())
+
+@app.route('/api/result-cache')
+def get_result_cache_state():
+    """
+    Node-wide result cache stats (hits, misses, hit ratio, evictions, size)
+    and the cached searches, most recently used first.
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'ttl': cache.ttl, 'stats': cache.stats(), 'entries': cache.entries()})
+
+@app.route('/api/watch', methods=['GET'])
+def list_watches():
+    """Saved searches with their schedule and poll counters, and whether this process polls them."""
+    return jsonify({'searches': get_watch_store().searches(), 'running': get_watcher().running})
+
+@app.route('/api/watch', methods=['POST'])
+def add_watch():
+    """
+    Save a search to be polled for new listings (same fields as
+    /api/analyze; max_pages, incremental and enrich do not apply), plus
+    "interval" in seconds. Saving an already saved search changes its
+    interval.
+    """
+    data = request.json or {}
+    try:
+        params = normalize_params(data)
+        search = get_watch_store().add(params, float(data.get('interval', DEFAULT_INTERVAL)))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(search), 201
+
+@app.route('/api/watch/feed')
+def get_watch_feed():
+    """
+    New and re-priced listings found by polls, oldest first.
+    Query params: since (last seq already read), search (saved search id),
+    limit (default 100). "next" is the since of the following request.
+    """
+    since = request.args.get('since', 0, type=int)
+    entries = get_watch_store().feed(
+        since=since,
+        search_id=request.args.get('search') or None,
+        limit=min(request.args.get('limit', 100, type=int), 1000)
+    )
+    return jsonify({'entries': entries, 'next': entries[-1]['seq'] if entries else since})
+
+@app.route('/api/watch/<search_id>', methods=['GET'])
+def get_watch(search_id):
+    """Return a saved search."""
+    search = get_watch_store().get(search_id)
+    if search is None:
+        return jsonify({'error': 'Saved search not found'}), 404
+    return jsonify(search)
+
+@app.route('/api/watch/<search_id>', methods=['DELETE'])
+def remove_watch(search_id):
+    """Stop watching a search and drop its feed entries."""
+    if not get_watch_store().remove(search_id):
+        return jsonify({'error': 'Saved search not found'}), 404
+    return jsonify({'removed': search_id})
+
+@app.route('/api/watch/<search_id>/poll', methods=['POST'])
+def poll_watch(search_id):
+    """Poll a saved search now, outside its schedule; returns the feed entries it added."""
+    search = get_watch_store().get(search_id)
+    if search is None:
+        return jsonify({'error': 'Saved search not found'}), 404
+    try:
+        return jsonify(get_watcher().poll(search))
+    except Exception as e:
+        return jsonify({'error': f"Polling failed: {e}"}), 502
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Pipeline counters, stage timings and cache/job stats in the Prometheus text format."""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
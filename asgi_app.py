@@ -0,0 +1,194 @@
+"""
+Otomoto Price Analyzer - ASGI service mode.
+
+Serves /api/config, /api/models/<make>, /api/generations/<make>/<model> and
+the streaming /api/analyze on an event loop: analyses run on the asyncio
+scraper core (src/async_scraper.py) inside the request instead of on the job
+manager's worker threads, so concurrent slow scrapes cost a task and a few
+pooled connections each rather than a thread. Every other route (the
+dashboard, jobs, results, trends, metrics...) is served by the Flask app in
+app.py, mounted behind the async routes.
+
+Run with: uvicorn asgi_app:app --port 8000
+"""
+
+import asyncio
+import warnings
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app import app as flask_app
+from src.analytics import RunningSummary
+from src.async_scraper import AsyncEnrichmentRun, close_async_client, iter_listing_pages_async
+from src.jobs import AnalysisRun, normalize_params
+from src.metrics import STREAM_BYTES, span
+from src.result_cache import cached_result, hit_events
+from src.result_sets import ResultSet, result_sets
+from src.scraper import get_generations, get_makes, get_models
+from src.wire import MessageEncoder, StreamCompressor, negotiate
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    with warnings.catch_warnings():
+        # Deprecated in favour of a2wsgi, but enough to serve the Flask routes
+        warnings.simplefilter('ignore')
+        from starlette.middleware.wsgi import WSGIMiddleware
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    yield
+    await close_async_client()
+
+
+app = FastAPI(title='Otomoto Price Analyzer', lifespan=lifespan)
+
+
+@app.get('/api/config')
+async def get_config():
+    """Return configuration data (makes) for the frontend."""
+    makes = await asyncio.to_thread(get_makes)
+    return {'makes': makes}
+
+
+@app.get('/api/models/{make}')
+async def get_models_for_make(make: str):
+    """Fetch models for a specific make dynamically."""
+    return await asyncio.to_thread(get_models, make)
+
+
+@app.get('/api/generations/{make}/{model}')
+async def get_generations_for_model(make: str, model: str):
+    """Fetch generations for a specific model dynamically."""
+    return await asyncio.to_thread(get_generations, make, model)
+
+
+@app.post('/api/analyze')
+async def analyze(request: Request):
+    """
+    Run the given search and stream it, as the Flask /api/analyze does:
+    progress updates, one 'batch' message per scraped page followed by
+    running 'analytics', 'enrichment' messages when the body sets "enrich",
+    then 'complete' (with the result set id) or 'error'. There is no job
+    behind the stream: disconnecting cancels the scrape. Searches found in
+    the result cache are streamed from it (?cache=0 or "incremental": false
+    skip the lookup).
+    """
+    try:
+        params = normalize_params(await request.json() or {})
+    except (TypeError, ValueError) as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    cached = None
+    if params['incremental'] and request.query_params.get('cache') not in ('0', 'false'):
+        hit = await asyncio.to_thread(cached_result, params)
+        if hit is not None:
+            table, stored_at = hit
+            result_id = await asyncio.to_thread(lambda: result_sets.add(ResultSet(table, params=params)))
+            cached = hit_events(table, result_id, stored_at)
+
+    layout, encoding = negotiate(
+        request.headers.get('Accept'),
+        request.headers.get('Accept-Encoding'),
+        request.query_params.get('layout'),
+        request.query_params.get('encoding')
+    )
+    encoder = MessageEncoder(layout)
+    compressor = StreamCompressor(encoding)
+
+    def send(data: bytes) -> bytes:
+        with span('compress'):
+            data = compressor.compress(data)
+        STREAM_BYTES.inc(len(data), layout=layout, encoding=encoding)
+        return data
+
+    def message(event) -> bytes:
+        with span('serialize'):
+            data = encoder.message(event)
+        return send(data)
+
+    def analytics_message(update) -> bytes:
+        """The 'analytics' message of a RunningSummary update, if it produced one."""
+        with span('analytics'):
+            summary = update()
+        return message({"type": "analytics", "data": summary}) if summary is not None else b''
+
+    async def generate():
+        events: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+        if cached is not None:
+            task = None
+            for event in cached + [None]:
+                events.put_nowait(event)
+        else:
+            task = asyncio.create_task(_analyze(params, events.put_nowait))
+        try:
+            # Aggregates over everything streamed so far, refreshed as it grows
+            # and complete before the 'complete' message
+            running = RunningSummary()
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                if event['type'] == 'complete':
+                    yield analytics_message(running.flush)
+                yield message(event)
+                if event['type'] == 'batch':
+                    yield analytics_message(lambda: running.add(event['listings']))
+            yield analytics_message(running.flush)
+            yield send(encoder.close()) + compressor.finish()
+        finally:
+            if task is not None:
+                task.cancel()
+
+    headers = {'Vary': 'Accept, Accept-Encoding'}
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return StreamingResponse(generate(), media_type=encoder.mimetype, headers=headers)
+
+
+async def _analyze(params: Dict[str, Any], emit) -> None:
+    """Scrape one search, retrying failed pages with backoff, and emit its events (None when done)."""
+    run = AnalysisRun(params, emit)
+    enrichment = AsyncEnrichmentRun(run.add_details) if run.enrich else None
+    try:
+        while True:
+            try:
+                async for batch in iter_listing_pages_async(**run.page_args()):
+                    listings = run.add_batch(batch)
+                    if enrichment is not None:
+                        await enrichment.add(listings)
+                break
+            except Exception as e:
+                delay = run.retry_delay(e)
+                if delay is None:
+                    print(f"Analysis failed on page {run.next_page}: {e}")
+                    if enrichment is not None:
+                        await enrichment.close(wait=False)
+                    emit(run.failure())
+                    return
+                with span('backoff'):
+                    await asyncio.sleep(delay)
+
+        details = None
+        if enrichment is not None:
+            run.progress("Waiting for listing details...")
+            with span('enrich_wait'):
+                details = await enrichment.close()
+        emit(await asyncio.to_thread(run.complete, details))
+    except asyncio.CancelledError:
+        if enrichment is not None:
+            await enrichment.close(wait=False)
+        raise
+    except Exception as e:
+        print(f"Analysis crashed: {e}")
+        emit({'type': 'error', 'message': str(e)})
+    finally:
+        emit(None)
+
+
+# Everything else is served by the Flask app
+app.mount('/', WSGIMiddleware(flask_app))
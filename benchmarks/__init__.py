@@ -0,0 +1 @@
+"""Offline benchmarks and a local Otomoto stub server."""
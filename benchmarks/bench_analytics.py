@@ -0,0 +1,83 @@
+"""
+Scaling benchmark for the server-side analytics.
+
+Times ``summarize`` (from listing dicts) and ``summarize_arrays`` (from
+columns) on synthetic result sets up to 100k listings, and compares the
+aggregate payload with the raw rows the browser used to receive.
+
+Usage:
+    python -m benchmarks.bench_analytics --sizes 1000 10000 100000
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from benchmarks.corpus import CITIES
+from src.analytics import summarize, summarize_arrays
+
+
+def synthetic_listings(n: int, seed: int = 0):
+    """Listing dicts with realistic price/mileage spread."""
+    rng = np.random.default_rng(seed)
+    years = rng.integers(2010, 2025, n)
+    mileage = rng.integers(1000, 350000, n)
+    price = np.maximum(5000, 250000 - (2024 - years) * 12000 - mileage * 0.25 + rng.normal(0, 15000, n))
+    price[rng.random(n) < 0.02] = 0  # "Zapytaj o cenę"
+    regions = [CITIES[i][1] for i in rng.integers(0, len(CITIES), n)]
+    return [
+        {
+            "id": str(6100000000 + i),
+            "scrape_date": "2024-01-01 12:00:00",
+            "title": "BMW Seria 3 320d",
+            "price_text": f"{int(price[i])} PLN",
+            "price": float(round(price[i])),
+            "year": str(years[i]),
+            "mileage_text": f"{mileage[i]} km",
+            "mileage": int(mileage[i]),
+            "fuel": "Diesel",
+            "gearbox": "Automatyczna",
+            "drive": "4x4 (stały)",
+            "region": regions[i],
+            "accident_free": bool(i % 2),
+            "first_owner": bool(i % 3 == 0),
+            "link": f"https://www.otomoto.pl/osobowe/oferta/bmw-seria-3-ID{i:x}.html",
+        }
+        for i in range(n)
+    ]
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark server-side analytics")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'listings':>9} {'from dicts':>11} {'from arrays':>12} {'rows JSON':>11} {'aggregates':>11}")
+    for n in args.sizes:
+        listings = synthetic_listings(n)
+        price = np.array([l['price'] for l in listings])
+        mileage = np.array([l['mileage'] for l in listings], dtype=float)
+        region = [l['region'] for l in listings]
+
+        t_dicts = best_of(lambda: summarize(listings), args.repeat)
+        t_arrays = best_of(lambda: summarize_arrays(price, mileage, region), args.repeat)
+        rows_size = len(json.dumps(listings))
+        agg_size = len(json.dumps(summarize_arrays(price, mileage, region)))
+        print(f"{n:>9} {t_dicts * 1000:>9.1f}ms {t_arrays * 1000:>10.1f}ms "
+              f"{rows_size / 1024:>9.0f}KB {agg_size / 1024:>9.1f}KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Memory and throughput benchmark for the streaming listing export.
+
+Feeds iter_export() a stream of 1000-listing tables (the shape of a live
+scrape) and discards the pieces, recording the traced peak memory and the
+encoding rate per format. Peak memory should stay flat as the export grows.
+
+Usage:
+    python -m benchmarks.bench_export --sizes 1000 100000 500000
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from benchmarks.bench_analytics import synthetic_listings
+from src.export import FORMATS, iter_export
+from src.listing_table import ListingTable
+
+PAGE_SIZE = 1000
+
+
+def measure(fmt: str, n: int, chunk_rows: int):
+    """(peak traced bytes, seconds, output bytes) of exporting n listings."""
+    page = ListingTable.from_records(synthetic_listings(PAGE_SIZE))
+
+    def pages():
+        for start in range(0, n, PAGE_SIZE):
+            yield page if n - start >= PAGE_SIZE else page.take(range(n - start))
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    output = 0
+    for piece in iter_export(pages(), fmt, chunk_rows):
+        output += len(piece)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming listing export")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 500000])
+    parser.add_argument('--formats', nargs='+', default=list(FORMATS), choices=FORMATS)
+    parser.add_argument('--chunk-rows', type=int, default=10_000)
+    args = parser.parse_args()
+
+    print(f"{'format':<8} {'listings':>9} {'peak':>9} {'output':>10} {'rate':>14}")
+    for fmt in args.formats:
+        for n in args.sizes:
+            try:
+                peak, elapsed, output = measure(fmt, n, args.chunk_rows)
+            except ValueError as e:
+                print(f"{fmt:<8} skipped: {e}")
+                break
+            print(f"{fmt:<8} {n:>9} {peak / 2**20:>7.1f}MB {output / 2**20:>8.1f}MB "
+                  f"{n / elapsed:>10.0f}/s")
+
+
+if __name__ == '__main__':
+    main()
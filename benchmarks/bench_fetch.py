@@ -0,0 +1,47 @@
+"""
+Wall-clock benchmark of sequential vs concurrent ``get_listings``.
+
+Runs against the local stub server with a fixed per-request latency and the
+rate limiter and page cache disabled, so the speed-up reflects the worker
+pool alone.
+
+Usage:
+    python -m benchmarks.bench_fetch --pages 20 --latency 0.2
+"""
+
+import argparse
+import time
+
+from benchmarks.corpus import PAGE_SIZE, YEARS
+from benchmarks.stub_server import start_stub_server
+from src import http_client, scraper
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent page fetching")
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency, total=PAGE_SIZE * args.pages)
+    scraper.BASE_URL = server.base_url
+    http_client.set_rate_limit(0)
+    http_client.set_page_cache(None)
+
+    baseline = None
+    for concurrency in args.concurrency:
+        server.request_count = 0
+        start = time.perf_counter()
+        listings = scraper.get_listings('bmw', 'seria-3', *YEARS,
+                                        max_pages=args.pages + 5, concurrency=concurrency)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"concurrency={concurrency:<3} listings={len(listings):<5} "
+              f"requests={server.request_count:<3} time={elapsed:6.2f}s speedup={baseline / elapsed:4.1f}x")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Memory and conversion benchmark for ListingTable.
+
+Compares the retained memory of listing dicts with the columnar
+ListingTable holding the same listings, and times the conversions the
+pipeline relies on (records -> table, table -> pandas, page of records).
+
+Usage:
+    python -m benchmarks.bench_listing_table --sizes 10000 100000
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+from benchmarks.bench_analytics import best_of, synthetic_listings
+from src.listing_table import ListingTable
+
+
+def retained_bytes(build) -> int:
+    """Bytes still allocated after build() returns (its result kept alive)."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the columnar listing table")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'listings':>9} {'dicts':>9} {'table':>9} {'from dicts':>11} {'to pandas':>10} {'50 rows':>8}")
+    for n in args.sizes:
+        listings = synthetic_listings(n)
+        dict_bytes = retained_bytes(lambda: synthetic_listings(n))
+        # The intermediate dicts are freed by the time the table is returned
+        table_bytes = retained_bytes(lambda: ListingTable.from_records(synthetic_listings(n)))
+        table = ListingTable.from_records(listings)
+
+        t_build = best_of(lambda: ListingTable.from_records(listings), args.repeat)
+        t_pandas = best_of(table.to_pandas, args.repeat)
+        t_page = best_of(lambda: table.to_records(range(50)), args.repeat)
+        print(f"{n:>9} {dict_bytes / 2**20:>7.1f}MB {table_bytes / 2**20:>7.1f}MB "
+              f"{t_build * 1000:>9.1f}ms {t_pandas * 1000:>8.2f}ms {t_page * 1000:>6.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
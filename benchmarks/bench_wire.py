@@ -0,0 +1,78 @@
+"""
+Payload size and encode/decode time of the /api/analyze wire formats.
+
+For synthetic result sets, compares row-oriented JSON (stdlib and orjson),
+the columnar JSON layout and Arrow IPC, each raw and gzip/brotli
+compressed, as sent in page-sized batches of 32 listings.
+
+Usage:
+    python -m benchmarks.bench_wire --sizes 1000 10000 100000
+"""
+
+import argparse
+import json
+
+from benchmarks.bench_analytics import best_of, synthetic_listings
+from benchmarks.corpus import PAGE_SIZE
+from src import wire
+from src.listing_table import ListingTable
+
+
+def encode_stream(batches, layout, dumps):
+    """Encode all batches as one /api/analyze body (without compression)."""
+    if layout == 'arrow':
+        encoder = wire.ArrowStreamEncoder()
+        return b''.join(encoder.write(b) for b in batches) + encoder.close()
+    parts = []
+    for page, batch in enumerate(batches, 1):
+        listings = wire.columnar(batch) if layout == 'columnar' else batch.to_records()
+        parts.append(dumps({'type': 'batch', 'page': page, 'listings': listings}) + b'\n')
+    return b''.join(parts)
+
+
+def decode_stream(body, layout, loads):
+    if layout == 'arrow':
+        return wire.pa.ipc.open_stream(body).read_all()
+    return [loads(line) for line in body.splitlines()]
+
+
+def compressed_size(body, encoding):
+    """Size when compressed the way the server streams it (flushed per message)."""
+    compressor = wire.StreamCompressor(encoding)
+    lines = body.splitlines(keepends=True) if encoding != 'identity' else [body]
+    return sum(len(compressor.compress(line)) for line in lines) + len(compressor.finish())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark analysis wire formats")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    stdlib_dumps = lambda obj: json.dumps(obj).encode('utf-8')
+    variants = [('rows', 'json', stdlib_dumps, json.loads)]
+    if wire.orjson is not None:
+        variants.append(('rows', 'orjson', wire.dumps, wire.orjson.loads))
+    variants.append(('columnar', 'json', stdlib_dumps, json.loads))
+    if wire.orjson is not None:
+        variants.append(('columnar', 'orjson', wire.dumps, wire.orjson.loads))
+    if wire.pa is not None:
+        variants.append(('arrow', 'ipc', None, None))
+    encodings = ['identity', 'gzip'] + (['br'] if wire.brotli is not None else [])
+
+    header = f"{'listings':>9} {'layout':>9} {'encoder':>7} {'encode':>9} {'decode':>9}"
+    header += ''.join(f" {name:>9}" for name in encodings)
+    print(header)
+    for n in args.sizes:
+        table = ListingTable.from_records(synthetic_listings(n))
+        batches = [table.take(range(i, min(i + PAGE_SIZE, n))) for i in range(0, n, PAGE_SIZE)]
+        for layout, encoder, dumps, loads in variants:
+            body = encode_stream(batches, layout, dumps)
+            t_encode = best_of(lambda: encode_stream(batches, layout, dumps), args.repeat)
+            t_decode = best_of(lambda: decode_stream(body, layout, loads), args.repeat)
+            sizes = ''.join(f" {compressed_size(body, e) / 1024:>7.0f}KB" for e in encodings)
+            print(f"{n:>9} {layout:>9} {encoder:>7} {t_encode * 1000:>7.1f}ms {t_decode * 1000:>7.1f}ms{sizes}")
+
+
+if __name__ == '__main__':
+    main()
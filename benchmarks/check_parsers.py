@@ -0,0 +1,80 @@
+"""
+Parity check and timing for the listing parser engines.
+
+Every engine in ``scraper.PAGE_PARSERS`` must return exactly the same
+dictionaries as the BeautifulSoup reference on the saved fixture corpus,
+and ``parse_listings_page`` through a parse memo, cold and warm, must match
+the engine's full-page parse. Exits non-zero on any mismatch.
+
+Usage:
+    python -m benchmarks.check_parsers --repeat 20
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+from src import scraper
+from src.parse_memo import ParseMemo
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+SCRAPE_DATE = "2024-01-01 12:00:00"
+YEAR_FROM = 2015
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check parser engines agree and time them")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(FIXTURES_DIR, 'listings_*.html')))
+    corpus = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            corpus[os.path.basename(path)] = f.read()
+
+    reference = scraper.PAGE_PARSERS['bs4']
+    failures = 0
+    for engine, page_parser in scraper.PAGE_PARSERS.items():
+        for name, content in corpus.items():
+            expected = reference(content, SCRAPE_DATE, YEAR_FROM)
+            actual = page_parser(content, SCRAPE_DATE, YEAR_FROM)
+            if actual != expected:
+                failures += 1
+                print(f"MISMATCH engine={engine} fixture={name}")
+                for exp, act in zip(expected, actual):
+                    if exp != act:
+                        print(f"  expected: {exp}\n  actual:   {act}")
+                        break
+                if len(expected) != len(actual):
+                    print(f"  expected {len(expected)} listings, got {len(actual)}")
+
+            memo = ParseMemo()
+            for state in ('cold', 'warm'):
+                memoized = scraper.parse_listings_page(content, YEAR_FROM, engine, memo=memo)
+                if _without_date(memoized) != _without_date(actual):
+                    failures += 1
+                    print(f"MISMATCH engine={engine} fixture={name} memo={state}")
+
+        start = time.perf_counter()
+        count = 0
+        for _ in range(args.repeat):
+            for content in corpus.values():
+                count += len(page_parser(content, SCRAPE_DATE, YEAR_FROM))
+        elapsed = time.perf_counter() - start
+        print(f"{engine:<6} {count / elapsed:10.0f} listings/s  ({elapsed / args.repeat * 1000:.1f} ms per corpus pass)")
+
+    if failures:
+        print(f"{failures} mismatching fixture(s)")
+        sys.exit(1)
+    print(f"All engines match on {len(corpus)} fixtures")
+
+
+def _without_date(listings):
+    return [{k: v for k, v in listing.items() if k != 'scrape_date'} for listing in listings]
+
+
+if __name__ == '__main__':
+    main()
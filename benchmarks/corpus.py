@@ -0,0 +1,326 @@
+"""
+Deterministic synthetic Otomoto pages.
+
+Renders listing pages with the same markup shape the scraper expects
+(``article[data-id]`` cards with ``dd[data-parameter]`` fields), category
+and detail pages carrying ``__NEXT_DATA__``, so the scraper can be
+exercised offline against the stub server.
+
+Regenerate the saved fixture corpus with ``python -m benchmarks.corpus``.
+"""
+
+import heapq
+import json
+import os
+import random
+from html import escape
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+PAGE_SIZE = 32
+# Production years of synthetic listings; listing ids start at LISTING_ID_BASE
+YEARS = (2012, 2024)
+LISTING_ID_BASE = 6100000000
+
+FUELS = ['Benzyna', 'Diesel', 'Hybryda', 'Elektryczny', 'Benzyna+LPG']
+GEARBOXES = ['Manualna', 'Automatyczna']
+DRIVES = ['Na przednie koła', 'Na tylne koła', '4x4 (stały)', '4x4 (dołączany automatycznie)']
+CITIES = [
+    ('Warszawa', 'Mazowieckie'), ('Kraków', 'Małopolskie'), ('Poznań', 'Wielkopolskie'),
+    ('Gdańsk', 'Pomorskie'), ('Wrocław', 'Dolnośląskie'), ('Katowice', 'Śląskie'),
+    ('Łódź', 'Łódzkie'), ('Lublin', 'Lubelskie'),
+]
+
+
+def _format_thousands(value: int) -> str:
+    return f"{value:,}".replace(',', ' ')
+
+
+def _core_fields(rng: random.Random) -> Tuple[int, int, int]:
+    year = rng.randint(*YEARS)
+    mileage = rng.randint(5, 300) * 1000 + rng.randint(0, 999)
+    price = rng.randint(30, 250) * 1000 + rng.choice([0, 500, 900])
+    return year, mileage, price
+
+
+def listing_year_price(listing_id: int, seed: int = 0) -> Tuple[int, int]:
+    """Production year and price of a listing, as rendered by render_article."""
+    year, _, price = _core_fields(random.Random(listing_id * 7919 + seed))
+    return year, price
+
+
+def render_article(listing_id: int, make: str = 'bmw', model: str = 'seria-3', seed: int = 0) -> str:
+    """Render a single listing card."""
+    rng = random.Random(listing_id * 7919 + seed)
+    year, mileage, price = _core_fields(rng)
+    fuel = rng.choice(FUELS)
+    gearbox = rng.choice(GEARBOXES)
+    drive = rng.choice(DRIVES)
+    city, region = rng.choice(CITIES)
+    title = f"{make.upper()} {model.replace('-', ' ').title()} {rng.choice(['320d', '318i', '330e', 'M340i'])}"
+    link = f"https://www.otomoto.pl/osobowe/oferta/{make}-{model}-ID{listing_id:x}.html"
+
+    features = []
+    if rng.random() < 0.6:
+        features.append('<li class="parameter-feature-item">Bezwypadkowy</li>')
+    if rng.random() < 0.3:
+        features.append('<li class="parameter-feature-item">Pierwszy właściciel</li>')
+
+    return (
+        f'<article data-id="{listing_id}" class="ooa-yca59n e1oqyyyi0" data-media-size="small">'
+        f'<section class="ooa-10gfd0w">'
+        f'<div class="ooa-ljs66p"><img src="https://ireland.apollo.olxcdn.com/{listing_id}.jpg" alt=""></div>'
+        f'<div class="ooa-1qo9a0p">'
+        f'<h2 class="e1oqyyyi9"><a href="{link}" target="_self">{escape(title)}</a></h2>'
+        f'<p class="e1oqyyyi10">1995 cm3 • 190 KM • {rng.choice(["M Sport", "Luxury Line", "Sport Line"])}</p>'
+        f'</div>'
+        f'<div class="ooa-d3dp2q">'
+        f'<dl class="ooa-1uwk9ii">'
+        f'<dt>Przebieg</dt><dd data-parameter="mileage">{_format_thousands(mileage)} km</dd>'
+        f'<dt>Rodzaj paliwa</dt><dd data-parameter="fuel_type">{fuel}</dd>'
+        f'<dt>Skrzynia biegów</dt><dd data-parameter="gearbox">{gearbox}</dd>'
+        f'<dt>Napęd</dt><dd data-parameter="drive">{escape(drive)}</dd>'
+        f'<dt>Rok produkcji</dt><dd data-parameter="year">{year}</dd>'
+        f'</dl>'
+        f'<ul class="ooa-1k7nwcr">{"".join(features)}</ul>'
+        f'<dl class="ooa-1o0axny"><dd><p class="ooa-gmxnzj">{city} ({region})</p>'
+        f'<p class="ooa-gmxnzj">Dodane {rng.randint(1, 30)} dni temu</p></dd></dl>'
+        f'</div>'
+        f'<div class="ooa-2p9dfw"><h3 class="e1oqyyyi16">{_format_thousands(price)}</h3>'
+        f'<p class="e1oqyyyi17">PLN</p></div>'
+        f'</section>'
+        f'</article>'
+    )
+
+
+def render_listing_page(
+    page: int,
+    total: int = PAGE_SIZE * 10,
+    make: str = 'bmw',
+    model: str = 'seria-3',
+    seed: int = 0
+) -> str:
+    """Render result page ``page`` (1-based) of a search with ``total`` listings."""
+    start = (page - 1) * PAGE_SIZE
+    ids = range(start, min(start + PAGE_SIZE, total))
+    articles: List[str] = [render_article(LISTING_ID_BASE + i, make, model, seed) for i in ids]
+    return _render_results(articles, make, model)
+
+
+def render_search_page(
+    listing_ids: Sequence[int],
+    page: int,
+    make: str = 'bmw',
+    model: str = 'seria-3',
+    seed: int = 0,
+    page_limit: Optional[int] = None,
+    promoted: int = 0
+) -> str:
+    """
+    Render result page ``page`` of a search matching ``listing_ids``.
+
+    Like Otomoto, the page's __NEXT_DATA__ reports the result count
+    (``advertSearch.totalCount`` and ``pageInfo``), and pages past
+    ``page_limit`` come back empty even if the search has more listings.
+    The ``promoted`` oldest listings (lowest ids) of the search are
+    repeated as promoted cards at the top of every non-empty page, whatever
+    the sort.
+    """
+    start = (page - 1) * PAGE_SIZE
+    served = [] if page_limit is not None and page > page_limit else listing_ids[start:start + PAGE_SIZE]
+    shown = heapq.nsmallest(promoted, listing_ids) + list(served) if served else []
+    articles = [render_article(listing_id, make, model, seed) for listing_id in shown]
+    advert_search = {'__typename': 'AdvertSearchOutput', 'totalCount': len(listing_ids),
+                     'pageInfo': {'__typename': 'PageInfo', 'pageSize': PAGE_SIZE, 'currentOffset': start},
+                     'edges': [{'node': {'id': str(listing_id)}} for listing_id in served]}
+    next_data = {'props': {'pageProps': {'urqlState': {
+        '5678901234': {'data': json.dumps({'advertSearch': advert_search})},
+    }}}, 'page': '/[category]/[[...slug]]', 'query': {}}
+    return _render_results(articles, make, model, next_data)
+
+
+def _render_results(articles: List[str], make: str, model: str, next_data: Optional[Dict[str, Any]] = None) -> str:
+    script = ''
+    if next_data is not None:
+        script = f'<script id="__NEXT_DATA__" type="application/json">{json.dumps(next_data)}</script>'
+    return (
+        '<!DOCTYPE html><html lang="pl"><head><meta charset="utf-8">'
+        f'<title>{make} {model} - otomoto.pl</title></head><body>'
+        '<div id="__next"><main><div data-testid="search-results">'
+        + ''.join(articles) +
+        '</div></main></div>' + script + '</body></html>'
+    )
+
+
+def render_detail_page(listing_id: int, seed: int = 0) -> str:
+    """
+    Render a listing's detail page.
+
+    Like Otomoto, the authoritative parameters sit in the ``parametersDict``
+    of the ``__NEXT_DATA__`` advert (yes/no flags only when set) and the
+    region in the seller location. Flags are drawn independently of the
+    card's badges, as list-view badges are incomplete.
+    """
+    rng = random.Random(f"detail/{listing_id}/{seed}")
+    year, mileage, price = _core_fields(random.Random(listing_id * 7919 + seed))
+    city, region = rng.choice(CITIES)
+
+    def parameter(label: str, value: str, value_label: str) -> Dict[str, Any]:
+        return {'label': label, 'values': [{'value': value, 'label': value_label}]}
+
+    parameters = {
+        'year': parameter('Rok produkcji', str(year), str(year)),
+        'mileage': parameter('Przebieg', str(mileage), f"{_format_thousands(mileage)} km"),
+        'fuel_type': parameter('Rodzaj paliwa', 'diesel', 'Diesel'),
+    }
+    if rng.random() < 0.7:
+        parameters['no_accident'] = parameter('Bezwypadkowy', '1', 'Tak')
+    if rng.random() < 0.4:
+        parameters['original_owner'] = parameter('Pierwszy właściciel', '1', 'Tak')
+    advert = {
+        'id': str(listing_id),
+        'price': {'value': str(price), 'currency': 'PLN'},
+        'parametersDict': parameters,
+        'seller': {'type': 'PRIVATE', 'location': {
+            'city': {'name': city}, 'region': {'name': region}, 'address': f"{city}, {region}",
+        }},
+        'description': '<p>' + ' '.join(['Zadbany samochód, serwisowany w ASO.'] * 40) + '</p>',
+    }
+    next_data = {'props': {'pageProps': {'advert': advert}}, 'page': '/oferta/[slug]', 'query': {}}
+    return (
+        '<!DOCTYPE html><html lang="pl"><head><meta charset="utf-8"><title>otomoto.pl</title></head>'
+        '<body><div id="__next"></div>'
+        f'<script id="__NEXT_DATA__" type="application/json">{json.dumps(next_data)}</script>'
+        '</body></html>'
+    )
+
+
+MAKES = {
+    'audi': ('Audi', ['a3', 'a4', 'a6', 'q5']),
+    'bmw': ('BMW', ['seria-1', 'seria-3', 'seria-5', 'x3', 'x5']),
+    'kia': ('Kia', ['ceed', 'sportage']),
+    'toyota': ('Toyota', ['corolla', 'rav4', 'yaris']),
+    'volkswagen': ('Volkswagen', ['golf', 'passat', 'tiguan']),
+}
+GENERATIONS = ['gen-i', 'gen-ii', 'gen-iii', 'gen-iv']
+
+
+def _filter_value(value_id: str, name: str, rng: random.Random) -> Dict[str, Any]:
+    return {'__typename': 'AdvertSearchFilterValue', 'id': value_id, 'name': name,
+            'counter': rng.randint(10, 20000)}
+
+
+def render_taxonomy_page(make: Optional[str] = None, model: Optional[str] = None, seed: int = 0) -> str:
+    """
+    Render a category page whose __NEXT_DATA__ carries urqlState filters.
+
+    Mirrors Otomoto's layout: each urqlState entry holds a JSON-encoded
+    ``data`` string; filters are AdvertSearchFilter objects, model and
+    generation filters carry make/model ``conditions``, and generations are
+    grouped in AdvertSearchFilterValuesGroup entries.
+    """
+    rng = random.Random(f"{make}/{model}/{seed}")
+    filters: List[Dict[str, Any]] = [
+        {'__typename': 'AdvertSearchFilter', 'id': 'filter_enum_make',
+         'values': [_filter_value(slug, name, rng) for slug, (name, _) in MAKES.items()]},
+        {'__typename': 'AdvertSearchFilter', 'id': 'filter_enum_fuel_type',
+         'values': [_filter_value(k, v, rng) for k, v in
+                    [('petrol', 'Benzyna'), ('diesel', 'Diesel'), ('hybrid', 'Hybryda'), ('electric', 'Elektryczny')]]},
+        {'__typename': 'AdvertSearchFilter', 'id': 'filter_enum_gearbox',
+         'values': [_filter_value('manual', 'Manualna', rng), _filter_value('automatic', 'Automatyczna', rng)]},
+    ]
+    if make in MAKES:
+        name, models = MAKES[make]
+        filters.append({
+            '__typename': 'AdvertSearchFilter', 'id': 'filter_enum_model',
+            'conditions': [{'filterId': 'filter_enum_make', 'value': make}],
+            'values': [_filter_value(m, f"{name} {m.replace('-', ' ').title()}", rng) for m in models],
+        })
+        if model in models:
+            filters.append({
+                '__typename': 'AdvertSearchFilter', 'id': 'filter_enum_generation',
+                'conditions': [{'filterId': 'filter_enum_make', 'value': make},
+                               {'filterId': 'filter_enum_model', 'value': model}],
+                'values': [{'__typename': 'AdvertSearchFilterValuesGroup', 'values': [
+                    _filter_value(f"gen-{model}-{g}", g.upper(), rng) for g in GENERATIONS[:2]]},
+                    {'__typename': 'AdvertSearchFilterValuesGroup', 'values': [
+                        _filter_value(f"gen-{model}-{g}", g.upper(), rng) for g in GENERATIONS[2:]]}],
+            })
+
+    # Spread filters over several urqlState entries, with unrelated payload
+    # noise and an open-for-input filter state referencing a filter by filterId
+    urql_state = {
+        '1234567890': {'data': json.dumps({'advertSearch': {'__typename': 'AdvertSearchOutput',
+                                                           'filters': filters[:2]}})},
+        '2345678901': {'data': json.dumps({'filtersState': [
+            {'__typename': 'OpenForInputFilterState', 'filterId': 'filter_float_price', 'values': []}
+        ], 'filters': filters[2:]})},
+        '3456789012': {'data': json.dumps({'promotedAds': [{'id': str(i), 'title': f"Ad {i}",
+                                                             'parameters': [{'key': 'year', 'value': '2019'}]}
+                                                            for i in range(50)]})},
+        '4567890123': {'error': None},
+    }
+    next_data = {'props': {'pageProps': {'urqlState': urql_state, 'slots': {}}},
+                 'page': '/[category]/[[...slug]]', 'query': {}}
+    return (
+        '<!DOCTYPE html><html lang="pl"><head><meta charset="utf-8"><title>otomoto.pl</title></head>'
+        '<body><div id="__next"></div>'
+        f'<script id="__NEXT_DATA__" type="application/json">{json.dumps(next_data)}</script>'
+        '</body></html>'
+    )
+
+
+def render_edge_case_page() -> str:
+    """Render a page of unusual cards used to check parser engines agree."""
+    articles = [
+        # Bare card: no parameters, no region, no price
+        '<article data-id="7000000001"><h2><a href="/oferta/a">Audi A4</a></h2></article>',
+        # Authoritative flags exposed as data-parameter, EUR price split across tags
+        '<article data-id="7000000002"><h2 class="x"> <a href="/oferta/b"> Škoda &amp; Co\n Octavia </a></h2>'
+        '<dl><dd data-parameter="no_accident">Tak</dd><dd data-parameter="original_owner">Tak</dd>'
+        '<dd data-parameter="mileage">\n 98&nbsp;000 km </dd><dd data-parameter="mileage">1 km</dd></dl>'
+        '<h3><span>12 500</span> <span>EUR</span></h3><h3>1 PLN</h3></article>',
+        # Long parenthesised description before the real location, comments in text
+        '<article data-id="7000000003"><h2><a href="/oferta/c">VW <!-- promo -->Golf</a></h2>'
+        '<p>Sprzedam zadbany samochód, serwisowany w ASO, garażowany (bez wkładu finansowego)</p>'
+        '<div><span><b>Gdynia</b> (Pomorskie)</span></div><p>Sopot (Pomorskie)</p>'
+        '<ul><li class="parameter-feature-item big"><span>Bezwypadkowy</span></li>'
+        '<li class="parameter-feature-item">Pierwszy właściciel <em>!</em></li></ul></article>',
+        # No title link: both engines skip it
+        '<article data-id="7000000004"><h2>Brak linku</h2><h3>10 000</h3></article>',
+        # Article without data-id is not a listing
+        '<article><h2><a href="/oferta/e">Ignored</a></h2></article>',
+        # Unparseable numbers fall back to zero
+        '<article data-id="7000000006"><h2><a href="/oferta/f">Fiat 126p</a></h2>'
+        '<h3>Zapytaj o cenę</h3><dd data-parameter="mileage">brak</dd><dd data-parameter="year">1999</dd>'
+        '<li class="parameter-feature-item"> Bezwypadkowy</li></article>',
+    ]
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"></head><body>'
+        + ''.join(articles) +
+        '</body></html>'
+    )
+
+
+def write_fixtures(directory: str) -> None:
+    """Save the fixture corpus used by the parser checks and benchmarks."""
+    os.makedirs(directory, exist_ok=True)
+    pages = {
+        'listings_bmw_seria-3_p1.html': render_listing_page(1, make='bmw', model='seria-3'),
+        'listings_bmw_seria-3_p2.html': render_listing_page(2, make='bmw', model='seria-3', seed=1),
+        'listings_kia_sportage_last.html': render_listing_page(3, total=PAGE_SIZE * 2 + 5,
+                                                               make='kia', model='sportage'),
+        'listings_empty.html': render_listing_page(99),
+        'listings_edge_cases.html': render_edge_case_page(),
+        'detail_6100000000.html': render_detail_page(LISTING_ID_BASE),
+        'detail_6100000001.html': render_detail_page(LISTING_ID_BASE + 1),
+        'taxonomy_root.html': render_taxonomy_page(),
+        'taxonomy_bmw.html': render_taxonomy_page('bmw'),
+        'taxonomy_bmw_seria-3.html': render_taxonomy_page('bmw', 'seria-3'),
+    }
+    for name, html in pages.items():
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            f.write(html)
+
+
+if __name__ == '__main__':
+    write_fixtures(os.path.join(os.path.dirname(__file__), 'fixtures'))
@@ -0,0 +1,192 @@
+"""
+Concurrent-analysis load test of the Flask app vs the ASGI service mode.
+
+Starts the stub server and each app in its own process (rate limiter and
+page cache off, a throwaway database), then fires N distinct streaming
+/api/analyze requests at once for every concurrency level and reports how
+many completed, their latency, the wall time and the server's peak thread
+count and memory. The Flask app gets as many job workers as there are
+requests and the in-flight request bound is lifted, so neither side is
+capped by configuration.
+
+Usage:
+    python -m benchmarks.load_test --levels 50 100 200 --latency 2 --pages 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.corpus import PAGE_SIZE, YEARS
+
+SERVERS = ('flask', 'asgi')
+
+
+def serve(kind: str, port: int) -> None:
+    """Run one of the apps in this process (the --serve mode)."""
+    if kind == 'flask':
+        import logging
+        from werkzeug.serving import make_server
+        from app import app
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', port, app, threaded=True)
+        server.serve_forever()
+    else:
+        import uvicorn
+        uvicorn.run('asgi_app:app', host='127.0.0.1', port=port, log_level='warning', backlog=2048)
+
+
+def start_process(args: List[str], env: Dict[str, str], port: int) -> subprocess.Popen:
+    """Start a Python subprocess and wait until it accepts connections on port."""
+    process = subprocess.Popen([sys.executable] + args, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"{' '.join(args)} exited with {process.returncode}")
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{' '.join(args)} did not start listening on port {port}")
+
+
+def process_status(pid: int) -> Dict[str, int]:
+    """Threads and resident memory (KiB) of a process, from /proc (empty elsewhere)."""
+    status = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('Threads', 'VmRSS', 'VmHWM'):
+                    status[name] = int(value.split()[0])
+    except OSError:
+        pass
+    return status
+
+
+async def analyze(client: httpx.AsyncClient, url: str, model: str) -> Dict[str, Any]:
+    """Stream one analysis to the end; return its outcome and duration."""
+    body = {'make': 'bmw', 'model': model, 'year_from': YEARS[0], 'year_to': YEARS[1],
+            'max_pages': 100, 'incremental': False}
+    start = time.perf_counter()
+    try:
+        async with client.stream('POST', f"{url}/api/analyze", json=body) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return {'ok': False, 'error': f"HTTP {response.status_code}", 'seconds': time.perf_counter() - start}
+            last = None
+            async for line in response.aiter_lines():
+                if line:
+                    last = json.loads(line)
+    except httpx.HTTPError as e:
+        return {'ok': False, 'error': type(e).__name__, 'seconds': time.perf_counter() - start}
+    ok = last is not None and last['type'] == 'complete'
+    return {'ok': ok, 'error': None if ok else (last or {}).get('message', 'no messages'),
+            'count': last['data']['count'] if ok else 0, 'seconds': time.perf_counter() - start}
+
+
+async def run_level(url: str, pid: int, level: int, run: int, timeout: float) -> Dict[str, Any]:
+    """Fire level concurrent analyses (distinct searches) and gather the results."""
+    peak = {'Threads': 0, 'VmRSS': 0}
+
+    async def sample():
+        while True:
+            status = process_status(pid)
+            for name in peak:
+                peak[name] = max(peak[name], status.get(name, 0))
+            await asyncio.sleep(0.05)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        sampler = asyncio.create_task(sample())
+        start = time.perf_counter()
+        results = await asyncio.gather(*[analyze(client, url, f"model-{run}-{i}") for i in range(level)])
+        wall = time.perf_counter() - start
+        sampler.cancel()
+
+    seconds = sorted(r['seconds'] for r in results if r['ok'])
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r['ok']:
+            errors[r['error']] = errors.get(r['error'], 0) + 1
+    return {
+        'level': level,
+        'ok': len(seconds),
+        'errors': errors,
+        'p50': statistics.median(seconds) if seconds else None,
+        'p95': seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))] if seconds else None,
+        'wall': wall,
+        'threads': peak['Threads'],
+        'rss_mb': peak['VmRSS'] / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Flask and ASGI apps with concurrent analyses")
+    parser.add_argument('--serve', choices=SERVERS, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--servers', nargs='+', choices=SERVERS, default=list(SERVERS))
+    parser.add_argument('--levels', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--latency', type=float, default=0.5, help='Stub seconds of delay per request')
+    parser.add_argument('--pages', type=int, default=8, help='Result pages per search')
+    parser.add_argument('--timeout', type=float, default=300.0, help='Client timeout per analysis')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    stub_port, app_port = args.port, args.port + 1
+    data_dir = tempfile.mkdtemp(prefix='otomoto-load-')
+    stub = start_process(['-m', 'benchmarks.stub_server', '--port', str(stub_port), '--latency', str(args.latency),
+                          '--total', str(PAGE_SIZE * args.pages)], dict(os.environ), stub_port)
+    try:
+        print(f"Stub: {args.pages} pages per search, {args.latency:g}s per request")
+        print(f"{'server':<6} {'level':>5} {'ok':>5} {'p50':>7} {'p95':>7} {'wall':>7} "
+              f"{'threads':>7} {'rss':>8}  errors")
+        for kind in args.servers:
+            env = dict(
+                os.environ,
+                OTOMOTO_BASE_URL=f"http://127.0.0.1:{stub_port}",
+                OTOMOTO_RPS='0',
+                OTOMOTO_MAX_IN_FLIGHT='0',
+                OTOMOTO_CACHE_MODE='off',
+                OTOMOTO_DB_PATH=os.path.join(data_dir, f"{kind}.db"),
+                OTOMOTO_TAXONOMY_PATH=os.path.join(data_dir, f"{kind}-taxonomy.json"),
+                OTOMOTO_JOB_WORKERS=str(max(args.levels)),
+                OTOMOTO_JOB_QUEUE=str(max(args.levels)),
+            )
+            server = start_process(['-m', 'benchmarks.load_test', '--serve', kind, '--port', str(app_port)],
+                                   env, app_port)
+            try:
+                for run, level in enumerate(args.levels):
+                    r = asyncio.run(run_level(f"http://127.0.0.1:{app_port}", server.pid, level, run, args.timeout))
+                    print(f"{kind:<6} {r['level']:>5} {r['ok']:>5} {_seconds(r['p50'])} {_seconds(r['p95'])} "
+                          f"{_seconds(r['wall'])} {r['threads']:>7} {r['rss_mb']:>6.0f}MB  "
+                          f"{', '.join(f'{e}: {n}' for e, n in r['errors'].items()) or '-'}")
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+def _seconds(value: Optional[float]) -> str:
+    return f"{value:6.2f}s" if value is not None else f"{'-':>7}"
+
+
+if __name__ == '__main__':
+    main()
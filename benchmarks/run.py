@@ -0,0 +1,519 @@
+"""
+Offline benchmark suite with regression tracking.
+
+Micro benchmarks time the hot functions on the fixture corpus (listing
+parsers, page parsing through a warm parse memo, ListingTable
+construction, ``_find_filters_recursive`` and the one-pass taxonomy
+extraction), detail page parsing and fair-price fitting on synthetic
+listings. Macro benchmarks run the real pipeline against the local stub
+server: a full ``get_listings`` scrape (also repeated over promoted cards,
+with injected 429/5xx responses, under per-client throttling, sharded
+past the site page limit, and on the asyncio core), cold detail-page
+enrichment, cold make/model/generation lookups, a poll of 50 saved searches
+and the ``/api/analyze`` stream through the Flask test client (also
+answered from the result cache).
+
+Every run is saved to ``benchmarks/results/<timestamp>.json`` and compared
+with ``benchmarks/results/baseline.json``; benchmarks whose fastest sample
+got slower than the baseline's by more than ``--threshold`` are flagged and
+make the command exit non-zero. The fastest sample is compared rather than
+the median because it is the least disturbed by other load on the machine.
+
+Usage:
+    python -m benchmarks.run                     # run everything, compare to baseline
+    python -m benchmarks.run --kind micro -k parse
+    python -m benchmarks.run --save-baseline     # accept this run as the new baseline
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.bench_analytics import synthetic_listings
+from benchmarks.corpus import PAGE_SIZE, YEARS
+from benchmarks.stub_server import start_stub_server
+from src import enrichment, http_client, pricing, result_cache, scraper, taxonomy, throttle, watcher
+from src.listing_table import ListingTable
+from src.metrics import LISTINGS_DEDUPLICATED
+from src.parse_memo import ParseMemo
+from src.rollups import RollupStore, set_rollups
+from src.store import ListingStore, set_store
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, 'baseline.json')
+DEFAULT_THRESHOLD = 0.2
+SCRAPE_DATE = "2024-01-01 12:00:00"
+YEAR_FROM = 2015
+
+# A benchmark prepares its inputs and returns (fn, number): fn is timed over
+# `number` calls per sample and may return counters (listings, requests...)
+Benchmark = Callable[[], Tuple[Callable[[], Optional[Dict[str, Any]]], int]]
+BENCHMARKS: Dict[str, Tuple[str, Benchmark]] = {}
+
+
+def benchmark(name: str, kind: str):
+    """Register a benchmark function under name ('micro' or 'macro')."""
+    def register(fn: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = (kind, fn)
+        return fn
+    return register
+
+
+def load_fixtures(pattern: str) -> Dict[str, bytes]:
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, pattern))):
+        with open(path, 'rb') as f:
+            corpus[os.path.basename(path)] = f.read()
+    return corpus
+
+
+def isolate(base_url: Optional[str] = None) -> None:
+    """Point the pipeline at the stub and give it fresh in-memory state."""
+    if base_url is not None:
+        scraper.BASE_URL = base_url
+    http_client.set_rate_limit(0)
+    http_client.set_page_cache(None)
+    throttle.controller.reset()
+    set_store(ListingStore(':memory:'))
+    set_rollups(RollupStore(':memory:'))
+    enrichment.set_detail_store(enrichment.DetailStore(':memory:'))
+    taxonomy.set_taxonomy_index(taxonomy.TaxonomyIndex(path=None))
+    scraper._metadata_cache.invalidate()
+    if scraper._parse_memo is not None:
+        scraper._parse_memo.clear()
+    result_cache.set_result_cache(result_cache.ResultCache(':memory:'))
+    watcher.set_watch_store(watcher.WatchStore(':memory:'))
+
+
+# -- Micro benchmarks ------------------------------------------------------
+
+def _parser_benchmark(engine: str) -> Benchmark:
+    def setup():
+        pages = list(load_fixtures('listings_*.html').values())
+        page_parser = scraper.PAGE_PARSERS[engine]
+
+        def run():
+            count = 0
+            for content in pages:
+                count += len(page_parser(content, SCRAPE_DATE, YEAR_FROM))
+            return {'listings': count}
+        return run, 5 if engine == 'bs4' else 50
+    return setup
+
+
+for _engine in scraper.PAGE_PARSERS:
+    benchmark(f"parse_{_engine}", 'micro')(_parser_benchmark(_engine))
+
+
+@benchmark('parse_page_memo_warm', 'micro')
+def bench_parse_memo_warm():
+    # A repeat sweep: every card of every page is already in the memo
+    pages = list(load_fixtures('listings_*.html').values())
+    memo = ParseMemo()
+    for content in pages:
+        scraper.parse_listings_page(content, YEAR_FROM, memo=memo)
+
+    def run():
+        count = 0
+        for content in pages:
+            count += len(scraper.parse_listings_page(content, YEAR_FROM, memo=memo))
+        return {'listings': count}
+    return run, 50
+
+
+@benchmark('listing_table_from_records', 'micro')
+def bench_listing_table():
+    parsed = [scraper.parse_listings_page(content, YEAR_FROM, 'bs4')
+              for content in load_fixtures('listings_*.html').values()]
+
+    def run():
+        for listings in parsed:
+            ListingTable.from_records(listings)
+    return run, 30
+
+
+@benchmark('find_filters_recursive', 'micro')
+def bench_find_filters():
+    # What the old per-filter lookup did: walk every decoded urqlState
+    # payload once per filter id
+    payloads = []
+    for content in load_fixtures('taxonomy_*.html').values():
+        next_data = taxonomy.extract_next_data(content)
+        urql_state = next_data['props']['pageProps']['urqlState']
+        payloads.extend(json.loads(v['data']) for v in urql_state.values() if isinstance(v.get('data'), str))
+    filter_ids = (taxonomy.MAKE_FILTER, taxonomy.MODEL_FILTER, taxonomy.GENERATION_FILTER)
+
+    def run():
+        return {'filters': sum(len(scraper._find_filters_recursive(payloads, f)) for f in filter_ids)}
+    return run, 200
+
+
+@benchmark('taxonomy_extract', 'micro')
+def bench_taxonomy_extract():
+    pages = [(content, name) for name, content in load_fixtures('taxonomy_*.html').items()]
+    scopes = {'taxonomy_root.html': (None, None), 'taxonomy_bmw.html': ('bmw', None),
+              'taxonomy_bmw_seria-3.html': ('bmw', 'seria-3')}
+
+    def run():
+        return {'filters': sum(len(taxonomy.extract_page_taxonomy(content, *scopes.get(name, (None, None))))
+                               for content, name in pages)}
+    return run, 200
+
+
+@benchmark('parse_detail_page', 'micro')
+def bench_parse_detail_page():
+    pages = list(load_fixtures('detail_*.html').values())
+
+    def run():
+        return {'details': sum(enrichment.parse_detail_page(content) is not None for content in pages)}
+    return run, 200
+
+
+@benchmark('price_model_fit_score', 'micro')
+def bench_price_model():
+    table = ListingTable.from_records(synthetic_listings(20000))
+
+    def run():
+        model = pricing.fit_price_model(table)
+        return {'outliers': int(model.score(table)['outlier'].sum())}
+    return run, 10
+
+
+# -- Macro benchmarks ------------------------------------------------------
+
+MACRO_PAGES = 10
+MACRO_LATENCY = 0.02
+
+
+def _get_listings_benchmark(error_rate: float) -> Benchmark:
+    def setup():
+        server = start_stub_server(latency=MACRO_LATENCY, total=PAGE_SIZE * MACRO_PAGES,
+                                   error_rate=error_rate, seed=1)
+
+        def run():
+            isolate(server.base_url)
+            server.request_count = server.error_count = 0
+            listings = scraper.get_listings('bmw', 'seria-3', *YEARS, max_pages=MACRO_PAGES + 5)
+            return {'listings': len(listings), 'requests': server.request_count, 'errors': server.error_count}
+        return run, 1
+    return setup
+
+
+benchmark('get_listings', 'macro')(_get_listings_benchmark(0.0))
+benchmark('get_listings_flaky', 'macro')(_get_listings_benchmark(0.1))
+
+
+@benchmark('get_listings_repeat', 'macro')
+def bench_get_listings_repeat():
+    # A second sweep of a search with promoted cards on every page: the
+    # cards come from the parse memo and the repeated ones are dropped
+    server = start_stub_server(latency=MACRO_LATENCY, total=PAGE_SIZE * MACRO_PAGES, promoted=3)
+    isolate(server.base_url)
+    scraper.get_listings('bmw', 'seria-3', *YEARS, max_pages=MACRO_PAGES + 5)
+
+    def run():
+        memo = scraper._parse_memo.stats() if scraper._parse_memo is not None else {'hits': 0}
+        dropped = LISTINGS_DEDUPLICATED.value()
+        listings = scraper.get_listings('bmw', 'seria-3', *YEARS, max_pages=MACRO_PAGES + 5)
+        after = scraper._parse_memo.stats() if scraper._parse_memo is not None else {'hits': 0}
+        return {'listings': len(listings), 'memo_hits': after['hits'] - memo['hits'],
+                'deduplicated': int(LISTINGS_DEDUPLICATED.value() - dropped)}
+    return run, 1
+
+
+@benchmark('get_listings_throttled', 'macro')
+def bench_get_listings_throttled():
+    # Four searches at once pushing 32 pages in flight at a site that takes
+    # 2, below the controller's initial window, so it has to back off
+    total = PAGE_SIZE * MACRO_PAGES * 2
+    models = ('seria-1', 'seria-3', 'seria-5', 'x3')
+    server = start_stub_server(latency=MACRO_LATENCY, total=total, capacity=2, retry_after=0)
+
+    def run():
+        isolate(server.base_url)
+        server.request_count = server.throttled_count = 0
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            counts = list(pool.map(
+                lambda model: len(scraper.get_listings('bmw', model, *YEARS, max_pages=MACRO_PAGES * 3,
+                                                       concurrency=8)),
+                models
+            ))
+        stats = throttle.controller.stats()
+        assert server.throttled_count > 0, "the stub site never answered 429"
+        assert stats['decreases'] > 0, "the controller did not shrink its window on 429s"
+        assert sum(counts) == total * len(models), f"{sum(counts)} of {total * len(models)} listings arrived"
+        return {'listings': sum(counts), 'requests': server.request_count, 'throttled': server.throttled_count,
+                'decreases': stats['decreases'], 'window': round(stats['window'], 1)}
+    return run, 1
+
+
+@benchmark('get_listings_async', 'macro')
+def bench_get_listings_async():
+    from src import async_scraper
+
+    server = start_stub_server(latency=MACRO_LATENCY, total=PAGE_SIZE * MACRO_PAGES)
+
+    def run():
+        isolate(server.base_url)
+        server.request_count = 0
+        listings = asyncio.run(async_scraper.get_listings_async('bmw', 'seria-3', *YEARS, max_pages=MACRO_PAGES + 5))
+        return {'listings': len(listings), 'requests': server.request_count}
+    return run, 1
+
+
+@benchmark('get_listings_sharded', 'macro')
+def bench_get_listings_sharded():
+    # Four times more pages than the (stub) site serves per search
+    page_limit = MACRO_PAGES // 2
+    server = start_stub_server(latency=MACRO_LATENCY, total=PAGE_SIZE * MACRO_PAGES * 2, page_limit=page_limit)
+
+    def run():
+        isolate(server.base_url)
+        server.request_count = 0
+        site_page_limit, scraper.SITE_PAGE_LIMIT = scraper.SITE_PAGE_LIMIT, page_limit
+        try:
+            listings = scraper.get_listings('bmw', 'seria-3', *YEARS, max_pages=MACRO_PAGES * 4)
+        finally:
+            scraper.SITE_PAGE_LIMIT = site_page_limit
+        return {'listings': len(listings), 'requests': server.request_count}
+    return run, 1
+
+
+@benchmark('enrich_listings_cold', 'macro')
+def bench_enrich_listings():
+    server = start_stub_server(latency=MACRO_LATENCY, total=PAGE_SIZE * MACRO_PAGES)
+    isolate(server.base_url)
+    listings = scraper.get_listings('bmw', 'seria-3', *YEARS, max_pages=MACRO_PAGES // 2)
+
+    def run():
+        isolate(server.base_url)
+        server.request_count = 0
+        enrichment_run = enrichment.EnrichmentRun(lambda details: None)
+        enrichment_run.add(listings)
+        return {'details': len(enrichment_run.close()), 'requests': server.request_count}
+    return run, 1
+
+
+@benchmark('metadata_lookup_cold', 'macro')
+def bench_metadata_lookup():
+    server = start_stub_server(latency=MACRO_LATENCY)
+
+    def run():
+        isolate(server.base_url)
+        server.request_count = 0
+        makes = scraper.get_makes()
+        models = scraper.get_models('bmw')
+        generations = scraper.get_generations('bmw', 'seria-3')
+        return {'values': len(makes) + len(models) + len(generations), 'requests': server.request_count}
+    return run, 1
+
+
+@benchmark('watch_poll', 'macro')
+def bench_watch_poll():
+    # 50 saved searches polled after a few listings were posted: about one page each
+    watched = 50
+    server = start_stub_server(latency=MACRO_LATENCY, total=PAGE_SIZE * MACRO_PAGES, promoted=3)
+    isolate(server.base_url)
+    store = watcher.get_watch_store()
+    for i in range(watched):
+        store.add({'make': 'bmw', 'model': f"model-{i}", 'year_from': YEARS[0], 'year_to': YEARS[1]})
+    poller = watcher.Watcher(workers=4)
+    poller.run_due()  # baselines
+
+    def run():
+        server.add_listings(3)
+        server.request_count = 0
+        with ThreadPoolExecutor(max_workers=poller.workers) as pool:
+            polls = list(pool.map(poller.poll, store.searches()))
+        return {'searches': len(polls), 'requests': server.request_count,
+                'entries': sum(len(poll['entries']) for poll in polls)}
+    return run, 1
+
+
+def _analyze_benchmark(headers: Dict[str, str]) -> Benchmark:
+    def setup():
+        import app as flask_app
+
+        server = start_stub_server(latency=MACRO_LATENCY, total=PAGE_SIZE * MACRO_PAGES)
+        client = flask_app.app.test_client()
+        body = {'make': 'bmw', 'model': 'seria-3', 'year_from': YEARS[0], 'year_to': YEARS[1],
+                'max_pages': MACRO_PAGES + 5, 'incremental': False}
+
+        def run():
+            isolate(server.base_url)
+            response = client.post('/api/analyze', json=body, headers=headers)
+            payload = response.get_data()  # drains the stream
+            return {'bytes': len(payload), 'status': response.status_code}
+        return run, 1
+    return setup
+
+
+benchmark('analyze_stream_rows', 'macro')(_analyze_benchmark({}))
+benchmark('analyze_stream_columnar_gzip', 'macro')(_analyze_benchmark(
+    {'Accept': 'application/x-ndjson; layout=columnar', 'Accept-Encoding': 'gzip'}))
+
+
+@benchmark('analyze_stream_cached', 'macro')
+def bench_analyze_cached():
+    # The same search again, answered from the result cache
+    import app as flask_app
+
+    server = start_stub_server(latency=MACRO_LATENCY, total=PAGE_SIZE * MACRO_PAGES)
+    client = flask_app.app.test_client()
+    body = {'make': 'bmw', 'model': 'seria-3', 'year_from': YEARS[0], 'year_to': YEARS[1],
+            'max_pages': MACRO_PAGES + 5}
+    isolate(server.base_url)
+    client.post('/api/analyze', json=body).get_data()
+
+    def run():
+        server.request_count = 0
+        response = client.post('/api/analyze', json=body)
+        payload = response.get_data()
+        return {'bytes': len(payload), 'requests': server.request_count,
+                'hit_ratio': result_cache.get_result_cache().stats()['hit_ratio']}
+    return run, 1
+
+
+# -- Harness ---------------------------------------------------------------
+
+def run_benchmarks(names: List[str], repeat: Dict[str, int]) -> Dict[str, Dict[str, Any]]:
+    """Run the named benchmarks; timings are seconds per call."""
+    results = {}
+    for name in names:
+        kind, setup = BENCHMARKS[name]
+        samples = []
+        counters = None
+        # The pipeline logs with print(); keep that out of the report and the timings
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            fn, number = setup()
+            fn()  # warm-up
+            for _ in range(repeat[kind]):
+                gc.collect()
+                gc.disable()  # as timeit does; collections are noise at this scale
+                try:
+                    start = time.perf_counter()
+                    for _ in range(number):
+                        counters = fn()
+                    samples.append((time.perf_counter() - start) / number)
+                finally:
+                    gc.enable()
+        results[name] = {
+            'kind': kind,
+            'median': statistics.median(samples),
+            'min': min(samples),
+            'samples': len(samples),
+            'number': number,
+            'counters': counters or {},
+        }
+        print(f"  {name:<32} {results[name]['min'] * 1000:>10.3f} ms min "
+              f"{results[name]['median'] * 1000:>10.3f} ms median  {_format_counters(counters)}")
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """Print the comparison with a baseline; return names of regressed benchmarks."""
+    regressions = []
+    print(f"\n{'benchmark':<34} {'baseline':>11} {'current':>11} {'change':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<34} {'-':>11} {result['min'] * 1000:>9.3f}ms {'new':>8}")
+            continue
+        change = result['min'] / base['min'] - 1 if base['min'] else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  faster'
+        print(f"{name:<34} {base['min'] * 1000:>9.3f}ms {result['min'] * 1000:>9.3f}ms {change:>+7.0%}{flag}")
+    return regressions
+
+
+def _format_counters(counters: Optional[Dict[str, Any]]) -> str:
+    return ' '.join(f"{k}={v}" for k, v in (counters or {}).items())
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite")
+    parser.add_argument('--kind', choices=('micro', 'macro', 'all'), default='all')
+    parser.add_argument('-k', dest='pattern', default=None, help='Only benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=None, help='Samples per benchmark (default: 7 micro, 3 macro)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative slowdown flagged as a regression (default: 0.2)')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the baseline')
+    parser.add_argument('--list', action='store_true', help='List benchmarks and exit')
+    args = parser.parse_args()
+
+    names = [name for name, (kind, _) in BENCHMARKS.items()
+             if args.kind in ('all', kind) and (not args.pattern or args.pattern in name)]
+    if args.list:
+        for name in names:
+            print(f"{BENCHMARKS[name][0]:<6} {name}")
+        return
+    repeat = {'micro': args.repeat or 7, 'macro': args.repeat or 3}
+
+    print(f"Running {len(names)} benchmarks")
+    results = run_benchmarks(names, repeat)
+
+    run = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(run, f, indent=2)
+    print(f"\nSaved results to {path}")
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"Comparing with baseline {args.baseline} (revision {baseline.get('revision')})")
+        regressions = compare(results, baseline['results'], args.threshold)
+    else:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                merged = json.load(f)
+            # Keep baseline entries of benchmarks not run this time
+            merged['results'].update(results)
+            run = dict(run, results=merged['results'])
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
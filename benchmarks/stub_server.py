@@ -0,0 +1,211 @@
+"""
+Local stand-in for otomoto.pl.
+
+Serves synthetic listing pages from ``benchmarks.corpus`` with Otomoto-style
+pagination (``?page=N``, empty page past the end or past an optional page
+limit, result count in ``__NEXT_DATA__``) and filtering by production year
+(``od-<year>`` and ``search[filter_float_year:to]``) and price
+(``search[filter_float_price:from/to]``), the newest-first sort (higher
+ids are newer; ``add_listings`` publishes new ones), listing detail pages
+(``/osobowe/oferta/<slug>-ID<hex id>.html``), make/model category pages
+carrying ``__NEXT_DATA__`` filters, an artificial per-request latency (with
+optional jitter) and, optionally, promoted cards repeated on every page, a
+share of 429 (with ``Retry-After``) and 5xx responses, and 429 for every
+request beyond a number already in flight (a site throttling clients that
+push too hard). Point the scraper at it with ``OTOMOTO_BASE_URL``.
+
+Usage:
+    python -m benchmarks.stub_server --port 8765 --latency 0.2 --total 640 --error-rate 0.05 --page-limit 10
+    python -m benchmarks.stub_server --latency 0.2 --capacity 6 --retry-after 0
+    python -m benchmarks.stub_server --latency 0.2 --promoted 3
+"""
+
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.corpus import (
+    LISTING_ID_BASE, PAGE_SIZE, listing_year_price, render_detail_page, render_search_page, render_taxonomy_page
+)
+
+# The scraper's newest-first sort (scraper.NEWEST_FIRST_ORDER)
+NEWEST_FIRST_ORDER = 'created_at_first:desc'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Request handler; configuration lives on the server instance."""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, Nagle's
+    # algorithm and delayed ACKs add ~40 ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [p for p in url.path.split('/') if p]
+
+        with server.lock:
+            server.request_count += 1
+            delay = server.latency + server.rng.uniform(0, server.jitter)
+            error = server.rng.random() < server.error_rate
+            status = server.rng.choice((429, 500, 502, 503)) if error else 200
+            if error:
+                server.error_count += 1
+            if server.capacity and server.in_flight >= server.capacity:
+                status = 429
+                server.throttled_count += 1
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+
+        try:
+            if delay:
+                time.sleep(delay)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+        if status == 429:
+            headers = {'Retry-After': str(server.retry_after)} if server.retry_after else None
+            self._send(429, b'too many requests', headers)
+            return
+        if status != 200:
+            self._send(status, b'upstream error')
+            return
+
+        if len(parts) >= 3 and parts[0] == 'osobowe' and parts[-1].startswith('od-'):
+            page = int(query.get('page', ['1'])[0])
+            listing_ids = server.search(int(parts[-1][3:]), _int_param(query, 'search[filter_float_year:to]'),
+                                        _int_param(query, 'search[filter_float_price:from]'),
+                                        _int_param(query, 'search[filter_float_price:to]'))
+            if query.get('search[order]') == [NEWEST_FIRST_ORDER]:
+                listing_ids = listing_ids[::-1]
+            body = render_search_page(listing_ids, page, make=parts[1], model=parts[2],
+                                      page_limit=server.page_limit, promoted=server.promoted)
+            self._send(200, body.encode('utf-8'))
+        elif len(parts) == 3 and parts[:2] == ['osobowe', 'oferta'] and '-ID' in parts[2]:
+            listing_id = int(parts[2].rsplit('-ID', 1)[1].split('.')[0], 16)
+            self._send(200, render_detail_page(listing_id).encode('utf-8'))
+        elif 1 <= len(parts) <= 3 and parts[0] == 'osobowe':
+            body = render_taxonomy_page(*parts[1:])
+            self._send(200, body.encode('utf-8'))
+        else:
+            self._send(404, b'not found')
+
+    def _send(self, status: int, body: bytes, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        latency: float = 0.0,
+        total: int = PAGE_SIZE * 10,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: int = 0,
+        page_limit: Optional[int] = None,
+        capacity: Optional[int] = None,
+        promoted: int = 0
+    ):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.total = total
+        self.page_limit = page_limit
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.capacity = capacity
+        self.promoted = promoted
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+        self.throttled_count = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._catalog: Optional[List[Tuple[int, int, int]]] = None
+
+    def search(
+        self,
+        year_from: int,
+        year_to: Optional[int] = None,
+        price_from: Optional[int] = None,
+        price_to: Optional[int] = None
+    ) -> List[int]:
+        """Ids of the ``total`` synthetic listings matching a year range and price band."""
+        with self.lock:
+            if self._catalog is None:
+                ids = range(LISTING_ID_BASE, LISTING_ID_BASE + self.total)
+                self._catalog = [(i,) + listing_year_price(i) for i in ids]
+            catalog = self._catalog
+        return [listing_id for listing_id, year, price in catalog
+                if year >= year_from and (year_to is None or year <= year_to)
+                and (price_from is None or price >= price_from) and (price_to is None or price <= price_to)]
+
+    def add_listings(self, count: int) -> None:
+        """Publish count new listings (the next ids), as if just posted."""
+        with self.lock:
+            self.total += count
+            self._catalog = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def _int_param(query: Dict[str, List[str]], name: str) -> Optional[int]:
+    values = query.get(name)
+    return int(float(values[0])) if values else None
+
+
+def start_stub_server(port: int = 0, **kwargs) -> StubServer:
+    """Start a stub server on a background thread and return it."""
+    server = StubServer(('127.0.0.1', port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds of delay per request')
+    parser.add_argument('--total', type=int, default=PAGE_SIZE * 10, help='Synthetic listings before year/price filters')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random delay of up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered 429/5xx')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429 (0: none)')
+    parser.add_argument('--page-limit', type=int, default=None, help='Last results page served per search')
+    parser.add_argument('--capacity', type=int, default=None, help='Requests in flight beyond which 429 is answered')
+    parser.add_argument('--promoted', type=int, default=0, help='Promoted cards repeated at the top of every page')
+    args = parser.parse_args()
+
+    server = StubServer(('127.0.0.1', args.port), latency=args.latency, total=args.total, jitter=args.jitter,
+                        error_rate=args.error_rate, retry_after=args.retry_after, page_limit=args.page_limit,
+                        capacity=args.capacity, promoted=args.promoted)
+    print(f"Stub Otomoto listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
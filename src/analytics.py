@@ -0,0 +1,194 @@
+"""
+Vectorized price analytics for scraped listings.
+
+Computes the dashboard aggregates (price statistics, histogram, a
+price-vs-mileage scatter and per-region averages) with NumPy/pandas, so the
+frontend receives a few kilobytes of aggregates instead of every listing.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.listing_table import ListingTable
+
+HISTOGRAM_BINS = 20
+# Scatter sets larger than this are 2-D binned instead of sent point by point
+MAX_SCATTER_POINTS = 2000
+SCATTER_GRID = 40
+QUANTILES = (0.1, 0.25, 0.75, 0.9)
+# A streamed summary is recomputed once the listings grew by this share
+SUMMARY_GROWTH = 0.25
+
+
+def summarize(listings: Iterable[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+    """
+    Summarize listing dictionaries as produced by the scraper.
+
+    Args:
+        listings: Listing dictionaries with 'price', 'mileage' and 'region'
+        **kwargs: Passed through to summarize_arrays
+
+    Returns:
+        Aggregates dictionary, see summarize_arrays
+    """
+    df = pd.DataFrame.from_records(list(listings), columns=['price', 'mileage', 'region'])
+    return summarize_arrays(
+        df['price'].to_numpy(dtype=float, na_value=0.0),
+        df['mileage'].to_numpy(dtype=float, na_value=0.0),
+        df['region'].to_numpy(dtype=object),
+        **kwargs
+    )
+
+
+def summarize_arrays(
+    price: np.ndarray,
+    mileage: np.ndarray,
+    region: Optional[Sequence[Any]] = None,
+    bins: int = HISTOGRAM_BINS,
+    max_scatter_points: int = MAX_SCATTER_POINTS,
+    grid: int = SCATTER_GRID
+) -> Dict[str, Any]:
+    """
+    Compute dashboard aggregates from column arrays.
+
+    Listings without a price (0) are ignored for price statistics, and those
+    without a price or mileage are left out of the scatter.
+
+    Args:
+        price: Prices in PLN
+        mileage: Mileages in km
+        region: Optional region names aligned with price
+        bins: Number of histogram bins
+        max_scatter_points: Above this many points the scatter is 2-D binned
+        grid: Cells per axis for the binned scatter
+
+    Returns:
+        Dictionary with 'count', 'price' statistics, 'histogram', 'scatter'
+        and 'regions' entries
+    """
+    price = np.asarray(price, dtype=float)
+    mileage = np.asarray(mileage, dtype=float)
+    priced = price[price > 0]
+
+    result: Dict[str, Any] = {
+        'count': int(price.size),
+        'priced': int(priced.size),
+        'price': None,
+        'histogram': {'edges': [], 'counts': []},
+        'scatter': {'binned': False, 'points': []},
+        'regions': {},
+    }
+    if priced.size == 0:
+        return result
+
+    quantiles = np.quantile(priced, (0.5,) + QUANTILES)
+    result['price'] = {
+        'mean': float(priced.mean()),
+        'median': float(quantiles[0]),
+        'min': float(priced.min()),
+        'max': float(priced.max()),
+        'quantiles': {f"p{round(q * 100)}": float(v) for q, v in zip(QUANTILES, quantiles[1:])},
+    }
+
+    counts, edges = np.histogram(priced, bins=bins)
+    result['histogram'] = {'edges': edges.round(2).tolist(), 'counts': counts.tolist()}
+
+    result['scatter'] = _scatter(price, mileage, max_scatter_points, grid)
+
+    if region is not None:
+        result['regions'] = _region_means(price, region)
+
+    return result
+
+
+class RunningSummary:
+    """
+    Aggregates of a stream of listing tables, for the analysis streams.
+
+    Recomputing the summary after every page costs O(pages²) on large
+    searches. A partial summary is only produced once the listings have
+    grown by SUMMARY_GROWTH since the previous one, which keeps the total
+    work linear in the number of listings; flush() gives the final summary
+    of everything.
+    """
+
+    def __init__(self, growth: float = SUMMARY_GROWTH):
+        self.growth = growth
+        self._tables: List[ListingTable] = []
+        self._count = 0
+        self._summarized = 0
+        self._pending = False
+
+    def add(self, table: ListingTable) -> Optional[Dict[str, Any]]:
+        """Take a batch; return a summary of everything so far if it is due, else None."""
+        self._tables.append(table)
+        self._count += len(table)
+        self._pending = True
+        if self._summarized and self._count < self._summarized * (1 + self.growth):
+            return None
+        return self.flush()
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """Summary of everything added, or None if nothing was added since the last one."""
+        if not self._pending:
+            return None
+        if len(self._tables) > 1:
+            self._tables = [ListingTable.concat(self._tables)]
+        table = self._tables[0]
+        self._summarized = self._count
+        self._pending = False
+        return summarize_arrays(table['price'], table['mileage'], table['region'])
+
+
+def _scatter(price: np.ndarray, mileage: np.ndarray, max_points: int, grid: int) -> Dict[str, Any]:
+    """Raw price-vs-mileage points, or non-empty 2-D bin centres with counts."""
+    mask = (price > 0) & (mileage > 0)
+    x = mileage[mask]
+    y = price[mask]
+    if x.size <= max_points:
+        return {
+            'binned': False,
+            'points': [{'x': float(px), 'y': float(py)} for px, py in zip(x, y)],
+        }
+
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=grid)
+    xi, yi = np.nonzero(counts)
+    x_centres = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centres = (y_edges[:-1] + y_edges[1:]) / 2
+    return {
+        'binned': True,
+        'points': [
+            {'x': round(float(x_centres[i]), 1), 'y': round(float(y_centres[j]), 1), 'count': int(counts[i, j])}
+            for i, j in zip(xi, yi)
+        ],
+    }
+
+
+def _region_means(price: np.ndarray, region: Sequence[Any]) -> Dict[str, Dict[str, float]]:
+    """Average price and listing count per region (lower-cased name)."""
+    if isinstance(region, pd.Categorical):
+        # Dictionary-encoded regions: aggregate by code without touching strings
+        priced = (price > 0) & (region.codes >= 0)
+        codes = region.codes[priced]
+        counts = np.bincount(codes, minlength=len(region.categories))
+        sums = np.bincount(codes, weights=price[priced], minlength=len(region.categories))
+        totals = {}
+        for i in np.flatnonzero(counts):
+            # Categories differing only in case or spacing are merged
+            name = str(region.categories[i]).strip().lower()
+            if name and name != 'n/a':
+                count, total = totals.get(name, (0, 0.0))
+                totals[name] = (count + counts[i], total + sums[i])
+        return {name: {'count': int(count), 'mean': float(total / count)} for name, (count, total) in totals.items()}
+
+    df = pd.DataFrame({'price': price, 'region': region})
+    df = df[(df['price'] > 0) & df['region'].notna() & (df['region'] != 'N/A')]
+    if df.empty:
+        return {}
+    grouped = df.groupby(df['region'].str.strip().str.lower())['price'].agg(['count', 'mean'])
+    return {
+        name: {'count': int(row['count']), 'mean': float(row['mean'])}
+        for name, row in grouped.iterrows()
+    }
@@ -0,0 +1,416 @@
+"""
+Asyncio scraper core for the ASGI service (asgi_app.py).
+
+iter_listing_pages_async is iter_listing_pages on an event loop: pages are
+fetched with httpx as tasks rather than a thread per in-flight request, so a
+single process can keep hundreds of slow scrapes going at once. Each scrape
+keeps its own small keep-alive pool (httpcore scans every pooled connection
+on each request, which gets quadratic with one pool for hundreds of
+scrapes); detail pages go through one shared client. It shares the search
+planner, the per-page bookkeeping, the adaptive controller, the global rate
+limiter and the page cache with the threaded scraper. HTML parsing and
+SQLite work are handed to worker threads (asyncio.to_thread) for their short
+duration, so they never stall the loop.
+"""
+
+import asyncio
+import ssl
+import time
+from datetime import timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+from src import enrichment
+from src.enrichment import DEFAULT_MAX_AGE, DetailStore, Details, detail_url, event_listings, parse_detail_page
+from src.http_client import DEFAULT_CONCURRENCY, POOL_SIZE, REQUEST_TIMEOUT, USER_AGENT, get_page_cache, rate_limiter
+from src.listing_table import ListingTable
+from src.metrics import (
+    ENRICHMENTS, HTTP_REQUESTS, HTTP_RESPONSE_BYTES, HTTP_RETRIES, PAGE_CACHE_LOOKUPS, PAGES, STAGE_SECONDS, span
+)
+from src.rollups import RollupStore
+from src.scraper import (
+    ListingBatch, PageTask, ProbeResult, SearchPlan, _page_failed, _PageWindow, _prepare_search, _search_planner,
+    _shard_request, extract_result_count, parse_listings_page
+)
+from src.store import ListingStore
+from src.throttle import DEFAULT_RETRIES, TRANSIENT_STATUSES, controller, parse_retry_after, retry_delay
+
+
+_client: Optional[httpx.AsyncClient] = None
+_ssl_context: Optional[ssl.SSLContext] = None
+_detail_slots: Optional[asyncio.Semaphore] = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the process-wide async client (call from the event loop thread)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = new_async_client(POOL_SIZE)
+    return _client
+
+
+def new_async_client(pool_size: int) -> httpx.AsyncClient:
+    """
+    Async client keeping up to pool_size connections alive.
+
+    Like the requests pool, busier moments open extra connections rather
+    than queueing: the rate limiter is what bounds outbound load.
+    """
+    global _ssl_context
+    if _ssl_context is None:
+        # Loading the CA bundle takes tens of milliseconds; do it once
+        _ssl_context = httpx.create_ssl_context()
+    return httpx.AsyncClient(
+        headers={'User-Agent': USER_AGENT},
+        verify=_ssl_context,
+        timeout=REQUEST_TIMEOUT,
+        limits=httpx.Limits(max_connections=None, max_keepalive_connections=pool_size),
+        follow_redirects=True
+    )
+
+
+async def close_async_client() -> None:
+    """Close the process-wide async client and its connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def fetch_async(
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    endpoint: str = 'default',
+    client: Optional[httpx.AsyncClient] = None,
+    retries: int = DEFAULT_RETRIES
+) -> bytes:
+    """
+    Fetch a URL through the page cache, an async pool, the adaptive
+    controller and the global rate limiter.
+
+    Args:
+        url: Absolute URL to fetch
+        params: Optional query parameters
+        headers: Optional extra request headers
+        endpoint: Endpoint class used to pick the cache TTL (see http_client.fetch)
+        client: Client to send the request with (default: get_async_client())
+        retries: Retries after a 429/5xx response, timeout or network error
+
+    Returns:
+        Raw response body
+
+    Raises:
+        httpx.HTTPError: On network errors or non-2xx responses once
+            retries are used up
+    """
+    cache = get_page_cache()
+    if cache is not None:
+        body = await asyncio.to_thread(cache.get, url, params, endpoint)
+        PAGE_CACHE_LOOKUPS.inc(endpoint=endpoint, result='hit' if body is not None else 'miss')
+        if body is not None:
+            return body
+
+    attempt = 0
+    while True:
+        STAGE_SECONDS.observe(await controller.acquire_async(), stage='throttle_wait')
+        wait = rate_limiter.reserve()
+        try:
+            if wait > 0:
+                await asyncio.sleep(wait)
+            STAGE_SECONDS.observe(wait, stage='rate_limit_wait')
+            start = time.monotonic()
+            with span('fetch'):
+                response = await (client or get_async_client()).get(url, params=params, headers=headers)
+        except (httpx.TimeoutException, httpx.NetworkError) as e:
+            controller.release()
+            HTTP_REQUESTS.inc(endpoint=endpoint, status='error')
+            if attempt >= retries:
+                raise
+            reason, retry_after = type(e).__name__, None
+        except httpx.HTTPError:
+            controller.release()
+            HTTP_REQUESTS.inc(endpoint=endpoint, status='error')
+            raise
+        except BaseException:
+            controller.release()
+            raise
+        else:
+            status = response.status_code
+            retry_after = parse_retry_after(response.headers.get('Retry-After')) \
+                if status in TRANSIENT_STATUSES else None
+            controller.release(time.monotonic() - start, status, retry_after)
+            HTTP_REQUESTS.inc(endpoint=endpoint, status=status)
+            if status not in TRANSIENT_STATUSES or attempt >= retries:
+                break
+            reason = str(status)
+        attempt += 1
+        HTTP_RETRIES.inc(endpoint=endpoint, reason=reason)
+        with span('retry_backoff'):
+            await asyncio.sleep(retry_delay(attempt, retry_after))
+
+    response.raise_for_status()
+    HTTP_RESPONSE_BYTES.inc(len(response.content), endpoint=endpoint)
+
+    if cache is not None:
+        await asyncio.to_thread(cache.put, url, params, endpoint, response.content)
+    return response.content
+
+
+async def get_listings_async(make: str, model: str, year_from: int, year_to: int, **kwargs: Any) -> ListingTable:
+    """Async counterpart of scraper.get_listings (same arguments, minus profile)."""
+    batches = [batch.listings async for batch in iter_listing_pages_async(make, model, year_from, year_to, **kwargs)]
+    return ListingTable.concat(batches)
+
+
+async def iter_listing_pages_async(
+    make: str,
+    model: str,
+    year_from: int,
+    year_to: int,
+    fuel_type: Optional[str] = None,
+    gearbox: Optional[str] = None,
+    drive_type: Optional[str] = None,
+    first_owner: bool = False,
+    accident_free: bool = False,
+    generation_slug: Optional[str] = None,
+    max_pages: int = 100,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    parser: Optional[str] = None,
+    store: Optional[ListingStore] = None,
+    incremental: bool = False,
+    start_page: int = 1,
+    raise_on_error: bool = False,
+    rollups: Optional[RollupStore] = None
+) -> AsyncIterator[ListingBatch]:
+    """
+    Async counterpart of scraper.iter_listing_pages (same arguments and
+    batches, minus profile).
+
+    Up to concurrency pages are in flight as tasks on the running loop;
+    progress_callback is called on the loop. Closing the generator early
+    cancels the outstanding page requests.
+    """
+    params, headers, state = _prepare_search(
+        make, model, year_from, year_to, fuel_type, gearbox, drive_type, first_owner, accident_free,
+        generation_slug, max_pages, store, incremental, rollups
+    )
+    client = new_async_client(max(1, concurrency))
+
+    try:
+        with span('plan'):
+            plan = await _plan_search_async(
+                client, make, model, year_from, year_to, generation_slug, params, headers, parser,
+                max_pages
+            )
+    except Exception as e:
+        await client.aclose()
+        PAGES.inc(outcome='error')
+        print(f"Error planning search: {e}")
+        if raise_on_error:
+            raise
+        return
+
+    loop = asyncio.get_running_loop()
+
+    def start(task: PageTask) -> asyncio.Future:
+        if task.listings is not None:
+            future = loop.create_future()
+            future.set_result(task.listings)
+            return future
+        url, shard_params = plan.requests[task.shard]
+        return asyncio.ensure_future(
+            _scrape_page_async(client, url, dict(shard_params, page=task.page), headers, year_from, parser))
+
+    window = _PageWindow(plan, start_page, 1 if incremental else concurrency, progress_callback, start)
+    try:
+        window.top_up()
+        while True:
+            item = window.pop()
+            if item is None:
+                break
+            page, task, future = item
+            try:
+                listings = await future
+            except Exception as e:
+                _page_failed(page, e, httpx.HTTPError)
+                if raise_on_error:
+                    raise
+                return
+
+            if not listings:
+                window.end_shard(page, task)
+                continue
+            if store is not None or rollups is not None:
+                batches, caught_up = await asyncio.to_thread(state.process, page, listings)
+            else:
+                batches, caught_up = state.process(page, listings)
+            if caught_up:
+                window.stop_shard(task)
+            else:
+                window.widen(concurrency)
+            for batch in batches:
+                yield batch
+
+        batches = await asyncio.to_thread(state.fill)
+        if batches and progress_callback:
+            progress_callback("No new listings left, loaded stored results.")
+        for batch in batches:
+            yield batch
+    finally:
+        window.cancel()
+        await client.aclose()
+
+
+class AsyncEnrichmentRun:
+    """
+    enrichment.EnrichmentRun on the event loop.
+
+    Detail pages are fetched through the async pool, at most
+    enrichment.DEFAULT_CONCURRENCY at a time across all runs on the loop;
+    on_details is called on the loop.
+    """
+
+    def __init__(
+        self,
+        on_details: Callable[[List[Dict[str, Any]]], None],
+        store: Optional[DetailStore] = None,
+        max_age: timedelta = DEFAULT_MAX_AGE
+    ):
+        self.on_details = on_details
+        self.store = store or enrichment.get_detail_store()
+        self.max_age = max_age
+        self.details: Dict[str, Details] = {}
+        self._queued = set()
+        self._tasks: List[asyncio.Future] = []
+        self._closed = False
+
+    async def add(self, listings: ListingTable) -> None:
+        """Queue the listings of one scraped page (listings already queued are skipped)."""
+        new = [(listing_id, link) for listing_id, link in zip(listings.ids, listings['link'])
+               if listing_id not in self._queued]
+        self._queued.update(listing_id for listing_id, _ in new)
+        if not new:
+            return
+        cached = await asyncio.to_thread(self.store.get_fresh, [listing_id for listing_id, _ in new], self.max_age)
+        ENRICHMENTS.inc(len(cached), result='cached')
+        if cached:
+            self._report(cached)
+        self._tasks.extend(asyncio.ensure_future(self._enrich(listing_id, link))
+                           for listing_id, link in new if listing_id not in cached)
+
+    async def close(self, wait: bool = True) -> Dict[str, Details]:
+        """Finish the run: wait for (or cancel) outstanding fetches; return details by listing id."""
+        if wait:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        else:
+            for task in self._tasks:
+                task.cancel()
+        self._closed = True
+        return dict(self.details)
+
+    async def _enrich(self, listing_id: str, link: str) -> None:
+        async with _get_detail_slots():
+            try:
+                content = await fetch_async(detail_url(link), endpoint='detail')
+            except httpx.HTTPError as e:
+                ENRICHMENTS.inc(result='error')
+                print(f"Error fetching details of listing {listing_id}: {e}")
+                return
+        details = await asyncio.to_thread(parse_detail_page, content)
+        if details is None:
+            ENRICHMENTS.inc(result='missing')
+            print(f"No advert data on the detail page of listing {listing_id}")
+            return
+        ENRICHMENTS.inc(result='fetched')
+        await asyncio.to_thread(self.store.put, listing_id, details)
+        self._report({listing_id: details})
+
+    def _report(self, found: Dict[str, Details]) -> None:
+        if self._closed:
+            return
+        self.details.update(found)
+        self.on_details(event_listings(found))
+
+
+def _get_detail_slots() -> asyncio.Semaphore:
+    """Loop-wide bound on concurrent detail page fetches."""
+    global _detail_slots
+    if _detail_slots is None:
+        _detail_slots = asyncio.Semaphore(max(1, enrichment.DEFAULT_CONCURRENCY))
+    return _detail_slots
+
+
+async def _plan_search_async(
+    client: httpx.AsyncClient,
+    make: str,
+    model: str,
+    year_from: int,
+    year_to: int,
+    generation_slug: Optional[str],
+    params: Dict[str, Any],
+    headers: Dict[str, str],
+    parser: Optional[str],
+    max_pages: int
+) -> SearchPlan:
+    """Run scraper._search_planner, probing each round of shards concurrently."""
+    planner = _search_planner(make, model, year_from, year_to, generation_slug, params, max_pages)
+    try:
+        shards = next(planner)
+        while True:
+            results = await _gather([
+                _probe_page_async(client, *_shard_request(search, make, model, generation_slug, params),
+                                  headers, year_from, parser)
+                for search in shards
+            ])
+            shards = planner.send(results)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _gather(coroutines: Iterable[Awaitable[Any]]) -> List[Any]:
+    """Await coroutines concurrently; on the first failure cancel the rest and re-raise."""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def _scrape_page_async(
+    client: httpx.AsyncClient,
+    base_url: str,
+    params: Dict[str, Any],
+    headers: Dict[str, str],
+    year_from: int,
+    parser: Optional[str] = None
+) -> ListingTable:
+    """Scrape a single page of listings into a table."""
+    content = await fetch_async(base_url, params=params, headers=headers, endpoint='listings', client=client)
+    return await asyncio.to_thread(_listing_table, content, year_from, parser)
+
+
+async def _probe_page_async(
+    client: httpx.AsyncClient,
+    base_url: str,
+    params: Dict[str, Any],
+    headers: Dict[str, str],
+    year_from: int,
+    parser: Optional[str] = None
+) -> ProbeResult:
+    """Scrape page 1 of a search: (listings, total count, page size)."""
+    content = await fetch_async(base_url, params=dict(params, page=1), headers=headers, endpoint='listings',
+                                client=client)
+    listings = await asyncio.to_thread(_listing_table, content, year_from, parser)
+    return (listings,) + extract_result_count(content)
+
+
+def _listing_table(content: bytes, year_from: int, parser: Optional[str]) -> ListingTable:
+    """Parse a results page into a table (runs in a worker thread)."""
+    listings = parse_listings_page(content, year_from, parser)
+    with span('table_build'):
+        return ListingTable.from_records(listings, year_from=year_from)
@@ -0,0 +1,219 @@
+"""
+Batch market sweeps.
+
+Runs many searches from a spec file concurrently over the shared connection
+pool, with every request drawn from the one global rate budget in
+http_client, and writes each search's listings to a Parquet (or Arrow/CSV)
+file partitioned by make and model:
+
+    <out>/make=bmw/model=seria-3/<search>.parquet
+
+A _manifest.json next to the partitions records each search's URL, row
+count, timing and error, if any.
+
+Spec files hold one JSON object per line (or a single JSON list) with the
+/api/analyze fields: make, model, generation, year_from, year_to, max_pages,
+fuel_type, gearbox, drive_type, first_owner, accident_free, incremental,
+enrich (fetch every listing's detail page for authoritative flags).
+
+Usage:
+    python -m src.batch sweeps.jsonl --out data/sweeps/2024-06-01 --searches 4 --rps 5
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from src.enrichment import EnrichmentRun, apply_details
+from src.http_client import DEFAULT_CONCURRENCY, POOL_SIZE, rate_limiter, set_rate_limit
+from src.jobs import normalize_params
+from src.listing_table import ListingTable
+from src.scraper import _build_params, _build_url, get_listings
+from src.rollups import get_rollups
+from src.store import get_store, search_key
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; CSV output still works without it
+    pa = None
+
+FORMATS = ('parquet', 'arrow', 'csv')
+DEFAULT_FORMAT = 'parquet' if pa is not None else 'csv'
+DEFAULT_SEARCHES = 4
+
+def load_specs(path: str) -> List[Dict[str, Any]]:
+    """
+    Read search specs from a JSON Lines file or a JSON list.
+
+    Returns:
+        Normalized parameter sets (see jobs.normalize_params), duplicates
+        (same URL and query) removed. Sweeps default to full, non-incremental
+        scrapes.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    stripped = text.lstrip()
+    if stripped.startswith('['):
+        raw_specs = json.loads(stripped)
+    else:
+        raw_specs = [json.loads(line) for line in text.splitlines() if line.strip() and not line.lstrip().startswith('#')]
+
+    specs = {}
+    for i, raw in enumerate(raw_specs, 1):
+        try:
+            params = normalize_params(dict({'incremental': False}, **raw))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{path}: spec {i}: {e}") from None
+        specs.setdefault(spec_key(params), params)
+    return list(specs.values())
+
+
+def spec_key(params: Dict[str, Any]) -> str:
+    """Identity of a search: its listing URL and query, as the scraper builds them."""
+    url = _build_url(params['make'], params['model'], params['year_from'], params['generation_slug'])
+    query = _build_params(
+        params['year_to'], params['fuel_type'], params['gearbox'], params['drive_type'],
+        params['first_owner'], params['accident_free']
+    )
+    return search_key(url, query)
+
+
+def write_partition(table: ListingTable, out_dir: str, params: Dict[str, Any], name: str, fmt: str) -> str:
+    """
+    Write one search's listings under make=<make>/model=<model>/ and return
+    the path. Columns follow the ListingTable schema; categoricals become
+    dictionary-encoded Parquet/Arrow columns.
+    """
+    partition = os.path.join(out_dir, f"make={params['make']}", f"model={params['model']}")
+    os.makedirs(partition, exist_ok=True)
+    path = os.path.join(partition, f"{name}.{fmt}")
+    df = table.to_pandas()
+    if fmt == 'csv':
+        df.to_csv(path, index=False)
+        return path
+    if pa is None:
+        raise RuntimeError(f"Writing {fmt} files requires pyarrow")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if fmt == 'parquet':
+        pq.write_table(table, path, compression='zstd')
+    else:
+        feather.write_feather(table, path, compression='zstd')
+    return path
+
+
+def run_search(params: Dict[str, Any], out_dir: str, fmt: str, concurrency: int, store: bool) -> Dict[str, Any]:
+    """Scrape one search with get_listings and write its partition file."""
+    key = spec_key(params)
+    name = f"{params['generation_slug'] or 'all'}-{params['year_from']}-{params['year_to']}-{key[:10]}"
+    url = _build_url(params['make'], params['model'], params['year_from'], params['generation_slug'])
+    entry = {'params': params, 'url': url, 'search_key': key, 'count': 0, 'file': None, 'error': None}
+    start = time.perf_counter()
+    try:
+        scrape_params = {k: v for k, v in params.items() if k not in ('incremental', 'enrich')}
+        listings = get_listings(
+            **scrape_params,
+            concurrency=concurrency,
+            store=get_store() if store or params['incremental'] else None,
+            incremental=params['incremental'],
+            rollups=get_rollups() if store else None
+        )
+        if params['enrich']:
+            enrichment = EnrichmentRun(lambda details: None)
+            enrichment.add(listings)
+            listings = apply_details(listings, enrichment.close())
+        entry['count'] = len(listings)
+        entry['file'] = os.path.relpath(write_partition(listings, out_dir, params, name, fmt), out_dir)
+    except Exception as e:
+        entry['error'] = str(e)
+    entry['seconds'] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def run_batch(
+    specs: List[Dict[str, Any]],
+    out_dir: str,
+    fmt: str = DEFAULT_FORMAT,
+    searches: int = DEFAULT_SEARCHES,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rps: Optional[float] = None,
+    store: bool = False
+) -> Dict[str, Any]:
+    """
+    Run a sweep: all searches concurrently, paced by the global rate limiter.
+
+    Args:
+        specs: Normalized parameter sets, see load_specs
+        out_dir: Output directory for partitions and _manifest.json
+        fmt: Output format, one of FORMATS
+        searches: Searches scraped at the same time
+        concurrency: Pages fetched in parallel per search
+        rps: Global requests-per-second budget (default: unchanged)
+        store: Also upsert listings into the SQLite listing store and
+            fold them into the price rollups
+
+    Returns:
+        The manifest: per-search entries plus sweep totals
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    if rps is not None:
+        set_rate_limit(rps)
+    # Keep in-flight requests within the shared pool; beyond that requests
+    # would queue for connections instead of for rate-limit slots
+    searches = max(1, min(searches, len(specs) or 1, POOL_SIZE // max(1, concurrency) or 1))
+    os.makedirs(out_dir, exist_ok=True)
+
+    print(f"Sweeping {len(specs)} searches, {searches} at a time, "
+          f"{concurrency} pages each, {rate_limiter.rate:g} req/s budget")
+    start = time.perf_counter()
+    entries = []
+    with ThreadPoolExecutor(max_workers=searches, thread_name_prefix='batch-search') as executor:
+        futures = [executor.submit(run_search, params, out_dir, fmt, concurrency, store) for params in specs]
+        for future in as_completed(futures):
+            entry = future.result()
+            entries.append(entry)
+            p = entry['params']
+            status = f"error: {entry['error']}" if entry['error'] else f"{entry['count']} listings"
+            print(f"[{len(entries)}/{len(specs)}] {p['make']}/{p['model']}: {status} in {entry['seconds']}s")
+
+    elapsed = time.perf_counter() - start
+    manifest = {
+        'date': date.today().isoformat(),
+        'format': fmt,
+        'searches': sorted(entries, key=lambda e: (e['params']['make'], e['params']['model'], e['search_key'])),
+        'total_listings': sum(e['count'] for e in entries),
+        'failed': sum(1 for e in entries if e['error']),
+        'seconds': round(elapsed, 3),
+    }
+    with open(os.path.join(out_dir, '_manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a batch of Otomoto searches into partitioned files")
+    parser.add_argument('specs', help='JSON Lines file (or JSON list) of search specs')
+    parser.add_argument('--out', default=os.path.join('data', 'sweeps', date.today().isoformat()),
+                        help='Output directory (default: data/sweeps/<today>)')
+    parser.add_argument('--format', choices=FORMATS, default=DEFAULT_FORMAT)
+    parser.add_argument('--searches', type=int, default=DEFAULT_SEARCHES, help='Searches run at the same time')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Pages in flight per search')
+    parser.add_argument('--rps', type=float, default=None, help='Global requests-per-second budget')
+    parser.add_argument('--store', action='store_true',
+                        help='Also keep listings in the SQLite listing store and price rollups')
+    args = parser.parse_args()
+
+    specs = load_specs(args.specs)
+    manifest = run_batch(specs, args.out, args.format, args.searches, args.concurrency, args.rps, args.store)
+    print(f"Done: {manifest['total_listings']} listings from {len(specs)} searches "
+          f"({manifest['failed']} failed) in {manifest['seconds']:.1f}s -> {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,9 @@ Data for Otomoto Price Analyzer
 """
 
 # Common Models dictionary (Make -> List of Models)
-# Now used primarily to list available makes. 
-# Models and Generations are scraped dynamically.
+# Only a fallback list of makes for when Otomoto is unreachable and the
+# taxonomy index (src/taxonomy.py) is still empty; makes, models and
+# generations are otherwise scraped and indexed dynamically.
 models_dict = {
     "audi": [],
     "bmw": [],
@@ -0,0 +1,310 @@
+"""
+Detail-page enrichment of scraped listings.
+
+Search result cards only hint at some fields: the accident-free and
+first-owner badges are often missing from the list view and the region is
+guessed from the card's text. A listing's detail page carries them
+authoritatively in the ``parametersDict`` and seller location of its
+``__NEXT_DATA__`` advert. An EnrichmentRun fetches the detail pages of a
+scrape's listings on a process-wide pool of DEFAULT_CONCURRENCY threads (so
+concurrent scrapes share the bound), starting with the first page of
+results, and reports each listing's details as soon as they are parsed.
+
+Parsed details are kept in a DetailStore (SQLite, next to the listing store)
+by listing id; details younger than DEFAULT_MAX_AGE are reused without a
+request, so a listing is enriched once per freshness window no matter how
+many searches return it.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from src import scraper
+from src.http_client import USER_AGENT, fetch
+from src.listing_table import ListingTable
+from src.metrics import ENRICHMENTS, span
+from src.store import DEFAULT_DB_PATH
+from src.taxonomy import extract_next_data, iter_dicts
+
+DEFAULT_CONCURRENCY = int(os.environ.get('OTOMOTO_ENRICH_CONCURRENCY', '4'))
+DEFAULT_MAX_AGE = timedelta(days=float(os.environ.get('OTOMOTO_DETAIL_MAX_AGE_DAYS', '7')))
+
+# parametersDict keys of the flags list-view badges only hint at
+ACCIDENT_FREE_PARAM = 'no_accident'
+FIRST_OWNER_PARAM = 'original_owner'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS listing_details (
+    listing_id TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    accident_free INTEGER NOT NULL,
+    first_owner INTEGER NOT NULL,
+    region TEXT,
+    parameters TEXT NOT NULL
+);
+"""
+
+Details = Dict[str, Any]
+
+
+def parse_detail_page(content: bytes) -> Optional[Details]:
+    """
+    Extract the authoritative parameters of a listing's detail page.
+
+    Args:
+        content: Raw HTML of the detail page
+
+    Returns:
+        Dictionary with 'accident_free' and 'first_owner' (bools), 'region'
+        (None if the page names none) and 'parameters' (every parametersDict
+        key mapped to its display value), or None if the page carries no
+        advert data
+    """
+    with span('detail_parse'):
+        next_data = extract_next_data(content)
+        if next_data is None:
+            return None
+        advert = next((node for node in iter_dicts(next_data)
+                       if isinstance(node.get('parametersDict'), dict)), None)
+        if advert is None:
+            return None
+
+        parameters = {}
+        for key, parameter in advert['parametersDict'].items():
+            values = parameter.get('values') if isinstance(parameter, dict) else None
+            if values and isinstance(values[0], dict):
+                parameters[key] = values[0].get('label') or values[0].get('value')
+        return {
+            'accident_free': _is_set(advert['parametersDict'].get(ACCIDENT_FREE_PARAM)),
+            'first_owner': _is_set(advert['parametersDict'].get(FIRST_OWNER_PARAM)),
+            'region': _region(advert),
+            'parameters': parameters,
+        }
+
+
+def apply_details(table: ListingTable, details: Dict[str, Details]) -> ListingTable:
+    """Copy of table with the accident-free, first-owner and (known) region fields of enriched listings replaced."""
+    changes = {}
+    for listing_id, found in details.items():
+        fields = {'accident_free': found['accident_free'], 'first_owner': found['first_owner']}
+        if found.get('region'):
+            fields['region'] = found['region']
+        changes[listing_id] = fields
+    return table.update(changes) if changes else table
+
+
+class DetailStore:
+    """Thread-safe cache of parsed detail pages in SQLite (by default next to the listing store)."""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    def get_fresh(self, listing_ids: Iterable[str], max_age: timedelta = DEFAULT_MAX_AGE) -> Dict[str, Details]:
+        """Details of the given listings fetched within max_age, by listing id."""
+        listing_ids = list(listing_ids)
+        cutoff = time.time() - max_age.total_seconds()
+        found = {}
+        with self._lock:
+            # Stay under SQLite's bound parameter limit
+            for start in range(0, len(listing_ids), 500):
+                chunk = listing_ids[start:start + 500]
+                rows = self._conn.execute(
+                    'SELECT listing_id, accident_free, first_owner, region, parameters FROM listing_details '
+                    f'WHERE fetched_at >= ? AND listing_id IN ({",".join("?" * len(chunk))})',
+                    [cutoff] + chunk
+                ).fetchall()
+                for listing_id, accident_free, first_owner, region, parameters in rows:
+                    found[listing_id] = {
+                        'accident_free': bool(accident_free),
+                        'first_owner': bool(first_owner),
+                        'region': region,
+                        'parameters': json.loads(parameters),
+                    }
+        return found
+
+    def put(self, listing_id: str, details: Details) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO listing_details '
+                '(listing_id, fetched_at, accident_free, first_owner, region, parameters) VALUES (?, ?, ?, ?, ?, ?)',
+                (listing_id, time.time(), int(details['accident_free']), int(details['first_owner']),
+                 details.get('region'), json.dumps(details['parameters'], ensure_ascii=False))
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class EnrichmentRun:
+    """
+    Detail-page enrichment of one scrape.
+
+    Listings are added page by page as they are scraped; cached details are
+    reported at once and the rest are fetched in the background. on_details
+    receives lists of {'id', 'accident_free', 'first_owner', 'region'}
+    dictionaries, from the pool threads, until the run is closed.
+    """
+
+    def __init__(
+        self,
+        on_details: Callable[[List[Dict[str, Any]]], None],
+        store: Optional[DetailStore] = None,
+        max_age: timedelta = DEFAULT_MAX_AGE
+    ):
+        self.on_details = on_details
+        self.store = store or get_detail_store()
+        self.max_age = max_age
+        self.details: Dict[str, Details] = {}
+        self._queued = set()
+        self._futures: List[Future] = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def add(self, listings: ListingTable) -> None:
+        """Queue the listings of one scraped page (listings already queued are skipped)."""
+        with self._lock:
+            new = [(listing_id, link) for listing_id, link in zip(listings.ids, listings['link'])
+                   if listing_id not in self._queued]
+            self._queued.update(listing_id for listing_id, _ in new)
+        if not new:
+            return
+
+        cached = self.store.get_fresh([listing_id for listing_id, _ in new], self.max_age)
+        ENRICHMENTS.inc(len(cached), result='cached')
+        if cached:
+            self._report(cached)
+        pool = _get_pool()
+        futures = [pool.submit(self._enrich, listing_id, link) for listing_id, link in new
+                   if listing_id not in cached]
+        with self._lock:
+            self._futures.extend(futures)
+
+    def close(self, wait: bool = True) -> Dict[str, Details]:
+        """
+        Finish the run: wait for (or cancel) outstanding fetches and stop reporting.
+
+        Returns:
+            Details of every enriched listing, by listing id
+        """
+        with self._lock:
+            futures = list(self._futures)
+        if wait:
+            for future in futures:
+                future.exception()
+        else:
+            for future in futures:
+                future.cancel()
+        with self._lock:
+            self._closed = True
+            return dict(self.details)
+
+    def _enrich(self, listing_id: str, link: str) -> None:
+        """Fetch, parse and cache one detail page (runs on the pool)."""
+        with self._lock:
+            if self._closed:
+                return
+        try:
+            content = fetch(detail_url(link), headers={'User-Agent': USER_AGENT}, endpoint='detail')
+        except requests.RequestException as e:
+            ENRICHMENTS.inc(result='error')
+            print(f"Error fetching details of listing {listing_id}: {e}")
+            return
+        details = parse_detail_page(content)
+        if details is None:
+            ENRICHMENTS.inc(result='missing')
+            print(f"No advert data on the detail page of listing {listing_id}")
+            return
+        ENRICHMENTS.inc(result='fetched')
+        self.store.put(listing_id, details)
+        self._report({listing_id: details})
+
+    def _report(self, found: Dict[str, Details]) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self.details.update(found)
+        self.on_details(event_listings(found))
+
+
+def event_listings(found: Dict[str, Details]) -> List[Dict[str, Any]]:
+    """The fields of enriched listings sent in 'enrichment' stream events."""
+    return [
+        {'id': listing_id, 'accident_free': d['accident_free'], 'first_owner': d['first_owner'],
+         'region': d.get('region')}
+        for listing_id, d in found.items()
+    ]
+
+
+def detail_url(link: str) -> str:
+    """Detail page URL on the configured host (cards link to www.otomoto.pl)."""
+    parsed = urlparse(link)
+    return f"{scraper.BASE_URL}{parsed.path}" if parsed.path else link
+
+
+def _is_set(parameter: Any) -> bool:
+    """Whether a yes/no parametersDict entry is present and affirmative."""
+    if not isinstance(parameter, dict):
+        return False
+    values = parameter.get('values') or []
+    return any(isinstance(v, dict) and str(v.get('value', '')).lower() in ('1', 'true', 'tak') for v in values)
+
+
+def _region(advert: Dict[str, Any]) -> Optional[str]:
+    """Region of the seller location, given as a string or a {'name': ...} object."""
+    for owner in (advert.get('seller') or {}, advert):
+        location = owner.get('location') if isinstance(owner, dict) else None
+        if isinstance(location, dict):
+            region = location.get('region')
+            if isinstance(region, dict):
+                region = region.get('name')
+            if isinstance(region, str) and region.strip():
+                return region.strip()
+    return None
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_store: Optional[DetailStore] = None
+_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """Process-wide detail fetch pool, shared by all runs."""
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=max(1, DEFAULT_CONCURRENCY), thread_name_prefix='enrich')
+    return _pool
+
+
+def get_detail_store() -> DetailStore:
+    """Return the process-wide detail store at DEFAULT_DB_PATH."""
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = DetailStore()
+    return _store
+
+
+def set_detail_store(store: DetailStore) -> None:
+    """Replace the process-wide detail store (e.g. an in-memory one)."""
+    global _store
+    with _lock:
+        _store = store
@@ -0,0 +1,170 @@
+"""
+Streaming export of listings as CSV, NDJSON or Parquet.
+
+iter_export() takes listing tables as they come (the pages of a live
+iter_listing_pages scrape, or a stored result cut into slices) and yields
+the encoded file in pieces of at most DEFAULT_CHUNK_ROWS listings, so the
+memory used by an export does not grow with its size: only the chunk being
+encoded is materialized, and nothing is buffered between chunks except, for
+Parquet, the row group metadata written in the footer. Every format carries
+the ListingTable columns, as the batch sweep partitions do.
+
+The /api/results/<id>/export and /api/export routes in app.py stream these
+pieces as a chunked HTTP response.
+"""
+
+import csv
+import io
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from src.listing_table import COLUMNS, ListingTable
+from src.metrics import span
+from src.wire import dumps
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from src.wire import ARROW_SCHEMA, arrow_batch
+except ImportError:  # pyarrow is optional; CSV and NDJSON exports work without it
+    pa = None
+
+FORMATS = ('csv', 'ndjson', 'parquet')
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+# Listings encoded at a time (one Parquet row group each)
+DEFAULT_CHUNK_ROWS = 10_000
+
+
+def iter_export(tables: Iterable[ListingTable], fmt: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    Encode listing tables into one export file, piece by piece.
+
+    Args:
+        tables: Listing tables in output order, e.g. the batches of a
+            scrape; consumed lazily
+        fmt: One of FORMATS
+        chunk_rows: Most listings encoded at a time
+
+    Yields:
+        Consecutive pieces of the file (the header comes with the first
+        chunk, a Parquet footer last); an export without listings is still
+        a valid file
+
+    Raises:
+        ValueError: If the format is unknown or needs a missing dependency
+    """
+    check_format(fmt)
+    chunks = _chunks(tables, max(1, chunk_rows))
+    if fmt == 'csv':
+        return _iter_csv(chunks)
+    if fmt == 'ndjson':
+        return _iter_ndjson(chunks)
+    return _iter_parquet(chunks)
+
+
+def check_format(fmt: str) -> None:
+    """Raise ValueError unless fmt is one of FORMATS and its dependencies are installed."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {FORMATS}")
+    if fmt == 'parquet' and pa is None:
+        raise ValueError("Parquet export requires pyarrow")
+
+
+def write_export(tables: Iterable[ListingTable], path: str, fmt: Optional[str] = None,
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS) -> int:
+    """Write iter_export() to a file (format from the extension by default); return the bytes written."""
+    fmt = fmt or path.rsplit('.', 1)[-1].lower()
+    written = 0
+    with open(path, 'wb') as f:
+        for piece in iter_export(tables, fmt, chunk_rows):
+            f.write(piece)
+            written += len(piece)
+    return written
+
+
+def table_slices(table: ListingTable, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[ListingTable]:
+    """A table as consecutive slices of at most chunk_rows listings."""
+    for start in range(0, len(table), chunk_rows):
+        yield table.take(np.arange(start, min(start + chunk_rows, len(table))))
+
+
+def _chunks(tables: Iterable[ListingTable], chunk_rows: int) -> Iterator[ListingTable]:
+    """Re-slice tables into chunks of at most chunk_rows listings (small tables pass through)."""
+    for table in tables:
+        if len(table) > chunk_rows:
+            yield from table_slices(table, chunk_rows)
+        elif len(table):
+            yield table
+
+
+def _columns(table: ListingTable) -> Dict[str, List[Any]]:
+    """Plain Python values per column (categoricals decoded)."""
+    return {name: np.asarray(table[name], dtype=object).tolist() for name in COLUMNS}
+
+
+def _iter_csv(chunks: Iterator[ListingTable]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue().encode('utf-8')
+    for table in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        with span('export_encode'):
+            columns = _columns(table)
+            writer.writerows(zip(*(columns[name] for name in COLUMNS)))
+            data = buffer.getvalue().encode('utf-8')
+        yield data
+
+
+def _iter_ndjson(chunks: Iterator[ListingTable]) -> Iterator[bytes]:
+    for table in chunks:
+        with span('export_encode'):
+            columns = _columns(table)
+            data = b''.join(dumps(dict(zip(COLUMNS, row))) + b'\n'
+                            for row in zip(*(columns[name] for name in COLUMNS)))
+        yield data
+
+
+def _iter_parquet(chunks: Iterator[ListingTable]) -> Iterator[bytes]:
+    sink = _DrainingSink()
+    writer = pq.ParquetWriter(sink, ARROW_SCHEMA, compression='zstd')
+    try:
+        for table in chunks:
+            with span('export_encode'):
+                writer.write_table(pa.Table.from_batches([arrow_batch(table)]))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+class _DrainingSink(io.RawIOBase):
+    """Write-only file that hands out what was written so far; tell() keeps counting for the Parquet offsets."""
+
+    def __init__(self):
+        super().__init__()
+        self._pieces: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._pieces.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._pieces)
+        self._pieces.clear()
+        return data
@@ -0,0 +1,188 @@
+"""
+Shared HTTP plumbing for the Otomoto scraper.
+
+All outbound requests go through a single keep-alive connection pool, the
+adaptive in-flight controller (src/throttle.py) and a global
+requests-per-second limiter, so sequential and concurrent fetches share the
+same politeness budget. Transient failures are retried per request.
+Responses are served from and recorded into the on-disk page cache unless it
+is disabled.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.metrics import HTTP_REQUESTS, HTTP_RESPONSE_BYTES, HTTP_RETRIES, PAGE_CACHE_LOOKUPS, STAGE_SECONDS, span
+from src.page_cache import DEFAULT_CACHE_MODE, PageCache
+from src.throttle import DEFAULT_RETRIES, TRANSIENT_STATUSES, controller, parse_retry_after, retry_delay
+
+# Overridable so the scraper can be pointed at a local stub server
+BASE_URL = os.environ.get('OTOMOTO_BASE_URL', 'https://www.otomoto.pl').rstrip('/')
+
+DEFAULT_RPS = float(os.environ.get('OTOMOTO_RPS', '5'))
+DEFAULT_CONCURRENCY = int(os.environ.get('OTOMOTO_CONCURRENCY', '4'))
+POOL_SIZE = 16
+REQUEST_TIMEOUT = 30
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+)
+
+
+class RateLimiter:
+    """Thread-safe limiter handing out evenly spaced request slots."""
+
+    def __init__(self, rate: float):
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float) -> None:
+        """Change the allowed requests per second (0 or less disables limiting)."""
+        with self._lock:
+            self.rate = rate
+            self._interval = 1.0 / rate if rate > 0 else 0.0
+
+    def reserve(self) -> float:
+        """Claim the next request slot without waiting; return seconds until it starts."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        return slot - now
+
+    def acquire(self) -> float:
+        """Block until the next request slot is available; return seconds waited."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+rate_limiter = RateLimiter(DEFAULT_RPS)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide session backed by a keep-alive connection pool."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['User-Agent'] = USER_AGENT
+                _session = session
+    return _session
+
+
+def set_rate_limit(rate: float) -> None:
+    """Set the global requests-per-second budget."""
+    rate_limiter.set_rate(rate)
+
+
+_page_cache: Optional[PageCache] = None
+_page_cache_loaded = False
+
+
+def get_page_cache() -> Optional[PageCache]:
+    """Return the process-wide page cache, or None when caching is off."""
+    global _page_cache, _page_cache_loaded
+    if not _page_cache_loaded:
+        with _session_lock:
+            if not _page_cache_loaded:
+                _page_cache = PageCache() if DEFAULT_CACHE_MODE != 'off' else None
+                _page_cache_loaded = True
+    return _page_cache
+
+
+def set_page_cache(cache: Optional[PageCache]) -> None:
+    """Replace the process-wide page cache (None disables caching)."""
+    global _page_cache, _page_cache_loaded
+    with _session_lock:
+        _page_cache = cache
+        _page_cache_loaded = True
+
+
+def fetch(
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    endpoint: str = 'default',
+    retries: int = DEFAULT_RETRIES
+) -> bytes:
+    """
+    Fetch a URL through the page cache, shared pool, adaptive controller and
+    rate limiter.
+
+    Args:
+        url: Absolute URL to fetch
+        params: Optional query parameters
+        headers: Optional extra request headers
+        endpoint: Endpoint class used to pick the cache TTL
+            ('listings', 'watch', 'taxonomy', 'detail', 'default')
+        retries: Retries after a 429/5xx response, timeout or connection
+            error (after Retry-After or a jittered exponential backoff)
+
+    Returns:
+        Raw response body
+
+    Raises:
+        requests.RequestException: On network errors or non-2xx responses
+            once retries are used up, or a cache miss in replay mode
+    """
+    cache = get_page_cache()
+    if cache is not None:
+        body = cache.get(url, params, endpoint)
+        PAGE_CACHE_LOOKUPS.inc(endpoint=endpoint, result='hit' if body is not None else 'miss')
+        if body is not None:
+            return body
+
+    attempt = 0
+    while True:
+        STAGE_SECONDS.observe(controller.acquire(), stage='throttle_wait')
+        STAGE_SECONDS.observe(rate_limiter.acquire(), stage='rate_limit_wait')
+        start = time.monotonic()
+        try:
+            with span('fetch'):
+                response = get_session().get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            controller.release()
+            HTTP_REQUESTS.inc(endpoint=endpoint, status='error')
+            if attempt >= retries:
+                raise
+            reason, retry_after = type(e).__name__, None
+        except requests.RequestException:
+            controller.release()
+            HTTP_REQUESTS.inc(endpoint=endpoint, status='error')
+            raise
+        else:
+            status = response.status_code
+            retry_after = parse_retry_after(response.headers.get('Retry-After')) \
+                if status in TRANSIENT_STATUSES else None
+            controller.release(time.monotonic() - start, status, retry_after)
+            HTTP_REQUESTS.inc(endpoint=endpoint, status=status)
+            if status not in TRANSIENT_STATUSES or attempt >= retries:
+                break
+            reason = str(status)
+        attempt += 1
+        HTTP_RETRIES.inc(endpoint=endpoint, reason=reason)
+        with span('retry_backoff'):
+            time.sleep(retry_delay(attempt, retry_after))
+
+    response.raise_for_status()
+    HTTP_RESPONSE_BYTES.inc(len(response.content), endpoint=endpoint)
+
+    if cache is not None:
+        cache.put(url, params, endpoint, response.content)
+    return response.content
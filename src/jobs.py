@@ -0,0 +1,434 @@
+"""
+Background scrape jobs.
+
+Analyses run on a fixed pool of worker threads fed by a bounded queue, so the
+number of concurrent outbound scrapes is capped no matter how many users
+click "Analyze". Identical requests (after normalizing their parameters)
+attach to the queued or running job instead of starting a second scrape.
+Every job keeps an event log (progress messages and page batches) that any
+number of clients can follow from the start, so a dropped connection loses
+no work. A job whose page fetch fails is retried from the last completed
+page, and a job that ran out of retries can be resumed the same way.
+Jobs submitted with profiling on are run under cProfile and their profile is
+written to PROFILE_DIR when they finish. Jobs with enrich set also fetch the
+detail page of every listing as pages come in (see src/enrichment.py) and
+stream the authoritative flags as 'enrichment' events. Completed results are
+stored in the node-wide result cache (src/result_cache.py).
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from src.enrichment import EnrichmentRun, apply_details
+from src.listing_table import ListingTable
+from src.metrics import PROFILE_DIR, ProfileCapture, register_stats, span
+from src.result_cache import cache_result
+from src.result_sets import ResultSet, result_sets
+from src.rollups import get_rollups
+from src.scraper import ListingBatch, iter_listing_pages
+from src.store import get_store
+
+DEFAULT_WORKERS = int(os.environ.get('OTOMOTO_JOB_WORKERS', '2'))
+DEFAULT_QUEUE_SIZE = int(os.environ.get('OTOMOTO_JOB_QUEUE', '16'))
+DEFAULT_RETRIES = int(os.environ.get('OTOMOTO_JOB_RETRIES', '2'))
+# Seconds before the first retry of a failed page; doubles on each attempt
+RETRY_DELAY = 2.0
+# Finished jobs kept around for status/result lookups
+MAX_FINISHED_JOBS = 64
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETE = 'complete'
+STATUS_FAILED = 'failed'
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+
+class JobQueueFull(Exception):
+    """Raised when a new job cannot be queued because the queue is at capacity."""
+
+
+def normalize_params(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turn an /api/analyze request body into iter_listing_pages arguments.
+
+    Args:
+        data: Request body with make, model, year_from, year_to, generation,
+            max_pages, fuel_type, gearbox, drive_type, first_owner,
+            accident_free, incremental and enrich
+
+    Returns:
+        Keyword arguments for iter_listing_pages plus 'enrich'; equal
+        searches map to equal dictionaries (slugs lower-cased, blanks
+        dropped, types fixed)
+
+    Raises:
+        ValueError: If make or model is missing or a number is malformed
+    """
+    def slug(name: str) -> Optional[str]:
+        value = data.get(name)
+        value = str(value).strip().lower() if value is not None else ''
+        return value or None
+
+    params = {
+        'make': slug('make'),
+        'model': slug('model'),
+        'year_from': int(data.get('year_from', 2015)),
+        'year_to': int(data.get('year_to', 2024)),
+        'generation_slug': slug('generation'),
+        'max_pages': int(data.get('max_pages', 20)),
+        'fuel_type': slug('fuel_type'),
+        'gearbox': slug('gearbox'),
+        'drive_type': slug('drive_type'),
+        'first_owner': bool(data.get('first_owner', False)),
+        'accident_free': bool(data.get('accident_free', False)),
+        # Repeat analyses only fetch pages until nothing new shows up
+        'incremental': bool(data.get('incremental', True)),
+        # Fetch every listing's detail page for authoritative flags
+        'enrich': bool(data.get('enrich', False)),
+    }
+    if not params['make'] or not params['model']:
+        raise ValueError('Make and Model are required')
+    return params
+
+
+def job_key(params: Dict[str, Any]) -> str:
+    """Coalescing key of a normalized parameter set."""
+    return json.dumps(params, sort_keys=True)
+
+
+class AnalysisRun:
+    """
+    Bookkeeping of one analysis across its attempts, whatever fetches its
+    pages: the job workers drive it with iter_listing_pages, the ASGI app
+    with iter_listing_pages_async. It keeps the pages scraped so far and the
+    page to resume from, drops stored listings the analysis already scraped,
+    paces retries and, once done, registers the result set and caches the
+    result. Events (the /api/analyze stream messages) go to emit.
+    """
+
+    def __init__(self, params: Dict[str, Any], emit: Callable[[Dict[str, Any]], None]):
+        self.params = params
+        self.enrich = bool(params.get('enrich', False))
+        self.tables: List[ListingTable] = []
+        self.count = 0
+        self.next_page = 1
+        self.attempts = 0
+        self.error: Optional[str] = None
+        self.result_id: Optional[str] = None
+        self._seen_ids = set()
+        self._emit_event = emit
+
+    def page_args(self) -> Dict[str, Any]:
+        """Arguments of iter_listing_pages(_async) for the next attempt."""
+        args = {name: value for name, value in self.params.items() if name != 'enrich'}
+        args.update(progress_callback=self.progress, store=get_store(), start_page=self.next_page,
+                    raise_on_error=True, rollups=get_rollups())
+        return args
+
+    def progress(self, message: str) -> None:
+        self._emit_event({'type': 'progress', 'message': message})
+
+    def add_batch(self, batch: ListingBatch) -> ListingTable:
+        """Record a scraped page and return the listings kept; stored listings already scraped are dropped."""
+        listings = batch.listings
+        if batch.from_store:
+            seen = self._seen_ids
+            listings = listings.take([i for i, listing_id in enumerate(listings.ids) if listing_id not in seen])
+        else:
+            self.next_page = batch.page + 1
+        self._seen_ids.update(listings.ids)
+        self.tables.append(listings)
+        self.count += len(listings)
+        self._emit_event({'type': 'batch', 'page': batch.page, 'from_store': batch.from_store, 'listings': listings})
+        return listings
+
+    def add_details(self, listings: List[Dict[str, Any]]) -> None:
+        self._emit_event({'type': 'enrichment', 'listings': listings})
+
+    def retry_delay(self, error: Exception, retries: int = DEFAULT_RETRIES) -> Optional[float]:
+        """Record a failed attempt; return the seconds to wait before resuming, or None once out of retries."""
+        self.attempts += 1
+        self.error = str(error)
+        if self.attempts > retries:
+            return None
+        delay = RETRY_DELAY * 2 ** (self.attempts - 1)
+        self.progress(f"Page {self.next_page} failed, retrying in {delay:g}s...")
+        return delay
+
+    def failure(self) -> Dict[str, Any]:
+        """The 'error' event of an analysis out of retries."""
+        return {'type': 'error', 'message': f"Scraping stopped at page {self.next_page}: {self.error}"}
+
+    def complete(self, details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Register the result set and cache the result of the finished scrape.
+
+        Args:
+            details: Detail-page data of an enriched analysis, applied first
+
+        Returns:
+            The 'complete' event
+        """
+        self.error = None
+        table = ListingTable.concat(self.tables)
+        if details is not None:
+            table = apply_details(table, details)
+        self.result_id = result_sets.add(ResultSet(table, params=self.params))
+        cache_result(self.params, table)
+        return {'type': 'complete', 'data': {'count': self.count, 'result_id': self.result_id}}
+
+
+class ScrapeJob(AnalysisRun):
+    """One scrape and the event log its followers replay."""
+
+    def __init__(self, params: Dict[str, Any], profile: bool = False):
+        super().__init__(params, self._emit)
+        self.id = uuid.uuid4().hex[:16]
+        self.key = job_key(params)
+        self.status = STATUS_QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.profile: Optional[ProfileCapture] = ProfileCapture() if profile else None
+        self.profile_path: Optional[str] = None
+        self._events: List[Dict[str, Any]] = []
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status not in ACTIVE_STATUSES
+
+    def iter_events(self, start: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        Follow the job's event log from position start until it finishes.
+
+        Events are dictionaries of type 'progress', 'batch' (whose
+        'listings' is a ListingTable), 'enrichment' (for enriched jobs),
+        and finally 'complete' or 'error' - the /api/analyze stream
+        messages.
+        """
+        index = start
+        while True:
+            with self._cond:
+                while index >= len(self._events) and not self.finished:
+                    self._cond.wait()
+                chunk = self._events[index:]
+                done = self.finished
+            index += len(chunk)
+            yield from chunk
+            if done:
+                return
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Status summary for the jobs API."""
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'params': self.params,
+            'pages_done': self.next_page - 1,
+            'count': self.count,
+            'attempts': self.attempts,
+            'error': self.error,
+            'result_id': self.result_id,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'profiled': self.profile is not None,
+        }
+
+    def _emit(self, event: Dict[str, Any], status: Optional[str] = None) -> None:
+        with self._cond:
+            self._events.append(event)
+            if status is not None:
+                self.status = status
+                self.finished_at = time.time()
+            self._cond.notify_all()
+
+
+class JobManager:
+    """Worker pool, bounded queue and registry of scrape jobs."""
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        retries: int = DEFAULT_RETRIES,
+        max_finished: int = MAX_FINISHED_JOBS
+    ):
+        self.retries = retries
+        self.max_finished = max_finished
+        self._queue: "queue.Queue[ScrapeJob]" = queue.Queue(maxsize=queue_size)
+        self._jobs: "OrderedDict[str, ScrapeJob]" = OrderedDict()
+        self._active: Dict[str, ScrapeJob] = {}
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('submitted', 'coalesced', 'rejected', 'completed', 'failed', 'retries'), 0)
+        for i in range(max(1, workers)):
+            threading.Thread(target=self._work, name=f"scrape-job-{i}", daemon=True).start()
+
+    def submit(self, params: Dict[str, Any], profile: bool = False) -> Tuple[ScrapeJob, bool]:
+        """
+        Queue a scrape, or attach to an identical queued or running one.
+
+        Args:
+            params: Normalized parameters, see normalize_params
+            profile: Capture a cProfile profile of the scrape (ignored when
+                attaching to an existing job)
+
+        Returns:
+            Tuple of the job and whether it was already active (coalesced)
+
+        Raises:
+            JobQueueFull: If the queue is at capacity
+        """
+        key = job_key(params)
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None:
+                self._stats['coalesced'] += 1
+                return job, True
+
+            job = ScrapeJob(params, profile=profile)
+            self._enqueue(job)
+            self._stats['submitted'] += 1
+            self._jobs[job.id] = job
+            self._prune()
+        return job, False
+
+    def resume(self, job_id: str) -> Optional[ScrapeJob]:
+        """
+        Requeue a failed job; it continues after its last completed page.
+
+        Returns:
+            The job (unchanged if it is not failed), or None if unknown
+
+        Raises:
+            JobQueueFull: If the queue is at capacity
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != STATUS_FAILED:
+                return job
+            if job.key in self._active:
+                # An identical search was started meanwhile
+                return self._active[job.key]
+            job.attempts = 0
+            job.error = None
+            self._enqueue(job)
+            with job._cond:
+                # Followers replaying the log should not see the old failure
+                if job._events and job._events[-1]['type'] == 'error':
+                    job._events.pop()
+                job.status = STATUS_QUEUED
+                job.finished_at = None
+        return job
+
+    def get(self, job_id: str) -> Optional[ScrapeJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters plus queue depth and active job count."""
+        with self._lock:
+            running = sum(1 for job in self._active.values() if job.status == STATUS_RUNNING)
+            return dict(self._stats, queued=self._queue.qsize(), running=running, jobs=len(self._jobs))
+
+    def _enqueue(self, job: ScrapeJob) -> None:
+        """Put a job on the queue and mark it active; caller holds the lock."""
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._stats['rejected'] += 1
+            raise JobQueueFull('Too many analyses queued, please try again shortly')
+        self._active[job.key] = job
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond max_finished; caller holds the lock."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job.profile is not None:
+                    status, event = job.profile.run(self._run, job)
+                else:
+                    status, event = self._run(job)
+            except Exception as e:
+                print(f"Job {job.id} crashed: {e}")
+                status, event = STATUS_FAILED, {'type': 'error', 'message': str(e)}
+            if job.profile is not None:
+                # Written before the final event, so followers can fetch it right away
+                try:
+                    job.profile_path = job.profile.dump(os.path.join(PROFILE_DIR, f"{job.id}.prof"))
+                except OSError as e:
+                    print(f"Could not write profile of job {job.id}: {e}")
+            self._finish(job, status, event)
+
+    def _run(self, job: ScrapeJob) -> Tuple[str, Dict[str, Any]]:
+        """Scrape until done, retrying failed pages with backoff; return (final status, final event)."""
+        with job._cond:
+            job.status = STATUS_RUNNING
+            job.started_at = job.started_at or time.time()
+
+        enrichment = EnrichmentRun(job.add_details) if job.enrich else None
+        if enrichment is not None:
+            # Pages kept from an earlier attempt
+            for table in job.tables:
+                enrichment.add(table)
+
+        while True:
+            try:
+                for batch in iter_listing_pages(**job.page_args(), profile=job.profile):
+                    listings = job.add_batch(batch)
+                    if enrichment is not None:
+                        enrichment.add(listings)
+                break
+            except Exception as e:
+                delay = job.retry_delay(e, self.retries)
+                if delay is None:
+                    print(f"Job {job.id} failed on page {job.next_page}: {e}")
+                    if enrichment is not None:
+                        enrichment.close(wait=False)
+                    return STATUS_FAILED, dict(job.failure(), job_id=job.id)
+                with self._lock:
+                    self._stats['retries'] += 1
+                with span('backoff'):
+                    time.sleep(delay)
+
+        details = None
+        if enrichment is not None:
+            job.progress("Waiting for listing details...")
+            with span('enrich_wait'):
+                details = enrichment.close()
+        return STATUS_COMPLETE, job.complete(details)
+
+    def _finish(self, job: ScrapeJob, status: str, event: Dict[str, Any]) -> None:
+        with self._lock:
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+            self._stats['completed' if status == STATUS_COMPLETE else 'failed'] += 1
+            job._emit(event, status=status)
+            self._prune()
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """Return the process-wide job manager, starting its workers on first use."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager()
+                register_stats('otomoto_jobs', _manager.stats, ('queued', 'running', 'jobs'), 'Scrape job manager')
+    return _manager
@@ -0,0 +1,279 @@
+"""
+Compact columnar container for scraped listings.
+
+A ListingTable holds listings as one array per field instead of one dict per
+listing: NumPy arrays for price, mileage, year and the feature flags,
+dictionary-encoded categoricals for the low-cardinality texts (fuel,
+gearbox, drive, region, currency) and for the scrape timestamp, which is
+shared by every listing of a page. The display strings (price_text,
+mileage_text) are kept as the card showed them, since their currency and
+format are not recoverable from the numbers; to_records() only regenerates
+them for tables read from files that lack them.
+
+Tables are what the scraper yields, what jobs and result sets keep and what
+the batch exporter writes. Listing dicts are only materialized at the edges
+(JSON responses, the SQLite store) via to_records(), optionally for a few
+selected rows.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+TEXT_COLUMNS = ('id', 'title', 'link', 'price_text', 'mileage_text')
+CATEGORICAL_COLUMNS = ('scrape_date', 'fuel', 'gearbox', 'drive', 'region', 'currency')
+NUMERIC_COLUMNS = {'price': np.float64, 'mileage': np.int64, 'year': np.int32}
+BOOL_COLUMNS = ('accident_free', 'first_owner')
+COLUMNS = TEXT_COLUMNS + CATEGORICAL_COLUMNS + tuple(NUMERIC_COLUMNS) + BOOL_COLUMNS
+
+# Keys of the listing dicts produced by the parsers, in their order
+RECORD_FIELDS = (
+    'id', 'scrape_date', 'title', 'price_text', 'price', 'year', 'mileage_text',
+    'mileage', 'fuel', 'gearbox', 'drive', 'region', 'accident_free', 'first_owner', 'link'
+)
+
+
+class ListingTable:
+    """Listings stored column by column; see the module docstring."""
+
+    def __init__(self, columns: Dict[str, Any]):
+        lengths = {len(columns[name]) for name in COLUMNS}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+        self._columns = {name: columns[name] for name in COLUMNS}
+        self._length = lengths.pop()
+
+    @classmethod
+    def empty(cls) -> 'ListingTable':
+        return cls.from_records([])
+
+    @classmethod
+    def from_records(
+        cls,
+        records: Sequence[Dict[str, Any]],
+        scrape_date: Optional[str] = None,
+        year_from: Optional[int] = None
+    ) -> 'ListingTable':
+        """
+        Build a table from listing dictionaries as produced by the parsers.
+
+        Args:
+            records: Listing dictionaries (missing keys get neutral defaults)
+            scrape_date: Timestamp for records without one (default: now)
+            year_from: Year of records without a readable one, like the
+                parsers' fallback (default: unknown)
+
+        Returns:
+            ListingTable with one row per record
+        """
+        if scrape_date is None:
+            scrape_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        columns = {name: [r.get(name) for r in records] for name in
+                   TEXT_COLUMNS + ('fuel', 'gearbox', 'drive', 'region') + BOOL_COLUMNS}
+        columns['scrape_date'] = [r.get('scrape_date') or scrape_date for r in records]
+        columns['currency'] = [_currency(r.get('price_text')) for r in records]
+        columns['price'] = [r.get('price') or 0.0 for r in records]
+        columns['mileage'] = [r.get('mileage') or 0 for r in records]
+        columns['year'] = [_year(r.get('year'), year_from) for r in records]
+        return cls._from_columns(columns)
+
+    @classmethod
+    def from_pandas(cls, df: pd.DataFrame) -> 'ListingTable':
+        """
+        Build a table from a DataFrame with (a subset of) the table columns,
+        e.g. one produced by to_pandas() or read back from Parquet.
+        """
+        n = len(df)
+        columns = {}
+        for name in COLUMNS:
+            if name in df.columns:
+                columns[name] = df[name]
+            elif name == 'currency':
+                columns[name] = [''] * n
+            elif name == 'scrape_date':
+                columns[name] = [datetime.now().strftime("%Y-%m-%d %H:%M:%S")] * n
+            else:
+                columns[name] = [None] * n
+        if 'year' in df.columns:
+            columns['year'] = [_year(y) for y in df['year'].tolist()]
+        return cls._from_columns(columns)
+
+    @classmethod
+    def concat(cls, tables: Iterable['ListingTable']) -> 'ListingTable':
+        """Concatenate tables, merging the categorical dictionaries."""
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return cls.empty()
+        if len(tables) == 1:
+            return tables[0]
+        columns = {}
+        for name in COLUMNS:
+            parts = [t._columns[name] for t in tables]
+            if name in CATEGORICAL_COLUMNS:
+                columns[name] = union_categoricals(parts, ignore_order=True)
+            else:
+                columns[name] = np.concatenate(parts)
+        return cls(columns)
+
+    @classmethod
+    def _from_columns(cls, columns: Dict[str, Any]) -> 'ListingTable':
+        """Coerce raw column values to the table's array types."""
+        arrays = {}
+        for name in TEXT_COLUMNS:
+            values = np.empty(len(columns[name]), dtype=object)
+            values[:] = ['' if v is None else str(v) for v in columns[name]]
+            arrays[name] = values
+        for name in CATEGORICAL_COLUMNS:
+            values = columns[name]
+            if isinstance(values, pd.Series):
+                values = values.astype(object).where(values.notna(), 'N/A')
+            else:
+                values = ['N/A' if v is None else v for v in values]
+            arrays[name] = pd.Categorical(values)
+        for name, dtype in NUMERIC_COLUMNS.items():
+            values = pd.to_numeric(pd.Series(columns[name], dtype=object), errors='coerce')
+            arrays[name] = values.fillna(0).to_numpy(dtype=dtype)
+        for name in BOOL_COLUMNS:
+            values = pd.Series(columns[name], dtype=object)
+            arrays[name] = values.where(values.notna(), False).to_numpy(dtype=bool)
+        return cls(arrays)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, name: str) -> Any:
+        """Column array by name (pd.Categorical for categorical columns)."""
+        return self._columns[name]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over listing dicts, as the parsers produce them."""
+        return iter(self.to_records())
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._columns['id']
+
+    def take(self, indices: Union[np.ndarray, Sequence[int]]) -> 'ListingTable':
+        """Rows selected by an integer index array or a boolean mask."""
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        else:
+            # An empty list becomes a float array
+            indices = indices.astype(np.intp, copy=False)
+        return ListingTable({
+            name: column.take(indices) if isinstance(column, pd.Categorical) else column[indices]
+            for name, column in self._columns.items()
+        })
+
+    def update(self, changes: Dict[str, Dict[str, Any]]) -> 'ListingTable':
+        """
+        Copy of the table with fields of some listings replaced.
+
+        Args:
+            changes: Listing id to {column name: new value}; ids not in the
+                table are ignored
+
+        Returns:
+            New ListingTable; unchanged columns are shared with this one
+        """
+        rows = {listing_id: i for i, listing_id in enumerate(self.ids)}
+        updates: Dict[str, tuple] = {}
+        for listing_id, fields in changes.items():
+            row = rows.get(listing_id)
+            if row is None:
+                continue
+            for name, value in fields.items():
+                indices, values = updates.setdefault(name, ([], []))
+                indices.append(row)
+                values.append(value)
+
+        columns = dict(self._columns)
+        for name, (indices, values) in updates.items():
+            column = columns[name]
+            if isinstance(column, pd.Categorical):
+                updated = np.asarray(column, dtype=object).copy()
+                updated[indices] = ['N/A' if v is None else v for v in values]
+                columns[name] = pd.Categorical(updated)
+            else:
+                updated = column.copy()
+                updated[indices] = values
+                columns[name] = updated
+        return ListingTable(columns)
+
+    def to_records(self, indices: Optional[Union[np.ndarray, Sequence[int]]] = None) -> List[Dict[str, Any]]:
+        """
+        Materialize listing dicts (all rows, or only those at indices).
+
+        price_text and mileage_text are the card's own; where a table read
+        from a file lacks them, they are regenerated from the numbers, e.g.
+        '89 900' (plus the currency if known) and '120 000 km', or 'N/A'.
+        """
+        table = self if indices is None else self.take(indices)
+        cols = {}
+        for name, column in table._columns.items():
+            if isinstance(column, pd.Categorical):
+                cols[name] = np.asarray(column, dtype=object).tolist()
+            else:
+                cols[name] = column.tolist()
+
+        records = []
+        for i in range(len(table)):
+            price = cols['price'][i]
+            mileage = cols['mileage'][i]
+            year = cols['year'][i]
+            price_text = cols['price_text'][i] or (
+                f"{_thousands(price)} {cols['currency'][i]}".strip() if price else 'N/A')
+            mileage_text = cols['mileage_text'][i] or (f"{_thousands(mileage)} km" if mileage else 'N/A')
+            records.append({
+                'id': cols['id'][i],
+                'scrape_date': cols['scrape_date'][i],
+                'title': cols['title'][i],
+                'price_text': price_text,
+                'price': price,
+                'year': str(year) if year else '',
+                'mileage_text': mileage_text,
+                'mileage': mileage,
+                'fuel': cols['fuel'][i],
+                'gearbox': cols['gearbox'][i],
+                'drive': cols['drive'][i],
+                'region': cols['region'][i],
+                'accident_free': cols['accident_free'][i],
+                'first_owner': cols['first_owner'][i],
+                'link': cols['link'][i],
+            })
+        return records
+
+    def to_pandas(self) -> pd.DataFrame:
+        """DataFrame with one column per table column; categoricals stay categorical."""
+        return pd.DataFrame({name: self._columns[name] for name in COLUMNS}, copy=False)
+
+    def nbytes(self) -> int:
+        """Approximate memory footprint in bytes, including string payloads."""
+        return int(self.to_pandas().memory_usage(deep=True, index=False).sum())
+
+
+def _currency(price_text: Optional[str]) -> str:
+    """Currency code named in a price text ('' if it names none)."""
+    if price_text:
+        for code in ('PLN', 'EUR'):
+            if code in price_text:
+                return code
+    return ''
+
+
+def _year(value: Any, default: Optional[int] = None) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default or 0
+
+
+def _thousands(value: float) -> str:
+    """Format a number with space-separated thousands, as Otomoto shows it."""
+    number = float(value)
+    text = f"{number:,.0f}" if number.is_integer() else f"{number:,.2f}"
+    return text.replace(',', ' ')
@@ -0,0 +1,132 @@
+"""
+In-process cache for Otomoto make/model/generation metadata.
+
+A bounded LRU with:
+    - single-flight loading: concurrent requests for the same key share one fetch
+    - stale-while-revalidate: expired entries are served while a background
+      refresh runs, so no user waits on a refetch within the stale window
+    - negative caching: failed or empty loads are remembered briefly
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+
+class _Entry(NamedTuple):
+    value: Any
+    stored_at: float
+    negative: bool
+
+
+class MetadataCache:
+    """Bounded LRU with single-flight loads and background refresh."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: timedelta = timedelta(hours=1),
+        stale_ttl: timedelta = timedelta(hours=24),
+        negative_ttl: timedelta = timedelta(seconds=60),
+        refresh_workers: int = 2
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl.total_seconds()
+        self.stale_ttl = stale_ttl.total_seconds()
+        self.negative_ttl = negative_ttl.total_seconds()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='metadata-refresh')
+        self._stats = dict.fromkeys(
+            ('hits', 'stale_hits', 'negative_hits', 'misses', 'coalesced', 'refreshes', 'load_failures', 'evictions'),
+            0
+        )
+
+    def get(self, key: str, loader: Callable[[], Any], default: Any = None) -> Any:
+        """
+        Return the cached value for key, loading it with loader() if needed.
+
+        A loader that raises or returns a falsy value counts as a failure and
+        is negatively cached for negative_ttl; callers then get default.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                age = now - entry.stored_at
+                if entry.negative:
+                    if age < self.negative_ttl:
+                        self._stats['negative_hits'] += 1
+                        return default
+                elif age < self.ttl:
+                    self._stats['hits'] += 1
+                    return entry.value
+                elif age < self.stale_ttl:
+                    self._stats['stale_hits'] += 1
+                    if key not in self._inflight:
+                        self._stats['refreshes'] += 1
+                        self._inflight[key] = self._refresher.submit(self._load, key, loader, entry)
+                    return entry.value
+
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self._stats['coalesced'] += 1
+                leader = False
+            else:
+                self._stats['misses'] += 1
+                flight = Future()
+                self._inflight[key] = flight
+                leader = True
+
+        if not leader:
+            value = flight.result()
+            return value if value else default
+
+        value = self._load(key, loader, None)
+        flight.set_result(value)
+        return value if value else default
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Drop one key, or everything when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters plus current size, for monitoring."""
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), inflight=len(self._inflight))
+
+    def _load(self, key: str, loader: Callable[[], Any], stale: Optional[_Entry]) -> Any:
+        """Run the loader and store its outcome; stale values survive failed refreshes."""
+        try:
+            value = loader()
+        except Exception as e:
+            print(f"Metadata load failed for {key}: {e}")
+            value = None
+
+        with self._lock:
+            self._inflight.pop(key, None)
+            if value:
+                self._store(key, _Entry(value, time.monotonic(), False))
+            else:
+                self._stats['load_failures'] += 1
+                if stale is None:
+                    self._store(key, _Entry(None, time.monotonic(), True))
+                else:
+                    value = stale.value
+        return value
+
+    def _store(self, key: str, entry: _Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
@@ -0,0 +1,319 @@
+"""
+Pipeline metrics in the Prometheus text exposition format.
+
+Counters and histograms live in one process-wide registry and are rendered
+by the ``/metrics`` endpoint. ``span(stage)`` times one pipeline stage
+(network fetch, HTML parsing, listing parsing, rate-limit waits, storage,
+serialization...) into the ``otomoto_stage_seconds`` histogram, so the time
+split of an analysis can be read off per stage. Components that already keep
+their own counters (metadata cache, job manager) are exported through
+collectors evaluated when the endpoint is scraped.
+
+``ProfileCapture`` gathers cProfile data for a single analysis across the
+job thread and the page fetch threads it uses.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+# Accept ?profile=1 on analyses (cProfile slows the scrape down noticeably)
+PROFILING_ENABLED = os.environ.get('OTOMOTO_PROFILING') == '1'
+PROFILE_DIR = os.environ.get('OTOMOTO_PROFILE_DIR', os.path.join('data', 'profiles'))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers sub-millisecond parsing up to slow page loads and backoff sleeps
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class MetricFamily(NamedTuple):
+    """One metric: samples are (name suffix, labels, value), e.g. ('_bucket', {'le': '0.1'}, 3)."""
+    name: str
+    type: str
+    help: str
+    samples: List[Tuple[str, Dict[str, str], float]]
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(_label_key(self.labels, labels), 0.0)
+
+    def collect(self) -> List[MetricFamily]:
+        with self._lock:
+            samples = [('', dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+        return [MetricFamily(self.name, self.type, self.help, samples)]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with sum and count, optionally split by labels."""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label key: [count per bucket (non-cumulative, last is +Inf), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _label_key(self.labels, labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def totals(self, **labels: Any) -> Tuple[float, int]:
+        """(sum, count) of one label combination."""
+        with self._lock:
+            state = self._values.get(_label_key(self.labels, labels))
+            return (state[1], state[2]) if state else (0.0, 0)
+
+    def collect(self) -> List[MetricFamily]:
+        samples = []
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, counts, total, count in items:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', dict(labels, le=_format_value(bound)), cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return [MetricFamily(self.name, self.type, self.help, samples)]
+
+
+class Registry:
+    """Named metrics plus collector callbacks, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], List[MetricFamily]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def register_collector(self, collector: Callable[[], List[MetricFamily]]) -> None:
+        """Add a callback producing metric families at render time."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> List[MetricFamily]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        families = []
+        for metric in metrics:
+            families.extend(metric.collect())
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        return families
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for family in self.collect():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.type}")
+            for suffix, labels, value in family.samples:
+                lines.append(f"{family.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'otomoto_stage_seconds', 'Time spent per pipeline stage', ('stage',))
+HTTP_REQUESTS = REGISTRY.counter(
+    'otomoto_http_requests_total', 'Outbound HTTP requests by endpoint class and status', ('endpoint', 'status'))
+HTTP_RETRIES = REGISTRY.counter(
+    'otomoto_http_retries_total', 'Retried outbound requests by endpoint class and reason', ('endpoint', 'reason'))
+HTTP_RESPONSE_BYTES = REGISTRY.counter(
+    'otomoto_http_response_bytes_total', 'Bytes downloaded by endpoint class', ('endpoint',))
+PAGE_CACHE_LOOKUPS = REGISTRY.counter(
+    'otomoto_page_cache_lookups_total', 'Page cache lookups by endpoint class and result', ('endpoint', 'result'))
+PAGES = REGISTRY.counter(
+    'otomoto_pages_total', 'Listing pages processed by outcome (ok, empty, error)', ('outcome',))
+PLANNED_PAGES = REGISTRY.counter(
+    'otomoto_planned_pages_total', 'Listing pages planned from the result count of searches')
+SEARCH_SHARDS = REGISTRY.counter(
+    'otomoto_search_shards_total', 'Shards searches were split into to stay under the site page limit')
+LISTINGS_PARSED = REGISTRY.counter(
+    'otomoto_listings_parsed_total', 'Listings parsed by parser engine', ('parser',))
+LISTINGS_DEDUPLICATED = REGISTRY.counter(
+    'otomoto_listings_deduplicated_total', 'Listings dropped as already scraped in the same run')
+LISTING_PARSE_ERRORS = REGISTRY.counter(
+    'otomoto_listing_parse_errors_total', 'Listing cards that failed to parse', ('parser',))
+ENRICHMENTS = REGISTRY.counter(
+    'otomoto_enrichments_total', 'Listing detail enrichments by result (cached, fetched, missing, error)', ('result',))
+STREAM_BYTES = REGISTRY.counter(
+    'otomoto_stream_bytes_total', 'Bytes sent on analysis streams by layout and encoding', ('layout', 'encoding'))
+EXPORT_BYTES = REGISTRY.counter(
+    'otomoto_export_bytes_total', 'Bytes sent on listing exports by format', ('format',))
+WATCH_POLLS = REGISTRY.counter(
+    'otomoto_watch_polls_total', 'Saved-search polls by outcome (ok, baseline, error)', ('outcome',))
+WATCH_PAGES = REGISTRY.counter(
+    'otomoto_watch_pages_total', 'Result pages fetched by saved-search polls')
+WATCH_FEED_ITEMS = REGISTRY.counter(
+    'otomoto_watch_feed_items_total', 'Listings added to the saved-search feed by status (new, changed)', ('status',))
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the enclosed block as one occurrence of a pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def register_stats(prefix: str, stats: Callable[[], Dict[str, int]], gauges: Sequence[str], help: str) -> None:
+    """
+    Export a component's stats() dictionary.
+
+    Args:
+        prefix: Metric name prefix, e.g. 'otomoto_metadata_cache'
+        stats: Callable returning the component's counters
+        gauges: Keys that are current levels rather than running totals;
+            each becomes <prefix>_<key>, the rest <prefix>_events_total{event=...}
+        help: Description of the component
+    """
+    def collect() -> List[MetricFamily]:
+        values = stats()
+        families = [MetricFamily(
+            f"{prefix}_events_total", 'counter', f"{help}: event counters",
+            [('', {'event': key}, value) for key, value in values.items() if key not in gauges]
+        )]
+        for key in gauges:
+            if key in values:
+                families.append(MetricFamily(f"{prefix}_{key}", 'gauge', f"{help}: {key}", [('', {}, values[key])]))
+        return families
+    REGISTRY.register_collector(collect)
+
+
+class ProfileCapture:
+    """
+    cProfile data of one analysis, gathered from every thread it runs on.
+
+    Each call to run() profiles its own thread; the results are merged when
+    read. On interpreters that allow only one active profiler at a time
+    (Python 3.12+), nested runs execute unprofiled.
+    """
+
+    def __init__(self):
+        self._profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call fn under a profiler and keep its data."""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                self._profiles.append(profile)
+
+    def stats(self) -> Optional[pstats.Stats]:
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def dump(self, path: str) -> Optional[str]:
+        """Write the merged profile (for snakeviz, pstats...); return path, or None if empty."""
+        stats = self.stats()
+        if stats is None:
+            return None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        stats.dump_stats(path)
+        return path
+
+    def summary(self, limit: int = 40, sort: str = 'cumulative') -> str:
+        """Text report of the top functions."""
+        stats = self.stats()
+        if stats is None:
+            return 'No profile data captured.\n'
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+def _label_key(names: Tuple[str, ...], labels: Dict[str, Any]) -> Tuple[str, ...]:
+    if len(labels) != len(names):
+        raise ValueError(f"Expected labels {names}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in names)
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
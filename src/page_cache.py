@@ -0,0 +1,198 @@
+"""
+On-disk cache for raw Otomoto page bodies.
+
+Bodies are stored content-addressed (by SHA-256 of the body) under the cache
+directory, with a small SQLite index mapping request keys (URL plus
+normalized query parameters) to bodies. Entries expire per endpoint and the
+cache is kept under a size budget by evicting least-recently-used entries.
+
+Modes:
+    off        Bypass the cache entirely
+    readwrite  Serve fresh entries, fetch and store on miss (default)
+    record     Always fetch, store every response
+    replay     Serve only from the cache regardless of age; misses fail
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+
+import requests
+
+MODES = ('off', 'readwrite', 'record', 'replay')
+
+DEFAULT_CACHE_DIR = os.environ.get('OTOMOTO_CACHE_DIR', os.path.join('data', 'page_cache'))
+DEFAULT_CACHE_MODE = os.environ.get('OTOMOTO_CACHE_MODE', 'readwrite')
+DEFAULT_MAX_BYTES = int(os.environ.get('OTOMOTO_CACHE_MAX_MB', '256')) * 1024 * 1024
+
+# Seconds a cached body stays fresh, per endpoint
+DEFAULT_TTLS: Dict[str, float] = {
+    'listings': 10 * 60,
+    # Saved-search polls (src/watcher.py) must see pages newer than their interval
+    'watch': 30,
+    'taxonomy': 24 * 60 * 60,
+    'detail': 24 * 60 * 60,
+    'default': 60 * 60,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed_at);
+CREATE INDEX IF NOT EXISTS idx_entries_content ON entries (content_hash);
+"""
+
+
+class CacheMiss(requests.RequestException):
+    """Raised in replay mode when a request has no cached response."""
+
+
+def cache_key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Key a request by URL and its sorted, stringified query parameters."""
+    query = ''
+    if params:
+        query = urlencode(sorted((str(k), str(v)) for k, v in params.items() if v is not None))
+    return hashlib.sha256(f"{url}?{query}".encode('utf-8')).hexdigest()
+
+
+class PageCache:
+    """Size-bounded, content-addressed LRU cache of response bodies."""
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_CACHE_DIR,
+        mode: str = DEFAULT_CACHE_MODE,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttls: Optional[Dict[str, float]] = None
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {MODES}")
+        self.directory = directory
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None, endpoint: str = 'default') -> Optional[bytes]:
+        """
+        Look up a cached body.
+
+        Returns:
+            The body, or None when the caller should fetch from the network
+
+        Raises:
+            CacheMiss: In replay mode when nothing is cached for the request
+        """
+        if self.mode in ('off', 'record'):
+            return None
+
+        key = cache_key(url, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT content_hash, stored_at FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+        if row is not None:
+            content_hash, stored_at = row
+            fresh = now - stored_at < self.ttls.get(endpoint, self.ttls['default'])
+            if fresh or self.mode == 'replay':
+                body = self._read_blob(content_hash)
+                if body is not None:
+                    with self._lock, self._conn:
+                        self._conn.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+                    return body
+
+        if self.mode == 'replay':
+            raise CacheMiss(f"No cached response for {url} (replay mode)")
+        return None
+
+    def put(self, url: str, params: Optional[Dict[str, Any]], endpoint: str, body: bytes) -> None:
+        """Store a body, then evict least-recently-used entries over budget."""
+        if self.mode in ('off', 'replay'):
+            return
+
+        content_hash = hashlib.sha256(body).hexdigest()
+        path = self._blob_path(content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (key, url, endpoint, content_hash, size, stored_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (cache_key(url, params), url, endpoint, content_hash, len(body), now, now)
+            )
+            self._evict()
+
+    def total_bytes(self) -> int:
+        """Bytes used by distinct cached bodies."""
+        with self._lock:
+            return self._total_bytes()
+
+    def clear(self) -> None:
+        """Drop every entry and body."""
+        with self._lock, self._conn:
+            hashes = [row[0] for row in self._conn.execute('SELECT DISTINCT content_hash FROM entries')]
+            self._conn.execute('DELETE FROM entries')
+        for content_hash in hashes:
+            self._remove_blob(content_hash)
+
+    def _total_bytes(self) -> int:
+        row = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM entries GROUP BY content_hash)'
+        ).fetchone()
+        return row[0]
+
+    def _evict(self) -> None:
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            'SELECT key, content_hash, size FROM entries ORDER BY accessed_at'
+        ).fetchall()
+        for key, content_hash, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            still_used = self._conn.execute(
+                'SELECT 1 FROM entries WHERE content_hash = ? LIMIT 1', (content_hash,)
+            ).fetchone()
+            if still_used is None:
+                self._remove_blob(content_hash)
+                total -= size
+
+    def _blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, 'objects', content_hash[:2], content_hash)
+
+    def _read_blob(self, content_hash: str) -> Optional[bytes]:
+        try:
+            with open(self._blob_path(content_hash), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _remove_blob(self, content_hash: str) -> None:
+        try:
+            os.remove(self._blob_path(content_hash))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,58 @@
+"""
+Memo of parsed listing cards.
+
+Result pages are mostly made of cards that were already parsed: repeat
+sweeps see the same listings again, and promoted cards are repeated on many
+pages. The memo keys each card's parsed dictionary by its listing id and a
+hash of the card's raw HTML, so a card is parsed again only when its markup
+changes (a new price, a new badge, ...). Bounded LRU, shared by all
+scrapes of the process.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+Key = Tuple[str, int, bytes]
+
+
+def card_key(listing_id: str, html: bytes, year_from: int) -> Key:
+    """Memo key of one card; year_from is part of it as the fallback year of cards without one."""
+    return listing_id, year_from, hashlib.blake2b(html, digest_size=16).digest()
+
+
+class ParseMemo:
+    """Bounded, thread-safe LRU of parsed cards keyed by card_key."""
+
+    def __init__(self, max_entries: int = 50_000):
+        self.max_entries = max_entries
+        self._cards: "OrderedDict[Key, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('hits', 'misses'), 0)
+
+    def get(self, key: Key) -> Optional[Dict[str, Any]]:
+        """The parsed card stored under key (shared, do not modify), or None."""
+        with self._lock:
+            listing = self._cards.get(key)
+            if listing is None:
+                self._stats['misses'] += 1
+                return None
+            self._cards.move_to_end(key)
+            self._stats['hits'] += 1
+            return listing
+
+    def put(self, key: Key, listing: Dict[str, Any]) -> None:
+        with self._lock:
+            self._cards[key] = listing
+            self._cards.move_to_end(key)
+            while len(self._cards) > self.max_entries:
+                self._cards.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cards.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, size=len(self._cards))
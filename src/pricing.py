@@ -0,0 +1,258 @@
+"""
+Fair-price model for listings of one search.
+
+Fits log(price) by least squares on the production year (as age and age²),
+mileage (linear and squared), accident-free status and one-hot fuel, gearbox
+and drive, over the listings of one make/model/generation. Scoring a whole
+ListingTable is a single matrix product: every listing gets the price the
+model expects for it, its relative deviation from that price and an outlier
+flag based on a robust (MAD) residual scale.
+
+Fitted models are cached by a fingerprint of the data they were fitted on,
+so re-querying or re-opening the same result set does not refit.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from src.listing_table import ListingTable
+from src.metrics import register_stats, span
+
+# Fewer priced listings than this are not enough to fit all features
+MIN_ROWS = 20
+# Category values seen fewer times than this share the baseline coefficient
+MIN_CATEGORY_COUNT = 5
+# |residual| above this many robust standard deviations is an outlier
+OUTLIER_Z = 2.5
+CATEGORICAL_FEATURES = ('fuel', 'gearbox', 'drive')
+MILEAGE_SCALE = 100_000.0
+
+
+class PriceModel:
+    """Fitted log-price regression; see the module docstring."""
+
+    def __init__(
+        self,
+        coefficients: np.ndarray,
+        categories: Dict[str, List[str]],
+        reference_year: int,
+        year_fill: float,
+        mileage_fill: float,
+        residual_scale: float,
+        rows: int,
+        r2: float
+    ):
+        self.coefficients = coefficients
+        self.categories = categories
+        self.reference_year = reference_year
+        self.year_fill = year_fill
+        self.mileage_fill = mileage_fill
+        self.residual_scale = residual_scale
+        self.rows = rows
+        self.r2 = r2
+
+    @property
+    def feature_names(self) -> List[str]:
+        names = ['intercept', 'age', 'age^2', 'mileage', 'mileage^2', 'accident_free']
+        for feature in CATEGORICAL_FEATURES:
+            names.extend(f"{feature}={value}" for value in self.categories[feature])
+        return names
+
+    def predict(self, table: ListingTable) -> np.ndarray:
+        """Expected price of every listing."""
+        return np.exp(_design_matrix(table, self) @ self.coefficients)
+
+    def score(self, table: ListingTable) -> Dict[str, np.ndarray]:
+        """
+        Score every listing of a table in one batch.
+
+        Returns:
+            Dictionary of arrays aligned with the table: 'fair_price'
+            (expected price), 'deviation' (price / fair_price - 1), 'z'
+            (log residual in robust standard deviations) and 'outlier'
+            (|z| > OUTLIER_Z); deviation and z are NaN and outlier is False
+            for listings without a usable price
+        """
+        log_expected = _design_matrix(table, self) @ self.coefficients
+        price = table['price']
+        usable = _usable_prices(table)
+        log_residual = np.full(len(table), np.nan)
+        log_residual[usable] = np.log(price[usable]) - log_expected[usable]
+        z = log_residual / self.residual_scale if self.residual_scale > 0 else np.zeros(len(table))
+        fair_price = np.exp(log_expected)
+        with np.errstate(invalid='ignore'):
+            outlier = np.abs(z) > OUTLIER_Z
+        return {
+            'fair_price': fair_price,
+            'deviation': np.expm1(log_residual),
+            'z': z,
+            'outlier': outlier & usable,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Summary for API responses."""
+        return {
+            'rows': self.rows,
+            'r2': self.r2,
+            'residual_scale': self.residual_scale,
+            'coefficients': dict(zip(self.feature_names, self.coefficients.tolist())),
+        }
+
+
+def fit_price_model(table: ListingTable, reference_year: Optional[int] = None) -> Optional[PriceModel]:
+    """
+    Fit the fair-price model on the priced listings of a table.
+
+    Args:
+        table: Listings of one make/model/generation
+        reference_year: Year ages are computed from (default: current year)
+
+    Returns:
+        Fitted PriceModel, or None with fewer than MIN_ROWS priced listings
+    """
+    usable = _usable_prices(table)
+    if usable.sum() < MIN_ROWS:
+        return None
+    fit_rows = table.take(np.flatnonzero(usable))
+
+    year = fit_rows['year'].astype(float)
+    mileage = fit_rows['mileage'].astype(float)
+    known_year = year[year > 0]
+    known_mileage = mileage[mileage > 0]
+    categories = {}
+    for feature in CATEGORICAL_FEATURES:
+        counts = _category_counts(fit_rows[feature])
+        # The most common value is the baseline (no column of its own)
+        baseline = max(counts, key=counts.get) if counts else None
+        categories[feature] = sorted(v for v, c in counts.items() if c >= MIN_CATEGORY_COUNT and v != baseline)
+
+    model = PriceModel(
+        coefficients=np.empty(0),
+        categories=categories,
+        reference_year=reference_year or datetime.now().year,
+        year_fill=float(np.median(known_year)) if known_year.size else float(datetime.now().year),
+        mileage_fill=float(np.median(known_mileage)) if known_mileage.size else 0.0,
+        residual_scale=0.0,
+        rows=len(fit_rows),
+        r2=0.0
+    )
+    X = _design_matrix(fit_rows, model)
+    y = np.log(fit_rows['price'])
+    coefficients, *_ = np.linalg.lstsq(X, y, rcond=None)
+    residual = y - X @ coefficients
+    total = ((y - y.mean()) ** 2).sum()
+
+    model.coefficients = coefficients
+    model.residual_scale = float(1.4826 * np.median(np.abs(residual - np.median(residual))))
+    model.r2 = float(1 - (residual ** 2).sum() / total) if total > 0 else 0.0
+    return model
+
+
+def fingerprint(table: ListingTable, segment: str = '') -> str:
+    """Stable hash of the columns the model is fitted on, plus a segment label."""
+    digest = hashlib.sha1(segment.encode('utf-8'))
+    for name in ('price', 'year', 'mileage', 'accident_free'):
+        digest.update(np.ascontiguousarray(table[name]).tobytes())
+    for name in ('currency',) + CATEGORICAL_FEATURES:
+        categorical = table[name]
+        digest.update(np.ascontiguousarray(categorical.codes).tobytes())
+        digest.update('\x1f'.join(str(c) for c in categorical.categories).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class PriceModelCache:
+    """Bounded, thread-safe LRU of fitted models keyed by dataset fingerprint."""
+
+    def __init__(self, max_models: int = 64):
+        self.max_models = max_models
+        self._models: "OrderedDict[str, Optional[PriceModel]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('hits', 'fits'), 0)
+
+    def get_or_fit(self, table: ListingTable, segment: str = '') -> Optional[PriceModel]:
+        """Return the cached model for this data, fitting it on first use (None if too few rows)."""
+        key = fingerprint(table, segment)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self._stats['hits'] += 1
+                return self._models[key]
+        with span('price_fit'):
+            model = fit_price_model(table)
+        with self._lock:
+            self._stats['fits'] += 1
+            self._models[key] = model
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+        return model
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, size=len(self._models))
+
+
+price_models = PriceModelCache()
+register_stats('otomoto_price_models', price_models.stats, ('size',), 'Fair-price model cache')
+
+
+def segment_key(params: Dict[str, Any]) -> str:
+    """make/model/generation label of a search's parameters."""
+    return '/'.join(str(params.get(name) or '') for name in ('make', 'model', 'generation_slug'))
+
+
+def _usable_prices(table: ListingTable) -> np.ndarray:
+    """Listings with a positive price in PLN (EUR-priced cards are left out)."""
+    currency = table['currency']
+    eur = np.asarray(currency.categories == 'EUR')
+    is_eur = eur[currency.codes] if eur.size else np.zeros(len(table), dtype=bool)
+    return (table['price'] > 0) & ~(is_eur & (currency.codes >= 0))
+
+
+def _category_counts(categorical) -> Dict[str, int]:
+    """Listings per stripped, lower-cased value of a categorical column (missing values as '')."""
+    codes = categorical.codes
+    counts = np.bincount(codes[codes >= 0], minlength=len(categorical.categories))
+    totals = {'': int((codes < 0).sum())} if (codes < 0).any() else {}
+    for category, count in zip(categorical.categories, counts.tolist()):
+        key = str(category).strip().lower()
+        totals[key] = totals.get(key, 0) + count
+    return totals
+
+
+def _design_matrix(table: ListingTable, model: PriceModel) -> np.ndarray:
+    """Feature matrix of a table in the column order of model.feature_names."""
+    n = len(table)
+    year = table['year'].astype(float)
+    year = np.where(year > 0, year, model.year_fill)
+    mileage = table['mileage'].astype(float)
+    mileage = np.where(mileage > 0, mileage, model.mileage_fill) / MILEAGE_SCALE
+    age = model.reference_year - year
+
+    width = 6 + sum(len(model.categories[f]) for f in CATEGORICAL_FEATURES)
+    X = np.zeros((n, width))
+    X[:, 0] = 1.0
+    X[:, 1] = age
+    X[:, 2] = age ** 2
+    X[:, 3] = mileage
+    X[:, 4] = mileage ** 2
+    X[:, 5] = table['accident_free']
+
+    offset = 6
+    rows = np.arange(n)
+    for feature in CATEGORICAL_FEATURES:
+        values = model.categories[feature]
+        if values:
+            categorical = table[feature]
+            # Column of each distinct category text (-1: baseline or unseen)
+            lookup = {value: offset + i for i, value in enumerate(values)}
+            columns = np.array([lookup.get(str(c).strip().lower(), -1) for c in categorical.categories] + [-1])
+            column = columns[categorical.codes]
+            hit = column >= 0
+            X[rows[hit], column[hit]] = 1.0
+        offset += len(values)
+    return X
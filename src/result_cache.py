@@ -0,0 +1,249 @@
+"""
+Node-wide cache of finished analysis results.
+
+Popular searches are analysed over and over, by every worker process of the
+app. The ResultCache keeps the final listing table of each completed
+analysis in SQLite (by default next to the listing store, so every worker
+on the node shares it), keyed by the normalized search: make, model,
+generation, year range, fuel, gearbox, drive, the owner and accident flags,
+max_pages and whether the listings were enriched. Scheduling details such as
+incremental scraping do not change the result and are left out of the key.
+
+Entries expire after DEFAULT_TTL, and the least recently used ones are
+evicted once the cache outgrows DEFAULT_MAX_BYTES. Tables are stored in the
+columnar wire form (src/wire.py) with their display texts, zlib-compressed,
+so a hit gives back the table the analysis produced. Hit, miss, store and
+eviction counters live in the database too, so stats() reports them for the
+whole node whichever worker asks.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.listing_table import ListingTable
+from src.metrics import register_stats, span
+from src.store import DEFAULT_DB_PATH
+from src.wire import columnar, dumps, from_columnar
+
+# Seconds a result is served from the cache (0 disables the cache)
+DEFAULT_TTL = float(os.environ.get('OTOMOTO_RESULT_CACHE_TTL', '600'))
+DEFAULT_MAX_BYTES = int(float(os.environ.get('OTOMOTO_RESULT_CACHE_MAX_MB', '64')) * 1024 * 1024)
+
+# normalize_params keys that define the result of an analysis
+KEY_PARAMS = (
+    'make', 'model', 'generation_slug', 'year_from', 'year_to', 'fuel_type', 'gearbox', 'drive_type',
+    'first_owner', 'accident_free', 'max_pages', 'enrich'
+)
+EVENTS = ('hits', 'misses', 'expired', 'stores', 'evictions')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    params TEXT NOT NULL,
+    data BLOB NOT NULL,
+    count INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_result_cache_accessed ON result_cache (accessed_at);
+CREATE TABLE IF NOT EXISTS result_cache_stats (
+    event TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+"""
+
+
+def result_key(params: Dict[str, Any]) -> str:
+    """Cache key of normalized analyze parameters (see src.jobs.normalize_params)."""
+    relevant = {name: params.get(name) for name in KEY_PARAMS}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Thread- and process-safe, size-bounded LRU of result tables in SQLite."""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, ttl: float = DEFAULT_TTL, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Other workers write to the same file; wait for their locks
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, params: Dict[str, Any]) -> Optional[Tuple[ListingTable, float]]:
+        """
+        Look up the cached result of a search.
+
+        Args:
+            params: Normalized analyze parameters
+
+        Returns:
+            Tuple of the listing table and the time it was stored, or None
+            if the search has no fresh result
+        """
+        key = result_key(params)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT data, stored_at FROM result_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and now - row[1] >= self.ttl:
+                self._conn.execute('DELETE FROM result_cache WHERE key = ?', (key,))
+                self._count('expired')
+                row = None
+            if row is None:
+                self._count('misses')
+                return None
+            self._conn.execute('UPDATE result_cache SET accessed_at = ? WHERE key = ?', (now, key))
+            self._count('hits')
+        data, stored_at = row
+        with span('result_cache_decode'):
+            table = from_columnar(json.loads(zlib.decompress(data)))
+        return table, stored_at
+
+    def put(self, params: Dict[str, Any], table: ListingTable) -> None:
+        """Store the result of a search, then drop expired entries and evict the least recently used over budget."""
+        with span('result_cache_encode'):
+            data = zlib.compress(dumps(columnar(table, display_texts=True)), 6)
+        now = time.time()
+        relevant = {name: params.get(name) for name in KEY_PARAMS}
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO result_cache (key, params, data, count, size, stored_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (result_key(params), json.dumps(relevant, sort_keys=True), data, len(table), len(data), now, now)
+            )
+            self._count('stores')
+            expired = self._conn.execute('DELETE FROM result_cache WHERE stored_at <= ?', (now - self.ttl,)).rowcount
+            if expired:
+                self._count('expired', expired)
+            self._evict()
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Cached searches, most recently used first, without their tables."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT params, count, size, stored_at, accessed_at FROM result_cache ORDER BY accessed_at DESC'
+            ).fetchall()
+        return [{'params': json.loads(params), 'count': count, 'bytes': size,
+                 'stored_at': stored_at, 'accessed_at': accessed_at}
+                for params, count, size, stored_at, accessed_at in rows]
+
+    def clear(self) -> None:
+        """Drop every entry (the counters are kept)."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM result_cache')
+
+    def stats(self) -> Dict[str, Any]:
+        """Node-wide event counters, hit ratio, entries and bytes used."""
+        with self._lock:
+            counts = dict(self._conn.execute('SELECT event, count FROM result_cache_stats').fetchall())
+            entries, size = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM result_cache'
+            ).fetchone()
+        stats = {event: counts.get(event, 0) for event in EVENTS}
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else None
+        stats['entries'] = entries
+        stats['bytes'] = size
+        return stats
+
+    def _count(self, event: str, amount: int = 1) -> None:
+        """Bump a shared counter; caller holds the lock inside a transaction."""
+        self._conn.execute(
+            'INSERT INTO result_cache_stats (event, count) VALUES (?, ?) '
+            'ON CONFLICT (event) DO UPDATE SET count = count + excluded.count',
+            (event, amount)
+        )
+
+    def _evict(self) -> None:
+        """Delete least recently used entries until under max_bytes; caller holds the lock."""
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM result_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute('SELECT key, size FROM result_cache ORDER BY accessed_at').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM result_cache WHERE key = ?', (key,))
+            self._count('evictions')
+            total -= size
+
+
+def cached_result(params: Dict[str, Any]) -> Optional[Tuple[ListingTable, float]]:
+    """ResultCache.get on the process-wide cache; None when disabled or on a database error."""
+    cache = get_result_cache()
+    if cache is None:
+        return None
+    try:
+        return cache.get(params)
+    except sqlite3.Error as e:
+        print(f"Result cache lookup failed: {e}")
+        return None
+
+
+def cache_result(params: Dict[str, Any], table: ListingTable) -> None:
+    """ResultCache.put on the process-wide cache; a database error only skips the store."""
+    cache = get_result_cache()
+    if cache is None:
+        return
+    try:
+        cache.put(params, table)
+    except sqlite3.Error as e:
+        print(f"Could not cache result: {e}")
+
+
+def hit_events(table: ListingTable, result_id: str, stored_at: float) -> List[Dict[str, Any]]:
+    """The /api/analyze stream messages of a cached result: a progress note, one batch and 'complete'."""
+    age = max(0, int(time.time() - stored_at))
+    return [
+        {'type': 'progress', 'message': f"Loaded {len(table)} listings analysed {age // 60} min {age % 60} s ago"},
+        {'type': 'batch', 'page': 1, 'from_store': False, 'cached': True, 'listings': table},
+        {'type': 'complete', 'data': {'count': len(table), 'result_id': result_id, 'cached': True}},
+    ]
+
+
+_cache: Optional[ResultCache] = None
+_cache_loaded = False
+_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Return the process-wide result cache at DEFAULT_DB_PATH, or None if disabled (TTL 0)."""
+    global _cache, _cache_loaded
+    if not _cache_loaded:
+        with _lock:
+            if not _cache_loaded:
+                _cache = ResultCache() if DEFAULT_TTL > 0 else None
+                _cache_loaded = True
+    return _cache
+
+
+def set_result_cache(cache: Optional[ResultCache]) -> None:
+    """Replace the process-wide result cache (e.g. an in-memory one, or None to disable it)."""
+    global _cache, _cache_loaded
+    with _lock:
+        _cache = cache
+        _cache_loaded = True
+
+
+def _metric_stats() -> Dict[str, int]:
+    """stats() of the current cache for /metrics (the ratio follows from the counters)."""
+    if _cache is None:
+        return {}
+    stats = _cache.stats()
+    del stats['hit_ratio']
+    return stats
+
+
+register_stats('otomoto_result_cache', _metric_stats, ('entries', 'bytes'), 'Analysis result cache (node-wide)')
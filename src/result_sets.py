@@ -0,0 +1,233 @@
+"""
+Server-side result sets for completed analyses.
+
+A ResultSet keeps the ListingTable of one analysis with precomputed
+categorical indexes (one boolean lookup table per filter value over the
+distinct card texts) and precomputed sort orders, so filtering, sorting and
+paging a result only materializes listing dicts for the rows on the
+requested page. Every listing is scored against the fair-price model of the
+result set once, when it is created.
+"""
+
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.analytics import summarize_arrays
+from src.listing_table import ListingTable
+from src.pricing import price_models, segment_key
+from src.utils import DRIVE_TYPE_MAPPING, FUEL_TYPE_MAPPING, GEARBOX_MAPPING
+
+SORTABLE_COLUMNS = ('year', 'price', 'mileage', 'title', 'deal')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Filter name -> (listing field, English value -> Polish substring)
+CATEGORICAL_FILTERS = {
+    'fuel': ('fuel', FUEL_TYPE_MAPPING),
+    'gearbox': ('gearbox', GEARBOX_MAPPING),
+    'drive': ('drive', DRIVE_TYPE_MAPPING),
+}
+
+
+class ResultSet:
+    """Columnar, indexed view over the listings of one analysis."""
+
+    def __init__(self, listings: Union[ListingTable, List[Dict[str, Any]]], params: Optional[Dict[str, Any]] = None):
+        if not isinstance(listings, ListingTable):
+            listings = ListingTable.from_records(listings)
+        self.table = listings
+        self.params = params or {}
+
+        # The table's arrays are used as they are, no per-listing work
+        self.year = listings['year']
+        self.price = listings['price']
+        self.mileage = listings['mileage'].astype(float)
+        self.first_owner = listings['first_owner']
+        self.accident_free = listings['accident_free']
+        self.region = _lowercased(listings['region'])
+
+        # Fair price per listing; deviation is NaN where there is no model
+        # (too few listings) or no usable price
+        self.price_model = price_models.get_or_fit(listings, segment_key(self.params))
+        if self.price_model is not None:
+            scores = self.price_model.score(listings)
+            self.fair_price = scores['fair_price']
+            self.deviation = scores['deviation']
+            self.outlier = scores['outlier']
+        else:
+            self.fair_price = np.full(len(listings), np.nan)
+            self.deviation = np.full(len(listings), np.nan)
+            self.outlier = np.zeros(len(listings), dtype=bool)
+
+        # The table's categoricals are already dictionary-encoded: decide per
+        # distinct text which filter values it satisfies (same substring
+        # semantics the dashboard used). A filter then costs one gather.
+        self._categorical_codes = {}
+        self._categories = {}
+        self._categorical_lookup = {}
+        for name, (field, mapping) in CATEGORICAL_FILTERS.items():
+            categorical = _lowercased(listings[field])
+            self._categorical_codes[name] = categorical.codes
+            categories = categorical.categories
+            self._categories[name] = categories
+            self._categorical_lookup[name] = {
+                key: np.array([polish in category for category in categories], dtype=bool)
+                for key, polish in mapping.items()
+            }
+
+        titles = np.array([title.lower() for title in listings['title']], dtype=str)
+        self._sort_orders = {
+            'year': np.argsort(self.year, kind='stable'),
+            'price': np.argsort(self.price, kind='stable'),
+            'mileage': np.argsort(self.mileage, kind='stable'),
+            'title': np.argsort(titles, kind='stable'),
+            # Best deals (most under the fair price) first; unscored last
+            'deal': np.argsort(self.deviation, kind='stable'),
+        }
+        # Descending orders that differ from the reversed ascending one
+        self._descending_orders = {
+            'deal': np.argsort(-self.deviation, kind='stable'),
+        }
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def mask(
+        self,
+        year_from: Optional[int] = None,
+        year_to: Optional[int] = None,
+        fuel: Optional[str] = None,
+        gearbox: Optional[str] = None,
+        drive: Optional[str] = None,
+        first_owner: bool = False,
+        accident_free: bool = False
+    ) -> np.ndarray:
+        """Boolean mask of listings matching the filters (unknown years always match)."""
+        mask = np.ones(len(self.table), dtype=bool)
+        known_year = self.year > 0
+        if year_from is not None:
+            mask &= ~known_year | (self.year >= year_from)
+        if year_to is not None:
+            mask &= ~known_year | (self.year <= year_to)
+
+        for name, value in (('fuel', fuel), ('gearbox', gearbox), ('drive', drive)):
+            if not value:
+                continue
+            lookup = self._categorical_lookup[name].get(value)
+            if lookup is None:
+                # Not a known English key: substring test on the distinct texts
+                needle = value.lower()
+                lookup = np.array([needle in c for c in self._categories[name]], dtype=bool)
+            mask &= lookup[self._categorical_codes[name]]
+
+        if first_owner:
+            mask &= self.first_owner
+        if accident_free:
+            mask &= self.accident_free
+        return mask
+
+    def query(
+        self,
+        sort: Optional[str] = None,
+        direction: str = 'asc',
+        page: int = 1,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        include_analytics: bool = True,
+        **filters
+    ) -> Dict[str, Any]:
+        """
+        Filter, sort and page the result set.
+
+        Args:
+            sort: Column from SORTABLE_COLUMNS ('deal': deviation from the
+                fair price), or None for scrape order
+            direction: 'asc' or 'desc'
+            page: 1-based page number
+            page_size: Rows per page (capped at MAX_PAGE_SIZE)
+            include_analytics: Also summarize the filtered listings
+            **filters: Keyword filters accepted by mask()
+
+        Returns:
+            Dictionary with 'total', 'page', 'page_size', 'rows' (listing
+            dicts plus 'fair_price', 'price_deviation' and 'outlier'),
+            'pricing' (model summary or None) and optionally 'analytics'
+        """
+        if sort is not None and sort not in SORTABLE_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort!r}")
+        page = max(1, page)
+        page_size = min(max(1, page_size), MAX_PAGE_SIZE)
+
+        mask = self.mask(**filters)
+        if sort is None:
+            selected = np.flatnonzero(mask)
+        else:
+            order = self._sort_orders[sort]
+            if direction == 'desc':
+                order = self._descending_orders.get(sort, order[::-1])
+            selected = order[mask[order]]
+
+        start = (page - 1) * page_size
+        page_rows = selected[start:start + page_size]
+        rows = self.table.to_records(page_rows)
+        for row, index in zip(rows, page_rows):
+            row['fair_price'] = _finite(self.fair_price[index])
+            row['price_deviation'] = _finite(self.deviation[index])
+            row['outlier'] = bool(self.outlier[index])
+        result = {
+            'total': int(selected.size),
+            'page': page,
+            'page_size': page_size,
+            'rows': rows,
+            'pricing': self.price_model.to_dict() if self.price_model is not None else None,
+        }
+        if include_analytics:
+            result['analytics'] = summarize_arrays(self.price[mask], self.mileage[mask], self.region[mask])
+        return result
+
+
+def _finite(value: float) -> Optional[float]:
+    """JSON-safe float: None for NaN/inf."""
+    return float(value) if np.isfinite(value) else None
+
+
+def _lowercased(categorical: pd.Categorical) -> pd.Categorical:
+    """Re-encode a categorical with stripped, lower-cased categories (merging duplicates)."""
+    lowered = np.array([str(c).strip().lower() for c in categorical.categories], dtype=object)
+    if not lowered.size:
+        return pd.Categorical.from_codes(categorical.codes, categories=[])
+    categories, inverse = np.unique(lowered, return_inverse=True)
+    codes = np.where(categorical.codes >= 0, inverse[categorical.codes], -1)
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+class ResultSetRegistry:
+    """Bounded, thread-safe LRU of result sets addressed by id."""
+
+    def __init__(self, max_sets: int = 32):
+        self.max_sets = max_sets
+        self._sets: "OrderedDict[str, ResultSet]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, result_set: ResultSet) -> str:
+        """Register a result set and return its id, evicting the oldest if full."""
+        result_id = uuid.uuid4().hex[:16]
+        with self._lock:
+            self._sets[result_id] = result_set
+            while len(self._sets) > self.max_sets:
+                self._sets.popitem(last=False)
+        return result_id
+
+    def get(self, result_id: str) -> Optional[ResultSet]:
+        with self._lock:
+            result_set = self._sets.get(result_id)
+            if result_set is not None:
+                self._sets.move_to_end(result_id)
+            return result_set
+
+
+result_sets = ResultSetRegistry()
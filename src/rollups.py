@@ -0,0 +1,371 @@
+"""
+Precomputed price rollups for trend queries.
+
+As pages are scraped, priced listings are folded into one row per
+(make, model, generation, year, fuel, gearbox, day) holding count, sum, min,
+max and a QuantileSketch of the prices. Listings of a generation search are
+also folded into the model-wide rows (generation ''), so a model trend
+covers every search of the model. A listing counts once per day and row
+key no matter how many searches return it (tracked in a membership table),
+so each day's bucket describes the asking prices on the market that day. Trend
+queries merge the matching rows, so their cost depends on the number of
+buckets rather than the number of listings, and they never touch the network.
+"""
+
+import json
+import math
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.listing_table import ListingTable
+from src.store import DEFAULT_DB_PATH
+from src.utils import map_fuel_type, map_gearbox_type
+
+# Relative accuracy of sketch quantiles (1%)
+DEFAULT_ALPHA = 0.01
+INTERVALS = ('day', 'week', 'month', 'quarter')
+TREND_QUANTILES = (0.25, 0.5, 0.75)
+# Membership rows are only needed for the current day; older ones are pruned
+MEMBERSHIP_DAYS = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS price_rollups (
+    make TEXT NOT NULL,
+    model TEXT NOT NULL,
+    generation TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    fuel TEXT NOT NULL,
+    gearbox TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    sketch TEXT NOT NULL,
+    PRIMARY KEY (make, model, generation, year, fuel, gearbox, day)
+);
+CREATE TABLE IF NOT EXISTS rollup_key_members (
+    day TEXT NOT NULL,
+    make TEXT NOT NULL,
+    model TEXT NOT NULL,
+    generation TEXT NOT NULL,
+    listing_id TEXT NOT NULL,
+    PRIMARY KEY (day, make, model, generation, listing_id)
+);
+"""
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch over positive values with logarithmic buckets.
+
+    Values are counted in buckets whose bounds grow by gamma = (1 + alpha) /
+    (1 - alpha), so every quantile is estimated within relative error alpha
+    and two sketches merge by adding bucket counts.
+    """
+
+    def __init__(self, alpha: float = DEFAULT_ALPHA, bins: Optional[Dict[int, int]] = None):
+        self.alpha = alpha
+        self._gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self._gamma)
+        self.bins: Dict[int, int] = dict(bins or {})
+
+    @property
+    def count(self) -> int:
+        return sum(self.bins.values())
+
+    def add(self, values: Iterable[float]) -> None:
+        """Count positive values (others are ignored)."""
+        values = np.asarray(values, dtype=float)
+        values = values[values > 0]
+        if values.size == 0:
+            return
+        indices, counts = np.unique(np.ceil(np.log(values) / self._log_gamma).astype(np.int64), return_counts=True)
+        for index, count in zip(indices.tolist(), counts.tolist()):
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        if other.alpha != self.alpha:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimated q-quantile (0 <= q <= 1), or None if the sketch is empty."""
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self._gamma ** index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.bins) / (self._gamma + 1)
+
+    def to_json(self) -> str:
+        indices = sorted(self.bins)
+        return json.dumps({'alpha': self.alpha, 'i': indices, 'c': [self.bins[i] for i in indices]},
+                          separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, raw: str) -> 'QuantileSketch':
+        data = json.loads(raw)
+        return cls(data['alpha'], dict(zip(data['i'], data['c'])))
+
+
+class RollupStore:
+    """Thread-safe price rollups in SQLite (by default next to the listing store)."""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, alpha: float = DEFAULT_ALPHA):
+        self.path = path
+        self.alpha = alpha
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        self._pruned_before: Optional[str] = None
+
+    def add(
+        self,
+        listings: ListingTable,
+        make: str,
+        model: str,
+        generation: Optional[str] = None,
+        day: Optional[str] = None
+    ) -> int:
+        """
+        Fold freshly scraped listings into the rollups.
+
+        Listings without a price or priced in EUR are skipped, as are
+        listings already counted on their day under the same row key.
+
+        Args:
+            listings: Listings of one scraped page
+            make: Make slug of the search
+            model: Model slug of the search
+            generation: Generation slug of the search, if it had one
+            day: Day the listings are counted on, 'YYYY-MM-DD' (default: each
+                listing's scrape day); stored listings still on the market
+                are counted on the current day
+
+        Returns:
+            Number of listings added to the model-wide rows
+        """
+        if not len(listings):
+            return 0
+        df = pd.DataFrame({
+            'id': listings['id'],
+            'day': np.asarray(listings['scrape_date'], dtype=object),
+            'price': listings['price'],
+            'year': listings['year'],
+            'fuel': np.asarray(listings['fuel'], dtype=object),
+            'gearbox': np.asarray(listings['gearbox'], dtype=object),
+            'currency': np.asarray(listings['currency'], dtype=object),
+        })
+        df = df[(df['price'] > 0) & (df['currency'] != 'EUR')]
+        if df.empty:
+            return 0
+        df['day'] = day if day is not None else df['day'].astype(str).str[:10]
+        df['fuel'] = df['fuel'].fillna('').astype(str).str.lower()
+        df['gearbox'] = df['gearbox'].fillna('').astype(str).str.lower()
+        keys = [(make.lower(), model.lower(), '')]
+        if generation:
+            keys.append((make.lower(), model.lower(), generation.lower()))
+
+        added = 0
+        with self._lock, self._conn:
+            self._prune_members(df['day'].max())
+            for key in keys:
+                new = [self._conn.execute(
+                    'INSERT OR IGNORE INTO rollup_key_members (day, make, model, generation, listing_id) '
+                    'VALUES (?, ?, ?, ?, ?)', (member_day,) + key + (listing_id,)
+                ).rowcount == 1 for member_day, listing_id in zip(df['day'], df['id'])]
+                rows = df[new]
+                for (year, fuel, gearbox, row_day), group in rows.groupby(
+                        ['year', 'fuel', 'gearbox', 'day'], sort=False):
+                    self._merge_row(key + (int(year), fuel, gearbox, row_day), group['price'].to_numpy())
+                if not key[2]:
+                    added = len(rows)
+        return added
+
+    def trend(
+        self,
+        make: str,
+        model: str,
+        generation: Optional[str] = None,
+        year_from: Optional[int] = None,
+        year_to: Optional[int] = None,
+        fuel: Optional[str] = None,
+        gearbox: Optional[str] = None,
+        day_from: Optional[str] = None,
+        day_to: Optional[str] = None,
+        interval: str = 'day'
+    ) -> Dict[str, Any]:
+        """
+        Price statistics per period from the rollups.
+
+        Args:
+            make: Make slug
+            model: Model slug
+            generation: Generation slug (default: the whole model)
+            year_from: Minimum production year
+            year_to: Maximum production year
+            fuel: Fuel type, English slug (e.g. 'petrol') or part of the
+                listing text, matched as a substring like result set filters
+            gearbox: Gearbox type, English slug (e.g. 'manual') or part of
+                the listing text, matched the same way
+            day_from: First scrape day, 'YYYY-MM-DD'
+            day_to: Last scrape day, 'YYYY-MM-DD'
+            interval: Period length, one of INTERVALS
+
+        Returns:
+            Dictionary with 'interval', 'periods' (one entry per period, oldest
+            first, with count, mean, min, max and p25/median/p75) and 'total'
+            over the whole range
+
+        Raises:
+            ValueError: If interval is unknown
+        """
+        if interval not in INTERVALS:
+            raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+        conditions = ['make = ?', 'model = ?', 'generation = ?']
+        args: List[Any] = [make.lower(), model.lower(), generation.lower() if generation else '']
+        for condition, value in (
+            ('year >= ?', year_from),
+            ('year <= ?', year_to),
+            ('instr(fuel, ?) > 0', map_fuel_type(fuel) if fuel else None),
+            ('instr(gearbox, ?) > 0', map_gearbox_type(gearbox) if gearbox else None),
+            ('day >= ?', day_from),
+            ('day <= ?', day_to),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                args.append(value)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT day, count, sum, min, max, sketch FROM price_rollups '
+                f"WHERE {' AND '.join(conditions)} ORDER BY day",
+                args
+            ).fetchall()
+
+        periods: "OrderedDict[str, _Aggregate]" = OrderedDict()
+        total = _Aggregate(self.alpha)
+        for day, count, total_sum, low, high, sketch in rows:
+            period = _period(day, interval)
+            if period not in periods:
+                periods[period] = _Aggregate(self.alpha)
+            row_sketch = QuantileSketch.from_json(sketch)
+            periods[period].add(count, total_sum, low, high, row_sketch)
+            total.add(count, total_sum, low, high, row_sketch)
+        return {
+            'interval': interval,
+            'periods': [dict(aggregate.to_dict(), period=period) for period, aggregate in periods.items()],
+            'total': total.to_dict(),
+            'buckets': len(rows),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _merge_row(self, key: Tuple[Any, ...], prices: np.ndarray) -> None:
+        """Add prices to one rollup row; caller holds the lock and transaction."""
+        row = self._conn.execute(
+            'SELECT count, sum, min, max, sketch FROM price_rollups WHERE make = ? AND model = ? '
+            'AND generation = ? AND year = ? AND fuel = ? AND gearbox = ? AND day = ?',
+            key
+        ).fetchone()
+        sketch = QuantileSketch(self.alpha) if row is None else QuantileSketch.from_json(row[4])
+        sketch.add(prices)
+        count, total, low, high = len(prices), float(prices.sum()), float(prices.min()), float(prices.max())
+        if row is not None:
+            count, total, low, high = row[0] + count, row[1] + total, min(row[2], low), max(row[3], high)
+        self._conn.execute(
+            'INSERT OR REPLACE INTO price_rollups (make, model, generation, year, fuel, gearbox, day, '
+            'count, sum, min, max, sketch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            key + (count, total, low, high, sketch.to_json())
+        )
+
+    def _prune_members(self, day: str) -> None:
+        """Drop membership rows of past days, at most once per day; caller holds the lock."""
+        cutoff = (datetime.strptime(day, '%Y-%m-%d') - timedelta(days=MEMBERSHIP_DAYS)).strftime('%Y-%m-%d')
+        if self._pruned_before is not None and self._pruned_before >= cutoff:
+            return
+        self._conn.execute('DELETE FROM rollup_key_members WHERE day < ?', (cutoff,))
+        self._pruned_before = cutoff
+
+
+class _Aggregate:
+    """Running merge of rollup rows."""
+
+    def __init__(self, alpha: float):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = QuantileSketch(alpha)
+
+    def add(self, count: int, total: float, low: float, high: float, sketch: QuantileSketch) -> None:
+        self.count += count
+        self.sum += total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+        self.sketch.merge(sketch)
+
+    def to_dict(self) -> Dict[str, Any]:
+        if not self.count:
+            return {'count': 0, 'mean': None, 'min': None, 'max': None, 'p25': None, 'median': None, 'p75': None}
+        p25, median, p75 = (self.sketch.quantile(q) for q in TREND_QUANTILES)
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count,
+            'min': self.min,
+            'max': self.max,
+            'p25': p25,
+            'median': median,
+            'p75': p75,
+        }
+
+
+def _period(day: str, interval: str) -> str:
+    """Label of the period a 'YYYY-MM-DD' day falls in."""
+    if interval == 'day':
+        return day
+    d = date.fromisoformat(day)
+    if interval == 'week':
+        year, week, _ = d.isocalendar()
+        return f"{year}-W{week:02d}"
+    if interval == 'month':
+        return day[:7]
+    return f"{d.year}-Q{(d.month - 1) // 3 + 1}"
+
+
+_rollups: Optional[RollupStore] = None
+_rollups_lock = threading.Lock()
+
+
+def get_rollups() -> RollupStore:
+    """Return the process-wide rollup store at DEFAULT_DB_PATH."""
+    global _rollups
+    if _rollups is None:
+        with _rollups_lock:
+            if _rollups is None:
+                _rollups = RollupStore()
+    return _rollups
+
+
+def set_rollups(rollups: RollupStore) -> None:
+    """Replace the process-wide rollup store (e.g. an in-memory one)."""
+    global _rollups
+    with _rollups_lock:
+        _rollups = rollups
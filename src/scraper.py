@@ -5,18 +5,92 @@ This module provides functionality to scrape car listings from Otomoto.pl
 based on various search criteria.
 """
 
-import json
-import time
+import os
 import re
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Deque, Generator, Iterator, NamedTuple, Tuple
 
 import requests
 from bs4 import BeautifulSoup
 
-# Simple in-memory cache for metadata
-_metadata_cache = {}
+from src import car_data
+from src.http_client import BASE_URL, DEFAULT_CONCURRENCY, USER_AGENT, fetch
+from src.listing_table import ListingTable
+from src.metadata_cache import MetadataCache
+from src.metrics import (
+    LISTING_PARSE_ERRORS, LISTINGS_DEDUPLICATED, LISTINGS_PARSED, PAGES, PLANNED_PAGES, SEARCH_SHARDS,
+    ProfileCapture, register_stats, span
+)
+from src.parse_memo import ParseMemo, card_key
+from src.rollups import RollupStore
+from src.store import INCREMENTAL_WINDOW, STATUS_UNCHANGED, ListingStore, search_key
+from src.taxonomy import (
+    GENERATION_FILTER, MAKE_FILTER, MODEL_FILTER,
+    extract_next_data, extract_page_taxonomy, get_taxonomy_index, iter_dicts, taxonomy_scope, urql_payloads
+)
+
+try:
+    import lxml.html as lxml_html
+except ImportError:  # lxml is optional; BeautifulSoup remains the fallback
+    lxml_html = None
+
+# Make/model/generation metadata (all filters of one category page per entry):
+# fresh for CACHE_TTL, then served stale while refreshing in the background;
+# failed lookups are retried after a minute
 CACHE_TTL = timedelta(hours=1)
+_metadata_cache = MetadataCache(
+    max_entries=int(os.environ.get('OTOMOTO_METADATA_CACHE_SIZE', '1024')),
+    ttl=CACHE_TTL,
+    stale_ttl=timedelta(hours=24),
+    negative_ttl=timedelta(seconds=60)
+)
+register_stats('otomoto_metadata_cache', _metadata_cache.stats, ('size', 'inflight'),
+               'Make/model/generation metadata cache')
+
+# Sort used by incremental scrapes so new listings come first
+NEWEST_FIRST_ORDER = 'created_at_first:desc'
+
+# Otomoto serves at most this many result pages per search; larger searches
+# are split into shards (year ranges, then price bands) that each fit
+SITE_PAGE_LIMIT = int(os.environ.get('OTOMOTO_SITE_PAGE_LIMIT', '500'))
+DEFAULT_PAGE_SIZE = 32
+# Price bands (PLN) for single-year shards: the open-ended top band is first
+# cut here, bounded bands are halved down to MIN_PRICE_BAND
+FIRST_PRICE_CUT = 50_000
+MIN_PRICE_BAND = 1_000
+
+YEAR_TO_PARAM = 'search[filter_float_year:to]'
+PRICE_FROM_PARAM = 'search[filter_float_price:from]'
+PRICE_TO_PARAM = 'search[filter_float_price:to]'
+
+# Location lines look like "City (Region)"
+_REGION_RE = re.compile(r'\(([^)]+)\)')
+
+# Parsed cards by listing id and card HTML (OTOMOTO_PARSE_MEMO_SIZE=0 disables)
+_PARSE_MEMO_SIZE = int(os.environ.get('OTOMOTO_PARSE_MEMO_SIZE', '50000'))
+_parse_memo = ParseMemo(_PARSE_MEMO_SIZE) if _PARSE_MEMO_SIZE > 0 else None
+if _parse_memo is not None:
+    register_stats('otomoto_parse_memo', _parse_memo.stats, ('size',), 'Parsed listing card memo')
+# Listing cards as the parsers see them: <article> elements with a data-id
+_CARD_RE = re.compile(rb'<article\b([^>]*)>.*?</article\s*>', re.S | re.I)
+_CARD_ID_RE = re.compile(rb'\bdata-id\s*=\s*["\']?([^"\'\s>]+)')
+# Cards missing from the memo are parsed as one document of just those cards
+_CARDS_HEAD = b'<!DOCTYPE html><html><head><meta charset="utf-8"></head><body>'
+_CARDS_TAIL = b'</body></html>'
+
+
+class ListingBatch(NamedTuple):
+    """
+    One page worth of listings yielded by iter_listing_pages.
+
+    page is the page's 1-based position in the search plan: the results
+    page number, unless the search was split into shards.
+    """
+    page: int
+    listings: ListingTable
+    from_store: bool = False
 
 
 def get_listings(
@@ -31,8 +105,13 @@ def get_listings(
     accident_free: bool = False,
     generation_slug: Optional[str] = None,
     max_pages: int = 100,
-    progress_callback: Optional[Callable[[str], None]] = None
-) -> List[Dict[str, Any]]:
+    progress_callback: Optional[Callable[[str], None]] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    parser: Optional[str] = None,
+    store: Optional[ListingStore] = None,
+    incremental: bool = False,
+    rollups: Optional[RollupStore] = None
+) -> ListingTable:
     """
     Scrape car listings from Otomoto.pl.
     
@@ -49,51 +128,565 @@ def get_listings(
         generation_slug: Specific generation identifier
         max_pages: Maximum number of pages to scrape (default: 100)
         progress_callback: Optional callback function for progress updates
+        concurrency: Number of pages fetched in parallel (default: 4)
+        parser: Listing parser engine, one of PAGE_PARSERS (default: DEFAULT_PARSER)
+        store: Optional listing store to upsert every scraped page into
+        incremental: Scrape newest-first and stop at the first page holding
+            only known, unchanged listings; the rest of the result is then
+            filled in from the store (requires store)
+        rollups: Optional rollup store every scraped page is folded into
         
     Returns:
-        List of dictionaries containing listing details
+        ListingTable of the listings, in page order (iterating it yields
+        listing dictionaries)
+    """
+    batches = []
+    for batch in iter_listing_pages(
+        make, model, year_from, year_to,
+        fuel_type=fuel_type,
+        gearbox=gearbox,
+        drive_type=drive_type,
+        first_owner=first_owner,
+        accident_free=accident_free,
+        generation_slug=generation_slug,
+        max_pages=max_pages,
+        progress_callback=progress_callback,
+        concurrency=concurrency,
+        parser=parser,
+        store=store,
+        incremental=incremental,
+        rollups=rollups
+    ):
+        batches.append(batch.listings)
+    return ListingTable.concat(batches)
+
+
+def iter_listing_pages(
+    make: str,
+    model: str,
+    year_from: int,
+    year_to: int,
+    fuel_type: Optional[str] = None,
+    gearbox: Optional[str] = None,
+    drive_type: Optional[str] = None,
+    first_owner: bool = False,
+    accident_free: bool = False,
+    generation_slug: Optional[str] = None,
+    max_pages: int = 100,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    parser: Optional[str] = None,
+    store: Optional[ListingStore] = None,
+    incremental: bool = False,
+    start_page: int = 1,
+    raise_on_error: bool = False,
+    profile: Optional[ProfileCapture] = None,
+    rollups: Optional[RollupStore] = None
+) -> Iterator[ListingBatch]:
     """
+    Scrape car listings from Otomoto.pl, yielding one batch per page.
+    
+    Takes the same arguments as get_listings, plus:
+        start_page: First page of the plan to fetch, to resume an
+            interrupted scrape
+        raise_on_error: Re-raise page fetch errors instead of quietly ending
+            the scrape, so callers can tell a failure from the last page
+        profile: Optional profile capture the page fetch threads report to
+        rollups: Optional rollup store every scraped page is folded into
+    
+    The page set is planned from the result count on page 1, so no request
+    goes past the last page. Searches with more pages than the site serves
+    (SITE_PAGE_LIMIT) are split into disjoint year-range or price-band
+    shards fetched in parallel (max_pages still bounds the total; an
+    incremental scrape stops paging each shard at its first page with
+    nothing new), and listings are deduplicated by id. Batches are yielded in
+    plan order as soon as each page is parsed, so callers can stream
+    results while later pages are still being fetched. Closing the
+    generator early cancels any outstanding page requests.
+    
+    Yields:
+        ListingBatch per non-empty page; an incremental scrape that stops
+        early ends with a batch of stored listings (from_store=True)
+    """
+    params, headers, state = _prepare_search(
+        make, model, year_from, year_to, fuel_type, gearbox, drive_type, first_owner, accident_free,
+        generation_slug, max_pages, store, incremental, rollups
+    )
+
+    # Page 1 reports the result count, so the page set is planned up front
+    # (split into shards when it exceeds the site's page limit). Planned
+    # pages are fetched through a sliding window of in-flight requests but
+    # consumed strictly in plan order; an empty page ends its shard.
+    # Request pacing is handled by the global rate limiter in http_client.
+    # Incremental scrapes consume page 1 alone and only open the window
+    # once it turns out to contain something new.
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+
+    def submit_task(fn: Callable[..., Any], *args: Any):
+        task = (fn,) + args
+        if profile is not None:
+            task = (profile.run,) + task
+        return executor.submit(*task)
+
+    try:
+        try:
+            with span('plan'):
+                plan = _plan_search(
+                    make, model, year_from, year_to, generation_slug, params, headers, parser,
+                    max_pages, submit_task
+                )
+        except Exception as e:
+            PAGES.inc(outcome='error')
+            print(f"Error planning search: {e}")
+            if raise_on_error:
+                raise
+            return
+
+        def start(task: PageTask) -> Future:
+            if task.listings is not None:
+                future = Future()
+                future.set_result(task.listings)
+                return future
+            url, shard_params = plan.requests[task.shard]
+            return submit_task(_scrape_page, url, dict(shard_params, page=task.page), headers, year_from, parser)
+
+        window = _PageWindow(plan, start_page, 1 if incremental else concurrency, progress_callback, start)
+        window.top_up()
+        while True:
+            item = window.pop()
+            if item is None:
+                break
+            page, task, future = item
+            try:
+                listings = future.result()
+            except Exception as e:
+                _page_failed(page, e, requests.RequestException)
+                if raise_on_error:
+                    raise
+                return
+
+            if not listings:
+                window.end_shard(page, task)
+                continue
+            batches, caught_up = state.process(page, listings)
+            # Open the window before handing the batch out, so fetching
+            # continues while the consumer processes it
+            if caught_up:
+                window.stop_shard(task)
+            else:
+                window.widen(concurrency)
+            yield from batches
+
+        batches = state.fill()
+        if batches and progress_callback:
+            progress_callback("No new listings left, loaded stored results.")
+        yield from batches
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _prepare_search(
+    make: str,
+    model: str,
+    year_from: int,
+    year_to: int,
+    fuel_type: Optional[str],
+    gearbox: Optional[str],
+    drive_type: Optional[str],
+    first_owner: bool,
+    accident_free: bool,
+    generation_slug: Optional[str],
+    max_pages: int,
+    store: Optional[ListingStore],
+    incremental: bool,
+    rollups: Optional[RollupStore]
+) -> Tuple[Dict[str, Any], Dict[str, str], '_ScrapeState']:
+    """Query parameters, headers and page bookkeeping of a scrape, for the thread and asyncio drivers."""
     base_url = _build_url(make, model, year_from, generation_slug)
     params = _build_params(year_to, fuel_type, gearbox, drive_type, first_owner, accident_free)
-    headers = _get_headers()
-    
-    all_listings = []
-    page = 1
+    if incremental and store is None:
+        raise ValueError("incremental scraping requires a listing store")
+    if incremental:
+        params['search[order]'] = NEWEST_FIRST_ORDER
+    key = search_key(base_url, params) if store is not None else None
+    state = _ScrapeState(make, model, generation_slug, store, key, incremental, rollups, max_pages)
+    return params, _get_headers(), state
+
+
+class SearchShard(NamedTuple):
+    """Disjoint slice of a search: a production year range and an optional price band (PLN)."""
+    year_from: int
+    year_to: int
+    price_from: Optional[int] = None
+    price_to: Optional[int] = None
+
+
+class PageTask(NamedTuple):
+    """One planned results page; listings is set for pages already fetched while planning."""
+    shard: int
+    page: int
+    listings: Optional[ListingTable] = None
+
+
+class SearchPlan(NamedTuple):
+    """Pages to fetch: (url, params) per shard and the page tasks in fetch order."""
+    requests: List[Tuple[str, Dict[str, Any]]]
+    tasks: List[PageTask]
+    total: Optional[int]
+
+
+class _PageWindow:
+    """
+    Planned pages fetched through a sliding window of in-flight requests but
+    consumed strictly in plan order; an empty page ends its shard.
+
+    Shared by the thread and asyncio drivers, which differ only in start:
+    it begins fetching one PageTask and returns a future of its listings.
+    """
+
+    def __init__(
+        self,
+        plan: SearchPlan,
+        start_page: int,
+        width: int,
+        progress_callback: Optional[Callable[[str], None]],
+        start: Callable[[PageTask], Any]
+    ):
+        self.plan = plan
+        self.tasks = plan.tasks[max(1, start_page) - 1:]
+        self.first_index = max(1, start_page)
+        self.width = max(1, width)
+        self.pending: Deque[Tuple[int, PageTask, Any]] = deque()
+        self.ended_shards = set()
+        self._next = 0
+        self._progress = progress_callback
+        self._start = start
+
+    def top_up(self) -> None:
+        """Start planned pages until width are in flight."""
+        while self._next < len(self.tasks) and len(self.pending) < self.width:
+            task = self.tasks[self._next]
+            if task.shard not in self.ended_shards:
+                index = self.first_index + self._next
+                if self._progress:
+                    if self.plan.total is None:
+                        self._progress(f"Scraping page {index}...")
+                    else:
+                        self._progress(f"Scraping page {index} of {len(self.plan.tasks)}...")
+                self.pending.append((index, task, self._start(task)))
+            self._next += 1
+
+    def pop(self) -> Optional[Tuple[int, PageTask, Any]]:
+        """Next (page number, task, future) in plan order, or None when done."""
+        while self.pending:
+            page, task, future = self.pending.popleft()
+            if task.shard in self.ended_shards:
+                future.cancel()
+                continue
+            return page, task, future
+        return None
+
+    def end_shard(self, page: int, task: PageTask) -> None:
+        """Record an empty page: its shard has no further pages."""
+        PAGES.inc(outcome='empty')
+        print(f"No listings found on page {page}. Stopping pagination.")
+        self.stop_shard(task)
+
+    def stop_shard(self, task: PageTask) -> None:
+        """Fetch no further pages of the task's shard."""
+        self.ended_shards.add(task.shard)
+        self.top_up()
+
+    def widen(self, width: int) -> None:
+        """Let width pages be in flight (incremental scrapes start with one) and start them."""
+        self.width = max(1, width)
+        self.top_up()
+
+    def cancel(self) -> None:
+        for _, _, future in self.pending:
+            future.cancel()
+
+
+def _page_failed(page: int, error: Exception, fetch_errors: Any) -> None:
+    """Count and log a page that could not be fetched or parsed."""
+    PAGES.inc(outcome='error')
+    if isinstance(error, fetch_errors):
+        print(f"Error fetching page {page}: {error}")
+    else:
+        print(f"Unexpected error on page {page}: {error}")
+
+
+def extract_result_count(content: bytes) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Read the result count of a search off one of its results pages.
     
-    while page <= max_pages:
-        params['page'] = page
-        
-        if progress_callback:
-            progress_callback(f"Scraping page {page}...")
+    Args:
+        content: Raw HTML of a results page
         
-        try:
-            listings = _scrape_page(base_url, params, headers, year_from)
-            
+    Returns:
+        (total listings, listings per page) from the AdvertSearchOutput in
+        the page's __NEXT_DATA__; either is None if the page lacks it
+    """
+    next_data = extract_next_data(content)
+    if next_data is None:
+        return None, None
+    for node in iter_dicts(urql_payloads(next_data)):
+        total = node.get('totalCount')
+        if isinstance(total, int) and not isinstance(total, bool):
+            page_info = node.get('pageInfo')
+            page_size = page_info.get('pageSize') if isinstance(page_info, dict) else None
+            if not isinstance(page_size, int) or page_size <= 0:
+                page_size = None
+            return total, page_size
+    return None, None
+
+
+class _ScrapeState:
+    """
+    Bookkeeping of one scrape as its pages are consumed: dedupe, rollups,
+    store and the incremental stop.
+
+    An incremental scrape stops paging a shard at its first page with
+    nothing new; once every shard has stopped, fill() supplies the rest from
+    the store: at most max_pages worth of listings, and only those its
+    search saw within INCREMENTAL_WINDOW. If the store has none that recent,
+    the scrape carries on as a full one instead.
+    """
+
+    def __init__(
+        self,
+        make: str,
+        model: str,
+        generation_slug: Optional[str],
+        store: Optional[ListingStore],
+        key: Optional[str],
+        incremental: bool,
+        rollups: Optional[RollupStore],
+        max_pages: int
+    ):
+        self.make = make
+        self.model = model
+        self.generation_slug = generation_slug
+        self.store = store
+        self.key = key
+        self.incremental = incremental
+        self.rollups = rollups
+        self.max_listings = max(1, max_pages) * DEFAULT_PAGE_SIZE
+        self.seen_ids = []
+        self.caught_up_page: Optional[int] = None
+        self._seen = set()
+
+    def process(self, page: int, listings: ListingTable) -> Tuple[List[ListingBatch], bool]:
+        """Record a non-empty page; return the batches to yield and whether its shard has nothing new left."""
+        PAGES.inc(outcome='ok')
+        # Promoted cards are repeated across (and within) pages, and listings
+        # move between pages while a search is being paged through
+        fresh = []
+        for i, listing_id in enumerate(listings.ids):
+            if listing_id not in self._seen:
+                self._seen.add(listing_id)
+                fresh.append(i)
+        duplicates = len(listings) - len(fresh)
+        if duplicates:
+            LISTINGS_DEDUPLICATED.inc(duplicates)
+            listings = listings.take(fresh)
             if not listings:
-                print(f"No listings found on page {page}. Stopping pagination.")
-                break
-            
-            all_listings.extend(listings)
-            print(f"Found {len(listings)} listings on page {page}")
-            
-            time.sleep(0.5)  # Be nice to the server
-            page += 1
-            
-        except requests.RequestException as e:
-            print(f"Error fetching page {page}: {e}")
-            break
-        except Exception as e:
-            print(f"Unexpected error on page {page}: {e}")
-            break
+                print(f"Page {page} only repeats listings already found")
+                return [], False
+        self.seen_ids.extend(listings.ids)
+        print(f"Found {len(listings)} listings on page {page}"
+              + (f" (dropped {duplicates} already found)" if duplicates else ""))
+
+        if self.rollups is not None:
+            with span('rollup'):
+                self.rollups.add(listings, self.make, self.model, self.generation_slug)
+
+        if self.store is not None:
+            with span('store'):
+                statuses = self.store.upsert_listings(listings, self.key)
+            if self.incremental and all(status == STATUS_UNCHANGED for status in statuses.values()):
+                if len(self.seen_ids) >= self.max_listings or self._stored(limit=1):
+                    print(f"Page {page} has no new listings; stopping its shard.")
+                    self.caught_up_page = max(page, self.caught_up_page or 0)
+                    return [ListingBatch(page, listings)], True
+                print(f"Page {page} has no new listings, but none are stored from the last "
+                      f"{INCREMENTAL_WINDOW}; scraping the remaining pages.")
+                self.incremental = False
+        return [ListingBatch(page, listings)], False
+
+    def fill(self) -> List[ListingBatch]:
+        """Stored listings completing an incremental scrape that caught up ([] if it did not)."""
+        limit = self.max_listings - len(self.seen_ids)
+        if self.caught_up_page is None or limit <= 0:
+            return []
+        known = self._stored(limit)
+        if not known:
+            return []
+        print(f"Using {len(known)} stored listings.")
+        known = ListingTable.from_records(known)
+        if self.rollups is not None:
+            # Still listed today, so counted on today's rollups too
+            with span('rollup'):
+                self.rollups.add(known, self.make, self.model, self.generation_slug,
+                                 day=datetime.now().strftime('%Y-%m-%d'))
+        return [ListingBatch(self.caught_up_page, known, from_store=True)]
+
+    def _stored(self, limit: int) -> List[Dict[str, Any]]:
+        """Recent stored listings of the search not scraped this time."""
+        with span('store'):
+            return self.store.get_search_listings(
+                self.key, exclude_ids=self.seen_ids, max_age=INCREMENTAL_WINDOW, limit=limit
+            )
+
+
+ProbeResult = Tuple[ListingTable, Optional[int], Optional[int]]
+
+
+def _search_planner(
+    make: str,
+    model: str,
+    year_from: int,
+    year_to: int,
+    generation_slug: Optional[str],
+    params: Dict[str, Any],
+    max_pages: int
+) -> Generator[List[SearchShard], List[ProbeResult], SearchPlan]:
+    """
+    Plan the exact page set of a search from the result count on its page 1.
     
-    return all_listings
+    A generator, so thread and asyncio drivers can share it: it yields
+    rounds of shards whose page 1 must be probed and is sent back their
+    _probe_page results, in order; its return value is the plan.
+    Searches whose result count on page 1 comes to more pages than
+    SITE_PAGE_LIMIT are split into year ranges and then price bands until
+    every shard fits, or until there are max_pages shards (each costs a
+    probe of its page 1). The page 1 of every shard is kept
+    as its first task; a plan over max_pages keeps page 1 of every shard,
+    then page 2 and so on, so the budget is spread over the whole search.
+    Pages without a result count fall back to fetching up to max_pages
+    until the first empty page.
+    """
+    root = SearchShard(year_from, year_to)
+    [(first, total, page_size)] = yield [root]
+    if total is None:
+        tasks = [PageTask(0, 1, first)] + [PageTask(0, page) for page in range(2, max_pages + 1)]
+        return SearchPlan([(_build_url(make, model, year_from, generation_slug), params)], tasks, None)
+
+    page_size = page_size or len(first) or DEFAULT_PAGE_SIZE
+    shards = 1
+    accepted: List[Tuple[SearchShard, ListingTable, int]] = []
+    frontier = [(root, first, total)]
+    while frontier:
+        parts = []
+        for search, listings, count in frontier:
+            pages = -(-count // page_size)
+            halves = _split_shard(search) if pages > SITE_PAGE_LIMIT and shards < max_pages else []
+            if halves:
+                shards += 1
+                parts.extend(halves)
+                continue
+            if pages > SITE_PAGE_LIMIT:
+                print(f"Search ({search.year_from}-{search.year_to}) has {count} listings, but the site "
+                      f"serves only {SITE_PAGE_LIMIT} pages of them.")
+            accepted.append((search, listings, min(pages, SITE_PAGE_LIMIT)))
+        results = (yield parts) if parts else []
+        frontier = [(part, listings, count if count is not None else page_size * SITE_PAGE_LIMIT)
+                    for part, (listings, count, _) in zip(parts, results)]
+
+    accepted.sort(key=lambda item: (item[0].year_from, item[0].price_from or 0))
+    shard_requests: List[Tuple[str, Dict[str, Any]]] = []
+    tasks: List[PageTask] = []
+    for index, (search, listings, pages) in enumerate(accepted):
+        shard_requests.append(_shard_request(search, make, model, generation_slug, params))
+        tasks.extend(PageTask(index, page, listings if page == 1 else None) for page in range(1, pages + 1))
+    if len(tasks) > max_pages:
+        print(f"Search has {total} listings on {len(tasks)} pages; fetching {max_pages} of them.")
+        # Stable sort: page 1 of every shard (already fetched), then page 2, ...
+        tasks = sorted(tasks, key=lambda task: task.page)[:max_pages]
+    if len(accepted) > 1:
+        print(f"Search has {total} listings; split into {len(accepted)} shards, {len(tasks)} pages.")
+    SEARCH_SHARDS.inc(len(accepted))
+    PLANNED_PAGES.inc(len(tasks))
+    return SearchPlan(shard_requests, tasks, total)
+
+
+def _plan_search(
+    make: str,
+    model: str,
+    year_from: int,
+    year_to: int,
+    generation_slug: Optional[str],
+    params: Dict[str, Any],
+    headers: Dict[str, str],
+    parser: Optional[str],
+    max_pages: int,
+    submit_task: Callable[..., Any]
+) -> SearchPlan:
+    """Run _search_planner, probing each round of shards in parallel through submit_task."""
+    planner = _search_planner(make, model, year_from, year_to, generation_slug, params, max_pages)
+    try:
+        shards = next(planner)
+        while True:
+            futures = [submit_task(_probe_page, *_shard_request(search, make, model, generation_slug, params),
+                                   headers, year_from, parser) for search in shards]
+            shards = planner.send([future.result() for future in futures])
+    except StopIteration as stop:
+        return stop.value
+
+
+def _shard_request(
+    search: SearchShard,
+    make: str,
+    model: str,
+    generation_slug: Optional[str],
+    params: Dict[str, Any]
+) -> Tuple[str, Dict[str, Any]]:
+    """URL and query parameters of one shard of a search."""
+    shard_params = dict(params)
+    shard_params[YEAR_TO_PARAM] = search.year_to
+    if search.price_from is not None:
+        shard_params[PRICE_FROM_PARAM] = search.price_from
+    if search.price_to is not None:
+        shard_params[PRICE_TO_PARAM] = search.price_to
+    return _build_url(make, model, search.year_from, generation_slug), shard_params
+
+
+def _split_shard(search: SearchShard) -> List[SearchShard]:
+    """Halve a shard's year range, or its price band once it spans one year ([] if too narrow to split)."""
+    if search.year_from < search.year_to:
+        middle = (search.year_from + search.year_to) // 2
+        return [search._replace(year_to=middle), search._replace(year_from=middle + 1)]
+    low = search.price_from or 0
+    if search.price_to is None:
+        # Open-ended top band: peel off a bounded band below it
+        cut = max(2 * low, FIRST_PRICE_CUT)
+        return [search._replace(price_from=low, price_to=cut), search._replace(price_from=cut + 1)]
+    if search.price_to - low < MIN_PRICE_BAND:
+        return []
+    middle = (low + search.price_to) // 2
+    return [search._replace(price_from=low, price_to=middle), search._replace(price_from=middle + 1)]
+
+
+def _probe_page(
+    base_url: str,
+    params: Dict[str, Any],
+    headers: Dict[str, str],
+    year_from: int,
+    parser: Optional[str] = None
+) -> ProbeResult:
+    """Scrape page 1 of a search: (listings, total count, page size), as in extract_result_count."""
+    content = fetch(base_url, params=dict(params, page=1), headers=headers, endpoint='listings')
+    listings = parse_listings_page(content, year_from, parser)
+    total, page_size = extract_result_count(content)
+    with span('table_build'):
+        return ListingTable.from_records(listings, year_from=year_from), total, page_size
 
 
 def _build_url(make: str, model: str, year_from: int, generation_slug: Optional[str]) -> str:
     """Build the base URL for scraping."""
     if generation_slug:
-        return f"https://www.otomoto.pl/osobowe/{make}/{model}/{generation_slug}/od-{year_from}"
-    return f"https://www.otomoto.pl/osobowe/{make}/{model}/od-{year_from}"
+        return f"{BASE_URL}/osobowe/{make}/{model}/{generation_slug}/od-{year_from}"
+    return f"{BASE_URL}/osobowe/{make}/{model}/od-{year_from}"
 
 
 def _build_params(
@@ -105,7 +698,7 @@ def _build_params(
     accident_free: bool
 ) -> Dict[str, Any]:
     """Build query parameters for the request."""
-    params = {"search[filter_float_year:to]": year_to}
+    params = {YEAR_TO_PARAM: year_to}
     
     if fuel_type:
         params["search[filter_enum_fuel_type]"] = fuel_type
@@ -123,38 +716,99 @@ def _build_params(
 
 def _get_headers() -> Dict[str, str]:
     """Get HTTP headers for requests."""
-    return {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                     "(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
+    return {"User-Agent": USER_AGENT}
 
 
 def _scrape_page(
     base_url: str,
     params: Dict[str, Any],
     headers: Dict[str, str],
-    year_from: int
+    year_from: int,
+    parser: Optional[str] = None,
+    endpoint: str = 'listings'
+) -> ListingTable:
+    """Scrape a single page of listings into a table (endpoint picks the page cache TTL)."""
+    content = fetch(base_url, params=params, headers=headers, endpoint=endpoint)
+    listings = parse_listings_page(content, year_from, parser)
+    with span('table_build'):
+        return ListingTable.from_records(listings, year_from=year_from)
+
+
+def parse_listings_page(
+    content: bytes,
+    year_from: int,
+    parser: Optional[str] = None,
+    memo: Optional[ParseMemo] = None
 ) -> List[Dict[str, Any]]:
-    """Scrape a single page of listings."""
-    response = requests.get(base_url, params=params, headers=headers, timeout=30)
-    response.raise_for_status()
+    """
+    Parse all listing cards out of a search results page.
     
-    soup = BeautifulSoup(response.content, 'html.parser')
-    articles = soup.find_all('article', attrs={'data-id': True})
-    
-    if not articles:
-        return []
+    Cards found in the parse memo (same listing id and card HTML) are
+    reused; only the others are parsed, as one document of just those
+    cards.
     
+    Args:
+        content: Raw HTML of the results page
+        year_from: Fallback production year for cards without one
+        parser: Engine name from PAGE_PARSERS (default: DEFAULT_PARSER)
+        memo: Parse memo (default: the process-wide one, if enabled)
+        
+    Returns:
+        List of listing dictionaries, empty if the page has no cards
+    """
+    parser = parser or DEFAULT_PARSER
+    memo = memo or _parse_memo
     scrape_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    listings = []
+    cards = _split_cards(content) if memo is not None else None
+    if not cards:
+        # No memo, or markup the splitter does not recognise: parse the page as is
+        listings = PAGE_PARSERS[parser](content, scrape_date, year_from)
+        LISTINGS_PARSED.inc(len(listings), parser=parser)
+        return listings
+
+    keys = [card_key(listing_id, html, year_from) for listing_id, html in cards]
+    found = [memo.get(key) for key in keys]
+    missing = [i for i, listing in enumerate(found) if listing is None]
+    if missing:
+        document = b''.join([_CARDS_HEAD] + [cards[i][1] for i in missing] + [_CARDS_TAIL])
+        parsed = PAGE_PARSERS[parser](document, scrape_date, year_from)
+        LISTINGS_PARSED.inc(len(parsed), parser=parser)
+        # Cards that failed to parse are missing from the output; match the rest by id, in order
+        position = 0
+        for i in missing:
+            if position < len(parsed) and parsed[position]['id'] == cards[i][0]:
+                found[i] = parsed[position]
+                memo.put(keys[i], parsed[position])
+                position += 1
+    return [dict(listing, scrape_date=scrape_date) for listing in found if listing is not None]
+
+
+def _split_cards(content: bytes) -> List[Tuple[str, bytes]]:
+    """(listing id, raw HTML) of every listing card of a page, in document order."""
+    cards = []
+    for match in _CARD_RE.finditer(content):
+        listing_id = _CARD_ID_RE.search(match.group(1))
+        if listing_id is not None:
+            cards.append((listing_id.group(1).decode('utf-8', 'replace'), match.group(0)))
+    return cards
+
+
+def _parse_page_bs4(content: bytes, scrape_date: str, year_from: int) -> List[Dict[str, Any]]:
+    """Parse a results page with BeautifulSoup (pure-Python fallback engine)."""
+    with span('html_parse'):
+        soup = BeautifulSoup(content, 'html.parser')
+        articles = soup.find_all('article', attrs={'data-id': True})
     
-    for article in articles:
-        try:
-            listing = _parse_listing(article, scrape_date, year_from)
-            listings.append(listing)
-        except Exception as e:
-            print(f"Error parsing listing: {e}")
-            continue
+    listings = []
+    with span('listing_parse'):
+        for article in articles:
+            try:
+                listing = _parse_listing(article, scrape_date, year_from)
+                listings.append(listing)
+            except Exception as e:
+                LISTING_PARSE_ERRORS.inc(parser='bs4')
+                print(f"Error parsing listing: {e}")
+                continue
     
     return listings
 
@@ -202,7 +856,7 @@ def _parse_listing(article, scrape_date: str, year_from: int) -> Dict[str, Any]:
         location_candidates = article.find_all(['p', 'span'])
         for cand in location_candidates:
             text = cand.get_text(strip=True)
-            match = re.search(r'\(([^)]+)\)', text)
+            match = _REGION_RE.search(text)
             if match and len(text) < 60: # Limit length to avoid catching long descriptions
                 region = match.group(1)
                 break
@@ -244,6 +898,127 @@ def _parse_listing(article, scrape_date: str, year_from: int) -> Dict[str, Any]:
     }
 
 
+def _parse_page_lxml(content: bytes, scrape_date: str, year_from: int) -> List[Dict[str, Any]]:
+    """Parse a results page with lxml, visiting each card's subtree once."""
+    if not content.strip():
+        return []
+    with span('html_parse'):
+        doc = lxml_html.document_fromstring(content, parser=_LXML_PARSER)
+    
+    listings = []
+    with span('listing_parse'):
+        for article in doc.iter('article'):
+            if article.get('data-id') is None:
+                continue
+            try:
+                listings.append(_parse_listing_lxml(article, scrape_date, year_from))
+            except Exception as e:
+                LISTING_PARSE_ERRORS.inc(parser='lxml')
+                print(f"Error parsing listing: {e}")
+                continue
+    
+    return listings
+
+
+def _parse_listing_lxml(article, scrape_date: str, year_from: int) -> Dict[str, Any]:
+    """
+    Single-pass equivalent of _parse_listing for an lxml element.
+    
+    Walks the card once, remembering the first h2/h3, the first dd per
+    data-parameter, feature badges and the first location-like line, and
+    mirrors BeautifulSoup's get_text(strip=True) / .string semantics so both
+    engines return identical dictionaries.
+    """
+    h2 = h3 = None
+    parameters = {}
+    region = None
+    accident_free_val = False
+    first_owner_val = False
+    
+    for elem in article.iter():
+        tag = elem.tag
+        if tag == 'dd':
+            name = elem.get('data-parameter')
+            if name is not None and name not in parameters:
+                parameters[name] = elem
+        elif tag == 'p' or tag == 'span':
+            if region is None:
+                text = _lxml_text(elem)
+                match = _REGION_RE.search(text)
+                if match and len(text) < 60:
+                    region = match.group(1)
+        elif tag == 'li':
+            if 'parameter-feature-item' in (elem.get('class') or '').split():
+                string = _lxml_string(elem)
+                if string == 'Bezwypadkowy':
+                    accident_free_val = True
+                elif string == 'Pierwszy właściciel':
+                    first_owner_val = True
+        elif tag == 'h2':
+            if h2 is None:
+                h2 = elem
+        elif tag == 'h3':
+            if h3 is None:
+                h3 = elem
+    
+    title_elem = h2.find('.//a') if h2 is not None else None
+    if title_elem is None:
+        raise ValueError("listing has no title link")
+    title = _lxml_text(title_elem)
+    link = title_elem.attrib['href']
+    
+    price_text = _lxml_text(h3) if h3 is not None else "N/A"
+    
+    def param_text(name: str, default: str) -> str:
+        elem = parameters.get(name)
+        return _lxml_text(elem) if elem is not None else default
+    
+    mileage_text = param_text('mileage', "N/A")
+    
+    return {
+        "id": article.get('data-id'),
+        "scrape_date": scrape_date,
+        "title": title,
+        "price_text": price_text,
+        "price": _parse_price(price_text),
+        "year": param_text('year', str(year_from)),
+        "mileage_text": mileage_text,
+        "mileage": _parse_mileage(mileage_text),
+        "fuel": param_text('fuel_type', "N/A"),
+        "gearbox": param_text('gearbox', "N/A"),
+        "drive": param_text('drive', "N/A"),
+        "region": region if region is not None else "N/A",
+        "accident_free": accident_free_val or 'no_accident' in parameters,
+        "first_owner": first_owner_val or 'original_owner' in parameters,
+        "link": link
+    }
+
+
+def _lxml_text(elem) -> str:
+    """Equivalent of BeautifulSoup's get_text(strip=True)."""
+    return ''.join(part.strip() for part in elem.itertext())
+
+
+def _lxml_string(elem) -> Optional[str]:
+    """Equivalent of BeautifulSoup's Tag.string (sole text descendant or None)."""
+    children = list(elem)
+    if not children:
+        return elem.text
+    if len(children) == 1 and not elem.text and not children[0].tail:
+        return _lxml_string(children[0])
+    return None
+
+
+PAGE_PARSERS: Dict[str, Callable[[bytes, str, int], List[Dict[str, Any]]]] = {
+    'bs4': _parse_page_bs4,
+}
+if lxml_html is not None:
+    _LXML_PARSER = lxml_html.HTMLParser(encoding='utf-8')
+    PAGE_PARSERS['lxml'] = _parse_page_lxml
+
+DEFAULT_PARSER = os.environ.get('OTOMOTO_PARSER') or ('lxml' if lxml_html is not None else 'bs4')
+
+
 def _parse_price(price_text: str) -> float:
     """Parse price text to float value."""
     try:
@@ -267,196 +1042,90 @@ def _parse_mileage(mileage_text: str) -> int:
 
 def get_makes() -> List[Dict[str, str]]:
     """Fetch all available car makes from Otomoto."""
-    url = "https://www.otomoto.pl/osobowe"
-    return _extract_filter_data(url, 'filter_enum_make')
+    makes = _extract_filter_data(None, None, MAKE_FILTER)
+    if not makes:
+        # Offline with an empty index: fall back to the bundled make list
+        makes = [{'id': slug, 'name': slug.replace('-', ' ').title()} for slug in car_data.models_dict]
+    return makes
 
 
 def get_models(make: str) -> List[Dict[str, str]]:
     """Fetch models for a given make from Otomoto."""
-    url = f"https://www.otomoto.pl/osobowe/{make}"
-    return _extract_filter_data(url, 'filter_enum_model')
+    return _extract_filter_data(make, None, MODEL_FILTER)
 
 
 def get_generations(make: str, model: str) -> List[Dict[str, str]]:
     """Fetch generations for a given make and model from Otomoto."""
-    url = f"https://www.otomoto.pl/osobowe/{make}/{model}"
-    return _extract_filter_data(url, 'filter_enum_generation')
-
-
-def _extract_filter_data(url: str, filter_id: str) -> List[Dict[str, str]]:
-    """Helper to extract filter data from NEXT_DATA in a page with caching."""
-    # Check cache
-    cache_key = f"{url}:{filter_id}"
-    if cache_key in _metadata_cache:
-        timestamp, data = _metadata_cache[cache_key]
-        if datetime.now() - timestamp < CACHE_TTL:
-            return data
-
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                     "(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
-    try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        script_tag = soup.find('script', id='__NEXT_DATA__')
-        if not script_tag:
-            return []
-        
-        data = json.loads(script_tag.string)
-        urql_state = data.get('props', {}).get('pageProps', {}).get('urqlState', {})
-        
-        # Parse conditions for better matching if model-specific
-        url_parts = url.split('/')
-        make = url_parts[4] if len(url_parts) > 4 else None
-        model = url_parts[5] if len(url_parts) > 5 else None
-        
-        all_values = {}
-        
-        for v in urql_state.values():
-            if isinstance(v, dict) and 'data' in v:
-                try:
-                    inner_data = json.loads(v['data'])
-                    found_filters = _find_filters_recursive(inner_data, filter_id)
-                    for f in found_filters:
-                        # Check conditions if present
-                        if not _matches_conditions(f, make, model):
-                            continue
-                            
-                        vals = _extract_values_from_filter(f)
-                        for val in vals:
-                            # Keep most generic or most complete name
-                            all_values[val['id']] = val['name']
-                except:
-                    continue
-        
-        res = []
-        if all_values:
-            res = [{'id': k, 'name': v} for k, v in sorted(all_values.items(), key=lambda x: x[1])]
-        
-        # If not found in urqlState, try AlternativeLinks as fallback for models
-        if not res and filter_id == 'filter_enum_model' and make:
-            res = _extract_from_alternative_links(data, make_slug=make)
+    return _extract_filter_data(make, model, GENERATION_FILTER)
 
-        # Cache results if successful
-        if res:
-            _metadata_cache[cache_key] = (datetime.now(), res)
-            
-        return res
 
-    except Exception as e:
-        print(f"Error extracting filter {filter_id} from {url}: {e}")
+def prewarm_metadata(makes: Optional[List[str]] = None, top_makes: int = 20, top_models: int = 5) -> None:
+    """
+    Populate the metadata cache and taxonomy index ahead of user requests.
     
-    return []
+    Args:
+        makes: Make slugs whose models to load (default: the most-listed makes)
+        top_makes: Number of most-listed makes to load when makes is None
+        top_models: Number of most-listed models per make to load generations for
+    """
+    if makes is None:
+        ranked_makes = sorted(get_makes(), key=lambda m: _listing_counter(m['name']), reverse=True)
+        makes = [m['id'] for m in ranked_makes[:top_makes]]
+    for make in makes:
+        models = get_models(make)
+        ranked = sorted(models, key=lambda m: _listing_counter(m['name']), reverse=True)
+        for model in ranked[:top_models]:
+            get_generations(make, model['id'])
+    print("Metadata cache prewarmed.")
 
 
-def _matches_conditions(filter_obj: Dict[str, Any], make: Optional[str], model: Optional[str]) -> bool:
-    """Check if the filter object matches the given make and model conditions."""
-    conditions = filter_obj.get('conditions', [])
-    if not conditions:
-        return True # Assume it's a global filter or correctly scoped if no conditions
-        
-    for cond in conditions:
-        f_id = cond.get('filterId')
-        val = cond.get('value')
-        if f_id == 'filter_enum_make' and make and val != make:
-            return False
-        if f_id == 'filter_enum_model' and model and val != model:
-            return False
-    return True
+def _listing_counter(name: str) -> int:
+    """Extract the trailing listing counter from names like 'Seria 3 (1234)'."""
+    match = re.search(r'\((\d+)\)$', name)
+    return int(match.group(1)) if match else 0
 
 
-def _find_filters_recursive(obj: Any, target_id: str) -> List[Dict[str, Any]]:
-    """Recursively find all filter objects with a specific ID or filterId."""
-    results = []
-    if isinstance(obj, dict):
-        # We look for AdvertSearchFilter (id) or OpenForInputFilterState (filterId)
-        if obj.get('id') == target_id or obj.get('filterId') == target_id:
-            results.append(obj)
-        for v in obj.values():
-            results.extend(_find_filters_recursive(v, target_id))
-    elif isinstance(obj, list):
-        for item in obj:
-            results.extend(_find_filters_recursive(item, target_id))
-    return results
-
-
-def _extract_values_from_filter(filter_obj: Dict[str, Any]) -> List[Dict[str, str]]:
-    """Extract label/value pairs from a filter object, including counter if present."""
-    values = []
-    raw_values = filter_obj.get('values', [])
-    for val in raw_values:
-        if not isinstance(val, dict):
-            continue
-            
-        if val.get('__typename') == 'AdvertSearchFilterValue':
-            name = val.get('name')
-            counter = val.get('counter')
-            if counter is not None:
-                name = f"{name} ({counter})"
-            values.append({
-                'id': val.get('id'),
-                'name': name
-            })
-        elif val.get('__typename') == 'AdvertSearchFilterValuesGroup':
-            for gv in val.get('values', []):
-                if isinstance(gv, dict):
-                    name = gv.get('name')
-                    counter = gv.get('counter')
-                    if counter is not None:
-                        name = f"{name} ({counter})"
-                    values.append({
-                        'id': gv.get('id'),
-                        'name': name
-                    })
-    return values
-
-
-def _extract_from_alternative_links(next_data: Dict[str, Any], make_slug: str) -> List[Dict[str, str]]:
-    """Fallback extraction from AlternativeLinksBlock (often models) if urqlState fails."""
-    import re
+def _extract_filter_data(make: Optional[str], model: Optional[str], filter_id: str) -> List[Dict[str, str]]:
+    """Values of one filter on the make/model category page, via cache and index."""
+    scope = taxonomy_scope(make, model)
+    filters = _metadata_cache.get(scope, lambda: _load_page_taxonomy(make, model), default={})
+    return filters.get(filter_id, [])
+
+
+def _load_page_taxonomy(make: Optional[str], model: Optional[str]) -> Dict[str, List[Dict[str, str]]]:
+    """
+    All filter values of a category page: from the taxonomy index while it is
+    fresh, otherwise downloaded, extracted in one pass and indexed. A failed
+    download falls back to whatever the index has, however old.
+    """
+    index = get_taxonomy_index()
+    scope = taxonomy_scope(make, model)
+    indexed = index.get(scope)
+    if indexed is not None and indexed[0] < CACHE_TTL.total_seconds():
+        return indexed[1]
+
+    url = '/'.join([f"{BASE_URL}/osobowe"] + [part for part in (make, model) if part])
     try:
-        # Search for AlternativeLinksBlock in props
-        def find_alt_links(obj):
-            if isinstance(obj, dict):
-                if obj.get('__typename') == 'AlternativeLinksBlock' and (obj.get('name') == 'model-generations' or obj.get('name') == 'models'):
-                    return obj
-                for v in obj.values():
-                    res = find_alt_links(v)
-                    if res: return res
-            elif isinstance(obj, list):
-                for item in obj:
-                    res = find_alt_links(item)
-                    if res: return res
-            return None
-
-        alt_block = find_alt_links(next_data)
-        if not alt_block:
-            return []
-            
-        models = []
-        # Pattern to extract model slug from URL: /osobowe/make/model-slug
-        pattern = re.compile(rf"/osobowe/{make_slug}/([^/?#\s]+)")
-        
-        for link in alt_block.get('links', []):
-            url = link.get('url', '')
-            match = pattern.search(url)
-            if match:
-                model_slug = match.group(1)
-                # Filter out regions or other things
-                if any(region in model_slug for region in ['mazowieckie', 'slaskie', 'wielkopolskie']):
-                    continue
-                
-                name = link.get('title', model_slug)
-                # Cleanup name
-                clean_name = name.replace(make_slug.capitalize(), '').strip()
-                
-                models.append({
-                    'id': model_slug,
-                    'name': clean_name if clean_name else model_slug
-                })
-        return models
-    except:
-        return []
+        content = fetch(url, headers=_get_headers(), endpoint='taxonomy')
+        with span('taxonomy_extract'):
+            filters = extract_page_taxonomy(content, make, model)
+    except Exception as e:
+        print(f"Error extracting filters from {url}: {e}")
+        filters = {}
+
+    if filters:
+        try:
+            index.update(scope, filters)
+        except OSError as e:
+            print(f"Error saving the taxonomy index: {e}")
+        return filters
+    return indexed[1] if indexed is not None else {}
+
+
+def _find_filters_recursive(obj: Any, target_id: str) -> List[Dict[str, Any]]:
+    """Find all filter objects with a specific ID or filterId (iterative, document order)."""
+    # We look for AdvertSearchFilter (id) or OpenForInputFilterState (filterId)
+    return [
+        node for node in iter_dicts(obj)
+        if node.get('id') == target_id or node.get('filterId') == target_id
+    ]
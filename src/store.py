@@ -0,0 +1,201 @@
+"""
+Persistent SQLite store for scraped listings.
+
+Listings are keyed by their Otomoto ``data-id`` and upserted on every scrape,
+keeping first/last-seen timestamps and a price-change history. Each search
+remembers which listings it returned, so an incremental scrape can stop at
+the first page with nothing new and fill in the rest from the store.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+DEFAULT_DB_PATH = os.environ.get('OTOMOTO_DB_PATH', os.path.join('data', 'otomoto.db'))
+
+# Stored listings not seen by a search for this long are presumed sold
+STALE_AFTER = timedelta(days=7)
+# An incremental scrape only fills in stored listings its search saw this recently
+INCREMENTAL_WINDOW = timedelta(hours=float(os.environ.get('OTOMOTO_INCREMENTAL_WINDOW_HOURS', '24')))
+
+STATUS_NEW = 'new'
+STATUS_CHANGED = 'changed'
+STATUS_UNCHANGED = 'unchanged'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    price REAL NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS price_history (
+    listing_id TEXT NOT NULL,
+    price REAL NOT NULL,
+    observed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_price_history_listing ON price_history (listing_id);
+CREATE TABLE IF NOT EXISTS search_listings (
+    search_key TEXT NOT NULL,
+    listing_id TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    PRIMARY KEY (search_key, listing_id)
+);
+"""
+
+
+def search_key(base_url: str, params: Dict[str, Any]) -> str:
+    """Stable key for a search, ignoring pagination and sort order."""
+    relevant = sorted(
+        (k, str(v)) for k, v in params.items()
+        if k not in ('page', 'search[order]')
+    )
+    raw = json.dumps([base_url, relevant])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class ListingStore:
+    """Thread-safe wrapper around the listings database."""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    def upsert_listings(
+        self,
+        listings: Iterable[Dict[str, Any]],
+        search: Optional[str] = None
+    ) -> Dict[str, str]:
+        """
+        Insert or update listings and record price changes.
+
+        Args:
+            listings: Listing dictionaries as produced by the scraper, or a
+                ListingTable
+            search: Optional search key the listings were returned for
+
+        Returns:
+            Mapping of listing id to 'new', 'changed' or 'unchanged'; when a
+            search key is given, listings not yet linked to it count as 'new'
+        """
+        now = datetime.now().isoformat(timespec='seconds')
+        statuses = {}
+        with self._lock, self._conn:
+            for listing in listings:
+                listing_id = listing['id']
+                price = listing.get('price') or 0.0
+                row = self._conn.execute(
+                    'SELECT price FROM listings WHERE id = ?', (listing_id,)
+                ).fetchone()
+
+                if row is None:
+                    statuses[listing_id] = STATUS_NEW
+                    self._conn.execute(
+                        'INSERT INTO listings (id, data, price, first_seen, last_seen) VALUES (?, ?, ?, ?, ?)',
+                        (listing_id, json.dumps(listing), price, now, now)
+                    )
+                    self._conn.execute(
+                        'INSERT INTO price_history (listing_id, price, observed_at) VALUES (?, ?, ?)',
+                        (listing_id, price, now)
+                    )
+                else:
+                    changed = row[0] != price
+                    statuses[listing_id] = STATUS_CHANGED if changed else STATUS_UNCHANGED
+                    if search and not changed and self._conn.execute(
+                        'SELECT 1 FROM search_listings WHERE search_key = ? AND listing_id = ?',
+                        (search, listing_id)
+                    ).fetchone() is None:
+                        statuses[listing_id] = STATUS_NEW
+                    self._conn.execute(
+                        'UPDATE listings SET data = ?, price = ?, last_seen = ? WHERE id = ?',
+                        (json.dumps(listing), price, now, listing_id)
+                    )
+                    if changed:
+                        self._conn.execute(
+                            'INSERT INTO price_history (listing_id, price, observed_at) VALUES (?, ?, ?)',
+                            (listing_id, price, now)
+                        )
+
+                if search:
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO search_listings (search_key, listing_id, last_seen) '
+                        'VALUES (?, ?, ?)',
+                        (search, listing_id, now)
+                    )
+        return statuses
+
+    def get_search_listings(
+        self,
+        search: str,
+        exclude_ids: Iterable[str] = (),
+        max_age: timedelta = STALE_AFTER,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Return stored listings seen for a search within max_age, newest first (at most limit)."""
+        cutoff = (datetime.now() - max_age).isoformat(timespec='seconds')
+        excluded = set(exclude_ids)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT l.id, l.data FROM search_listings s JOIN listings l ON l.id = s.listing_id '
+                'WHERE s.search_key = ? AND s.last_seen >= ? ORDER BY l.first_seen DESC LIMIT ?',
+                (search, cutoff, -1 if limit is None else max(0, limit) + len(excluded))
+            ).fetchall()
+        listings = [json.loads(data) for listing_id, data in rows if listing_id not in excluded]
+        return listings if limit is None else listings[:max(0, limit)]
+
+    def get_listing(self, listing_id: str) -> Optional[Dict[str, Any]]:
+        """Return a stored listing with its first/last-seen timestamps."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data, first_seen, last_seen FROM listings WHERE id = ?', (listing_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        listing = json.loads(row[0])
+        listing['first_seen'] = row[1]
+        listing['last_seen'] = row[2]
+        return listing
+
+    def get_price_history(self, listing_id: str) -> List[Dict[str, Any]]:
+        """Return the recorded price changes of a listing, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT price, observed_at FROM price_history WHERE listing_id = ? ORDER BY rowid',
+                (listing_id,)
+            ).fetchall()
+        return [{'price': price, 'observed_at': observed_at} for price, observed_at in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_store: Optional[ListingStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ListingStore:
+    """Return the process-wide listing store at DEFAULT_DB_PATH."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ListingStore()
+    return _store
+
+
+def set_store(store: ListingStore) -> None:
+    """Replace the process-wide listing store (e.g. an in-memory one)."""
+    global _store
+    with _store_lock:
+        _store = store
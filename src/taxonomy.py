@@ -0,0 +1,286 @@
+"""
+Make/model/generation taxonomy for Otomoto.
+
+Category pages (``/osobowe``, ``/osobowe/<make>``, ``/osobowe/<make>/<model>``)
+embed every search filter in their ``__NEXT_DATA__`` urqlState. The extractor
+decodes each urqlState entry once and walks the result a single time,
+iteratively, collecting all filters (makes, models, generations, fuel types
+and so on) in one pass. The values end up in a persistent TaxonomyIndex, so
+make/model/generation lookups are served from memory and survive restarts.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_INDEX_PATH = os.environ.get('OTOMOTO_TAXONOMY_PATH', os.path.join('data', 'taxonomy.json'))
+
+MAKE_FILTER = 'filter_enum_make'
+MODEL_FILTER = 'filter_enum_model'
+GENERATION_FILTER = 'filter_enum_generation'
+
+_NEXT_DATA_RE = re.compile(rb'<script[^>]*\bid="__NEXT_DATA__"[^>]*>(.*?)</script>', re.DOTALL)
+
+# Model slugs in AlternativeLinks that are really regions
+_ALT_LINK_REGIONS = ('mazowieckie', 'slaskie', 'wielkopolskie')
+
+FilterValues = Dict[str, List[Dict[str, str]]]
+
+
+def iter_dicts(obj: Any) -> Iterator[Dict[str, Any]]:
+    """Yield every dict nested in obj, depth-first in document order, without recursion."""
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            yield node
+            children = node.values()
+        elif isinstance(node, list):
+            children = node
+        else:
+            continue
+        stack.extend(child for child in reversed(children) if isinstance(child, (dict, list)))
+
+
+def extract_next_data(content: bytes) -> Optional[Dict[str, Any]]:
+    """Decode the __NEXT_DATA__ JSON of a page, or None if it has none."""
+    match = _NEXT_DATA_RE.search(content)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1))
+    except ValueError:
+        return None
+
+
+def urql_payloads(next_data: Dict[str, Any]) -> List[Any]:
+    """Decode the JSON ``data`` string of every urqlState entry of a page."""
+    urql_state = next_data.get('props', {}).get('pageProps', {}).get('urqlState', {})
+    payloads = []
+    for entry in urql_state.values():
+        if isinstance(entry, dict) and isinstance(entry.get('data'), str):
+            try:
+                payloads.append(json.loads(entry['data']))
+            except ValueError:
+                continue
+    return payloads
+
+
+def extract_filters(next_data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Collect every filter object in the urqlState of a page.
+
+    Args:
+        next_data: Decoded __NEXT_DATA__
+
+    Returns:
+        Mapping of filter id to the filter objects carrying it (an
+        AdvertSearchFilter ``id`` or an OpenForInputFilterState ``filterId``),
+        in document order
+    """
+    filters: Dict[str, List[Dict[str, Any]]] = {}
+    for node in iter_dicts(urql_payloads(next_data)):
+        for key in ('id', 'filterId'):
+            filter_id = node.get(key)
+            if isinstance(filter_id, str) and filter_id.startswith('filter_'):
+                filters.setdefault(filter_id, []).append(node)
+                break
+    return filters
+
+
+def filter_values(
+    filters: List[Dict[str, Any]],
+    make: Optional[str] = None,
+    model: Optional[str] = None
+) -> List[Dict[str, str]]:
+    """
+    Merge the values of filter objects that apply to make/model.
+
+    Args:
+        filters: Filter objects sharing one id, as returned by extract_filters
+        make: Make slug of the page, used to check filter conditions
+        model: Model slug of the page, used to check filter conditions
+
+    Returns:
+        List of {'id', 'name'} dictionaries sorted by name; names carry the
+        listing counter, e.g. 'Seria 3 (1234)'
+    """
+    all_values = {}
+    for filter_obj in filters:
+        if not _matches_conditions(filter_obj, make, model):
+            continue
+        for value in _extract_values(filter_obj):
+            # Keep most generic or most complete name
+            all_values[value['id']] = value['name']
+    return [{'id': k, 'name': v} for k, v in sorted(all_values.items(), key=lambda x: x[1])]
+
+
+def extract_page_taxonomy(content: bytes, make: Optional[str] = None, model: Optional[str] = None) -> FilterValues:
+    """
+    Extract the values of every filter on a category page.
+
+    Args:
+        content: Raw HTML of /osobowe, /osobowe/<make> or /osobowe/<make>/<model>
+        make: Make slug the page was fetched for
+        model: Model slug the page was fetched for
+
+    Returns:
+        Mapping of filter id to its values (see filter_values); filters
+        without applicable values are left out
+    """
+    next_data = extract_next_data(content)
+    if next_data is None:
+        return {}
+
+    taxonomy = {}
+    for filter_id, filters in extract_filters(next_data).items():
+        values = filter_values(filters, make, model)
+        if values:
+            taxonomy[filter_id] = values
+
+    # If not found in urqlState, try AlternativeLinks as fallback for models
+    if MODEL_FILTER not in taxonomy and make and not model:
+        models = _models_from_alternative_links(next_data, make)
+        if models:
+            taxonomy[MODEL_FILTER] = models
+    return taxonomy
+
+
+def taxonomy_scope(make: Optional[str] = None, model: Optional[str] = None) -> str:
+    """Index key of the category page for make/model ('' for all cars)."""
+    return '/'.join(part for part in (make, model) if part)
+
+
+class TaxonomyIndex:
+    """Filter values per category page, held in memory and persisted as JSON."""
+
+    def __init__(self, path: Optional[str] = DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._scopes: Dict[str, Dict[str, Any]] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._scopes = json.load(f).get('scopes', {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable taxonomy index {path}: {e}")
+
+    def get(self, scope: str) -> Optional[Tuple[float, FilterValues]]:
+        """Return (age in seconds, filter values) for a scope, or None if never indexed."""
+        with self._lock:
+            entry = self._scopes.get(scope)
+        if entry is None:
+            return None
+        return time.time() - entry['updated'], entry['filters']
+
+    def values(self, scope: str, filter_id: str) -> List[Dict[str, str]]:
+        """Indexed values of one filter on a scope's page, regardless of age."""
+        entry = self.get(scope)
+        return entry[1].get(filter_id, []) if entry else []
+
+    def update(self, scope: str, filters: FilterValues) -> None:
+        """Replace a scope's filter values and persist the index."""
+        with self._lock:
+            self._scopes[scope] = {'updated': time.time(), 'filters': filters}
+            self._save()
+
+    def scopes(self) -> List[str]:
+        with self._lock:
+            return list(self._scopes)
+
+    def _save(self) -> None:
+        """Write the index atomically; caller holds the lock."""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'scopes': self._scopes}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+_index: Optional[TaxonomyIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_taxonomy_index() -> TaxonomyIndex:
+    """Return the process-wide taxonomy index at DEFAULT_INDEX_PATH."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = TaxonomyIndex()
+    return _index
+
+
+def set_taxonomy_index(index: TaxonomyIndex) -> None:
+    """Replace the process-wide taxonomy index (e.g. an in-memory one, path=None)."""
+    global _index
+    with _index_lock:
+        _index = index
+
+
+def _matches_conditions(filter_obj: Dict[str, Any], make: Optional[str], model: Optional[str]) -> bool:
+    """Check if the filter object matches the given make and model conditions."""
+    conditions = filter_obj.get('conditions') or []
+    for cond in conditions:
+        f_id = cond.get('filterId')
+        val = cond.get('value')
+        if f_id == MAKE_FILTER and make and val != make:
+            return False
+        if f_id == MODEL_FILTER and model and val != model:
+            return False
+    return True
+
+
+def _extract_values(filter_obj: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Extract id/name pairs from a filter object, including counter if present."""
+    values = []
+    for val in filter_obj.get('values') or []:
+        if not isinstance(val, dict):
+            continue
+        typename = val.get('__typename')
+        if typename == 'AdvertSearchFilterValue':
+            members = [val]
+        elif typename == 'AdvertSearchFilterValuesGroup':
+            members = [gv for gv in val.get('values', []) if isinstance(gv, dict)]
+        else:
+            continue
+        for member in members:
+            name = member.get('name')
+            counter = member.get('counter')
+            if counter is not None:
+                name = f"{name} ({counter})"
+            values.append({'id': member.get('id'), 'name': name})
+    return values
+
+
+def _models_from_alternative_links(next_data: Dict[str, Any], make_slug: str) -> List[Dict[str, str]]:
+    """Fallback extraction from AlternativeLinksBlock (often models) if urqlState has none."""
+    alt_block = next(
+        (node for node in iter_dicts(next_data)
+         if node.get('__typename') == 'AlternativeLinksBlock'
+         and node.get('name') in ('model-generations', 'models')),
+        None
+    )
+    if not alt_block:
+        return []
+
+    models = []
+    # Pattern to extract model slug from URL: /osobowe/make/model-slug
+    pattern = re.compile(rf"/osobowe/{re.escape(make_slug)}/([^/?#\s]+)")
+    for link in alt_block.get('links', []):
+        match = pattern.search(link.get('url', ''))
+        if not match:
+            continue
+        model_slug = match.group(1)
+        # Filter out regions or other things
+        if any(region in model_slug for region in _ALT_LINK_REGIONS):
+            continue
+        name = link.get('title', model_slug)
+        clean_name = name.replace(make_slug.capitalize(), '').strip()
+        models.append({'id': model_slug, 'name': clean_name or model_slug})
+    return models
@@ -0,0 +1,266 @@
+"""
+Adaptive request throttling and retry policy.
+
+The AdaptiveController bounds the requests in flight to the site across the
+whole process (all analyses, lookups and detail fetches) with an AIMD
+window, like TCP congestion control: every successful response grows the
+window by 1/window (one slot per window's worth of successes), while a 429
+or 5xx response, a network error or a response much slower than the
+recent baseline shrinks it multiplicatively, at most once per round trip.
+A Retry-After header pauses all requests until it expires.
+
+Transient failures (429, 5xx, timeouts, connection errors) are retried by
+the fetch helpers in http_client and async_scraper, one request at a time,
+after Retry-After or a jittered exponential backoff, so a failed page is
+retried on its own while the other pages carry on.
+
+State and recent decisions are exposed through state() (/api/throttle) and
+the otomoto_throttle_* metrics.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from src.metrics import register_stats
+
+# Upper bound of the in-flight window (0: unbounded, the window is only tracked)
+DEFAULT_MAX_IN_FLIGHT = int(os.environ.get('OTOMOTO_MAX_IN_FLIGHT', '16'))
+# One analysis' worth of pages (OTOMOTO_CONCURRENCY's default)
+INITIAL_WINDOW = 4.0
+MIN_WINDOW = 1.0
+# Retries of one request after a transient failure
+DEFAULT_RETRIES = int(os.environ.get('OTOMOTO_FETCH_RETRIES', '3'))
+
+# Window multipliers on overload signals
+ERROR_DECREASE = 0.5
+LATENCY_DECREASE = 0.8
+# A response this many times slower than the baseline counts as congestion
+LATENCY_FACTOR = 3.0
+# Successful responses the baseline (minimum latency) is taken over
+BASELINE_SAMPLES = 50
+# Full-jitter exponential backoff: uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+# Longest Retry-After honoured
+MAX_RETRY_AFTER = 120.0
+# Decisions kept for state()
+MAX_DECISIONS = 50
+
+TRANSIENT_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class AdaptiveController:
+    """Thread-safe AIMD bound on in-flight requests; see the module docstring."""
+
+    def __init__(
+        self,
+        max_window: int = DEFAULT_MAX_IN_FLIGHT,
+        initial_window: float = INITIAL_WINDOW,
+        min_window: float = MIN_WINDOW
+    ):
+        self.min_window = min_window
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._async_waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self.reset(max_window, initial_window)
+
+    def reset(self, max_window: Optional[int] = None, initial_window: float = INITIAL_WINDOW) -> None:
+        """Forget everything learned (call while no request is in flight); max_window None keeps the bound."""
+        with self._cond:
+            if max_window is not None:
+                self.max_window = max_window
+            self.window = self._clamp(initial_window)
+            self._paused_until = 0.0
+            self._last_decrease = 0.0
+            self._latencies: Deque[float] = deque(maxlen=BASELINE_SAMPLES)
+            self._smoothed_latency: Optional[float] = None
+            self._decisions: Deque[Dict[str, Any]] = deque(maxlen=MAX_DECISIONS)
+            self._stats = dict.fromkeys(('granted', 'waited', 'increases', 'decreases', 'pauses'), 0)
+
+    def acquire(self) -> float:
+        """Block until a request may start; return seconds waited. Pair with release()."""
+        start = time.monotonic()
+        with self._cond:
+            waited = False
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif not self._has_slot():
+                    self._cond.wait()
+                else:
+                    break
+                waited = True
+            self._grant(waited)
+        return time.monotonic() - start
+
+    async def acquire_async(self) -> float:
+        """acquire() for coroutines: waits without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        waited = False
+        while True:
+            future = None
+            with self._cond:
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0 and self._has_slot():
+                    self._grant(waited)
+                    return time.monotonic() - start
+                if pause <= 0:
+                    future = loop.create_future()
+                    self._async_waiters.append((loop, future))
+            waited = True
+            if future is None:
+                await asyncio.sleep(pause)
+                continue
+            try:
+                await future
+            except asyncio.CancelledError:
+                # A wake-up meant for this waiter goes to the next one
+                if future.done() and not future.cancelled():
+                    self._wake(1)
+                raise
+
+    def release(self, latency: Optional[float] = None, status: Optional[int] = None,
+                retry_after: Optional[float] = None) -> None:
+        """
+        Free a slot and adapt the window to the outcome of its request.
+
+        Args:
+            latency: Seconds the request took (None if it did not complete)
+            status: HTTP status, or None for a network error or timeout
+            retry_after: Seconds from the response's Retry-After header
+        """
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if retry_after:
+                pause = min(retry_after, MAX_RETRY_AFTER)
+                if now + pause > self._paused_until:
+                    self._paused_until = now + pause
+                    self._stats['pauses'] += 1
+                    self._record('pause', f"Retry-After {pause:g}s")
+            if status is None or status in TRANSIENT_STATUSES:
+                self._decrease(ERROR_DECREASE, f"HTTP {status}" if status else 'network error', now)
+            elif latency is not None and status < 400:
+                self._observe_latency(latency, now)
+            self._cond.notify_all()
+            free = self._free_slots()
+        self._wake(free)
+
+    def state(self) -> Dict[str, Any]:
+        """Current window, latency figures, counters and recent decisions."""
+        with self._cond:
+            return {
+                'window': round(self.window, 2),
+                'max_window': self.max_window or None,
+                'in_flight': self.in_flight,
+                'paused_for': round(max(0.0, self._paused_until - time.monotonic()), 3),
+                'baseline_latency': min(self._latencies) if self._latencies else None,
+                'smoothed_latency': self._smoothed_latency,
+                'stats': dict(self._stats),
+                'decisions': list(self._decisions),
+            }
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self._stats, window=self.window, in_flight=self.in_flight)
+
+    def _has_slot(self) -> bool:
+        return not self.max_window or self.in_flight < int(self.window)
+
+    def _free_slots(self) -> int:
+        if not self.max_window:
+            return 0
+        return max(0, int(self.window) - self.in_flight)
+
+    def _grant(self, waited: bool) -> None:
+        self.in_flight += 1
+        self._stats['granted'] += 1
+        if waited:
+            self._stats['waited'] += 1
+
+    def _wake(self, count: int) -> None:
+        """Wake up to count async waiters; they re-check the window themselves."""
+        while count > 0:
+            with self._cond:
+                if not self._async_waiters:
+                    return
+                loop, future = self._async_waiters.popleft()
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_resolve, future)
+                count -= 1
+
+    def _observe_latency(self, latency: float, now: float) -> None:
+        """Additive increase, or a decrease if the response was congested; caller holds the lock."""
+        self._latencies.append(latency)
+        self._smoothed_latency = latency if self._smoothed_latency is None \
+            else 0.8 * self._smoothed_latency + 0.2 * latency
+        baseline = min(self._latencies)
+        if len(self._latencies) >= 5 and latency > LATENCY_FACTOR * baseline:
+            self._decrease(LATENCY_DECREASE, f"latency {latency:.3f}s > {LATENCY_FACTOR:g}x {baseline:.3f}s", now)
+            return
+        before = self.window
+        self.window = self._clamp(self.window + 1.0 / self.window)
+        if int(self.window) > int(before):
+            self._stats['increases'] += 1
+            self._record('increase', 'successful window', before)
+
+    def _decrease(self, factor: float, reason: str, now: float) -> None:
+        # Responses to requests sent before the last cut reflect the old window
+        if now - self._last_decrease < (self._smoothed_latency or 0.0):
+            return
+        before = self.window
+        self.window = self._clamp(self.window * factor)
+        self._last_decrease = now
+        self._stats['decreases'] += 1
+        self._record('decrease', reason, before)
+
+    def _record(self, action: str, reason: str, before: Optional[float] = None) -> None:
+        self._decisions.append({
+            'time': time.time(),
+            'action': action,
+            'reason': reason,
+            'window_before': round(before, 2) if before is not None else None,
+            'window': round(self.window, 2),
+        })
+
+    def _clamp(self, window: float) -> float:
+        upper = self.max_window if self.max_window else float('inf')
+        return max(self.min_window, min(upper, window))
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def retry_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Seconds before retry number attempt (from 1): Retry-After if given, else full-jitter backoff."""
+    if retry_after:
+        return min(retry_after, MAX_RETRY_AFTER)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds of a Retry-After header given as delta-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+controller = AdaptiveController()
+register_stats('otomoto_throttle', controller.stats, ('window', 'in_flight'), 'Adaptive request controller')
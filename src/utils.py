@@ -22,6 +22,13 @@ GEARBOX_MAPPING: Dict[str, str] = {
     'automatic': 'automatyczna'
 }
 
+# Drive type mapping from English to Polish (as shown on listing cards)
+DRIVE_TYPE_MAPPING: Dict[str, str] = {
+    'front-wheel-drive': 'na przednie koła',
+    'rear-wheel-drive': 'na tylne koła',
+    '4x4': '4x4'
+}
+
 
 def map_fuel_type(fuel_type: str) -> str:
     """
@@ -47,3 +54,16 @@ def map_gearbox_type(gearbox: str) -> str:
         Polish gearbox type (e.g., 'manualna')
     """
     return GEARBOX_MAPPING.get(gearbox.lower(), gearbox.lower())
+
+
+def map_drive_type(drive_type: str) -> str:
+    """
+    Map English drive type to Polish equivalent.
+    
+    Args:
+        drive_type: English drive type (e.g., 'front-wheel-drive')
+        
+    Returns:
+        Polish drive type (e.g., 'na przednie koła')
+    """
+    return DRIVE_TYPE_MAPPING.get(drive_type.lower(), drive_type.lower())
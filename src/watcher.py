@@ -0,0 +1,606 @@
+"""
+Saved searches, polled for fresh listings.
+
+Re-running an analysis just to spot new listings costs a crawl of up to
+max_pages. A saved search is polled instead: its results are requested
+newest-first (the sort incremental analyses use) and upserted into the
+listing store, page by page, until a page ends on a listing the saved search
+has already seen. What a saved search has seen is tracked in its own table:
+an analysis of the same search upserts the same listings, and must not hide
+them from the next poll. Everything below that listing is
+older and known, so a poll costs one page unless more listings arrived since
+the previous poll than fit on it. Promoted cards at the top of a page are
+old listings, which is why the end of the page decides rather than its
+first known listing. Listings new to the search and those whose price
+changed are appended to a feed, served by /api/watch/feed.
+
+The first poll of a search only records page 1 as the baseline later polls
+are compared with. Price changes are caught on the pages a poll fetches;
+listings further down are re-priced by the next analysis of the search.
+The first poll of each day also folds the search's stored listings into
+that day's price rollups, so trends of a watched search cover the whole
+market rather than the newest cards alone.
+
+Saved searches and the feed live in SQLite next to the listing store. Due
+searches are claimed with a conditional update, so the schedulers of
+several worker processes split the polls rather than repeat them, and
+every request goes through the shared rate limit and throttle.
+
+Usage:
+    python -m src.watcher           # run the scheduler in the foreground
+    python -m src.watcher --once    # poll the searches that are due, then exit
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from src.listing_table import ListingTable
+from src.metrics import PAGES, WATCH_FEED_ITEMS, WATCH_PAGES, WATCH_POLLS, register_stats, span
+from src.rollups import RollupStore, get_rollups
+from src.scraper import NEWEST_FIRST_ORDER, _build_params, _build_url, _get_headers, _scrape_page
+from src.store import (
+    DEFAULT_DB_PATH, STATUS_CHANGED, STATUS_NEW, STATUS_UNCHANGED, ListingStore, get_store, search_key
+)
+
+# Seconds between two polls of a saved search, unless saved with its own
+DEFAULT_INTERVAL = float(os.environ.get('OTOMOTO_WATCH_INTERVAL', '900'))
+MIN_INTERVAL = 60
+# Result pages a poll fetches at most before giving up on reaching known listings
+MAX_POLL_PAGES = int(os.environ.get('OTOMOTO_WATCH_MAX_PAGES', '5'))
+# Searches one scheduler polls at the same time
+DEFAULT_WORKERS = int(os.environ.get('OTOMOTO_WATCH_WORKERS', '2'))
+# Seconds an idle scheduler waits before looking for due searches again
+TICK = 5.0
+# Feed entries, and listings a saved search has not seen again, older than this are dropped
+FEED_RETENTION = 30 * 24 * 3600
+
+# normalize_params keys that define a saved search
+WATCH_PARAMS = (
+    'make', 'model', 'generation_slug', 'year_from', 'year_to', 'fuel_type', 'gearbox', 'drive_type',
+    'first_owner', 'accident_free'
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watched_searches (
+    id TEXT PRIMARY KEY,
+    params TEXT NOT NULL,
+    interval REAL NOT NULL,
+    created_at REAL NOT NULL,
+    next_poll REAL NOT NULL,
+    last_polled REAL,
+    last_success REAL,
+    last_error TEXT,
+    polls INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER NOT NULL DEFAULT 0,
+    found INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_watched_searches_next_poll ON watched_searches (next_poll);
+CREATE TABLE IF NOT EXISTS watch_feed (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    search_id TEXT NOT NULL,
+    listing_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    price REAL NOT NULL,
+    previous_price REAL,
+    data TEXT NOT NULL,
+    observed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_watch_feed_search ON watch_feed (search_id, seq);
+CREATE INDEX IF NOT EXISTS idx_watch_feed_observed ON watch_feed (observed_at);
+CREATE TABLE IF NOT EXISTS watch_seen (
+    search_id TEXT NOT NULL,
+    listing_id TEXT NOT NULL,
+    price REAL NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (search_id, listing_id)
+);
+CREATE INDEX IF NOT EXISTS idx_watch_seen_seen_at ON watch_seen (seen_at);
+"""
+
+_SEARCH_COLUMNS = (
+    'id', 'params', 'interval', 'created_at', 'next_poll', 'last_polled', 'last_success', 'last_error',
+    'polls', 'pages', 'found'
+)
+_FEED_COLUMNS = ('seq', 'search_id', 'listing_id', 'status', 'price', 'previous_price', 'data', 'observed_at')
+
+
+class PollResult(NamedTuple):
+    """One poll of a search: pages fetched, listings on them and the feed entries found (none for a baseline)."""
+    pages: int
+    listings: int
+    entries: List[Dict[str, Any]]
+    baseline: bool = False
+
+
+def watch_id(params: Dict[str, Any]) -> str:
+    """Id of a saved search; equal normalized parameters give the same id."""
+    relevant = {name: params.get(name) for name in WATCH_PARAMS}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def poll_search(
+    params: Dict[str, Any],
+    store: ListingStore,
+    watches: 'WatchStore',
+    baseline: bool = False,
+    max_pages: int = MAX_POLL_PAGES,
+    parser: Optional[str] = None,
+    rollups: Optional[RollupStore] = None,
+    snapshot: bool = False
+) -> PollResult:
+    """
+    Fetch a search newest-first until it reaches listings it has seen before.
+
+    Args:
+        params: Saved search parameters (see WATCH_PARAMS)
+        store: Listing store the pages are upserted into
+        watches: Saved-search store tracking what the search has seen
+        baseline: Fetch page 1 only and report nothing (first poll)
+        max_pages: Most result pages fetched
+        parser: Listing parser engine (default: DEFAULT_PARSER)
+        rollups: Optional rollup store every fetched page is folded into
+        snapshot: Also fold the search's other stored listings into today's
+            rollups (once a day)
+
+    Returns:
+        PollResult whose entries are the listings new to the search or
+        re-priced, newest first
+
+    Raises:
+        requests.RequestException: If a page cannot be fetched
+    """
+    base_url = _build_url(params['make'], params['model'], params['year_from'], params.get('generation_slug'))
+    query = _build_params(
+        params['year_to'], params.get('fuel_type'), params.get('gearbox'), params.get('drive_type'),
+        params.get('first_owner', False), params.get('accident_free', False)
+    )
+    query['search[order]'] = NEWEST_FIRST_ORDER
+    key = search_key(base_url, query)
+    search_id = watch_id(params)
+    headers = _get_headers()
+
+    seen = set()
+    entries = []
+    pages = count = 0
+    for page in range(1, (1 if baseline else max(1, max_pages)) + 1):
+        # The 'watch' page cache TTL is shorter than MIN_INTERVAL, so polls see fresh pages
+        listings = _scrape_page(base_url, dict(query, page=page), headers, params['year_from'], parser,
+                                endpoint='watch')
+        pages += 1
+        WATCH_PAGES.inc()
+        if not listings:
+            PAGES.inc(outcome='empty')
+            break
+        PAGES.inc(outcome='ok')
+        # Promoted cards are repeated on every page
+        fresh = []
+        for i, listing_id in enumerate(listings.ids):
+            if listing_id not in seen:
+                seen.add(listing_id)
+                fresh.append(i)
+        if len(fresh) < len(listings):
+            listings = listings.take(fresh)
+            if not listings:
+                break
+        count += len(listings)
+
+        if rollups is not None:
+            with span('rollup'):
+                rollups.add(listings, params['make'], params['model'], params.get('generation_slug'))
+        with span('store'):
+            store.upsert_listings(listings, key)
+            seen_before = watches.mark_seen(search_id, listings)
+        statuses = {listing_id: status for listing_id, (status, _) in seen_before.items()}
+        if not baseline:
+            entries.extend(_entry(listing, *seen_before[listing['id']])
+                           for listing in listings if statuses[listing['id']] in (STATUS_NEW, STATUS_CHANGED))
+        # Newest first: past the last listing already seen, everything is known
+        if statuses[listings.ids[-1]] != STATUS_NEW:
+            break
+
+    if rollups is not None and snapshot:
+        with span('store'):
+            known = store.get_search_listings(key, exclude_ids=seen)
+        if known:
+            with span('rollup'):
+                rollups.add(ListingTable.from_records(known), params['make'], params['model'],
+                            params.get('generation_slug'), day=time.strftime('%Y-%m-%d'))
+    return PollResult(pages, count, entries, baseline)
+
+
+def _entry(listing: Dict[str, Any], status: str, previous: Optional[float]) -> Dict[str, Any]:
+    """Feed entry of a new or re-priced listing."""
+    return {'listing_id': listing['id'], 'status': status, 'price': listing.get('price') or 0.0,
+            'previous_price': previous, 'listing': listing}
+
+
+class WatchStore:
+    """Thread- and process-safe SQLite store of saved searches, their schedule and the feed."""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Schedulers of other workers write to the same file; wait for their locks
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    def add(self, params: Dict[str, Any], interval: float = DEFAULT_INTERVAL) -> Dict[str, Any]:
+        """
+        Save a search, or change the poll interval of the saved one.
+
+        Args:
+            params: Normalized analyze parameters (only WATCH_PARAMS are kept)
+            interval: Seconds between polls
+
+        Returns:
+            The saved search; a new one is due for its baseline poll at once
+
+        Raises:
+            ValueError: If the interval is shorter than MIN_INTERVAL
+        """
+        if interval < MIN_INTERVAL:
+            raise ValueError(f"Poll interval must be at least {MIN_INTERVAL} seconds")
+        search_id = watch_id(params)
+        relevant = {name: params.get(name) for name in WATCH_PARAMS}
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO watched_searches (id, params, interval, created_at, next_poll) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET interval = excluded.interval',
+                (search_id, json.dumps(relevant, sort_keys=True), interval, now, now)
+            )
+        return self.get(search_id)
+
+    def get(self, search_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_SEARCH_COLUMNS)} FROM watched_searches WHERE id = ?", (search_id,)
+            ).fetchone()
+        return _search_dict(row) if row is not None else None
+
+    def searches(self) -> List[Dict[str, Any]]:
+        """Saved searches, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_SEARCH_COLUMNS)} FROM watched_searches ORDER BY created_at"
+            ).fetchall()
+        return [_search_dict(row) for row in rows]
+
+    def remove(self, search_id: str) -> bool:
+        """Delete a saved search, its feed entries and the listings it has seen; False if there was none."""
+        with self._lock, self._conn:
+            deleted = self._conn.execute('DELETE FROM watched_searches WHERE id = ?', (search_id,)).rowcount
+            self._conn.execute('DELETE FROM watch_feed WHERE search_id = ?', (search_id,))
+            self._conn.execute('DELETE FROM watch_seen WHERE search_id = ?', (search_id,))
+        return bool(deleted)
+
+    def mark_seen(self, search_id: str, listings) -> Dict[str, Tuple[str, Optional[float]]]:
+        """
+        Record listings as seen by a saved search.
+
+        Args:
+            search_id: Polling search
+            listings: Listings of a fetched page
+
+        Returns:
+            Mapping of listing id to (status, previous price): new if the
+            search had not seen the listing, changed if it last saw another
+            price (then given), unchanged otherwise
+        """
+        now = time.time()
+        seen = {}
+        with self._lock, self._conn:
+            for listing in listings:
+                listing_id = listing['id']
+                price = listing.get('price') or 0.0
+                row = self._conn.execute(
+                    'SELECT price FROM watch_seen WHERE search_id = ? AND listing_id = ?', (search_id, listing_id)
+                ).fetchone()
+                if row is None:
+                    seen[listing_id] = (STATUS_NEW, None)
+                elif row[0] != price:
+                    seen[listing_id] = (STATUS_CHANGED, row[0])
+                else:
+                    seen[listing_id] = (STATUS_UNCHANGED, None)
+                self._conn.execute(
+                    'INSERT INTO watch_seen (search_id, listing_id, price, seen_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (search_id, listing_id) DO UPDATE SET price = excluded.price, seen_at = excluded.seen_at',
+                    (search_id, listing_id, price, now)
+                )
+        return seen
+
+    def claim_due(self, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Take the most overdue search for polling.
+
+        Its next poll is moved one interval ahead (give or take 10%, so
+        searches saved together drift apart) by an update that only succeeds
+        if no other scheduler moved it first.
+
+        Returns:
+            The claimed search, or None if nothing is due
+        """
+        now = time.time() if now is None else now
+        while True:
+            with self._lock, self._conn:
+                row = self._conn.execute(
+                    f"SELECT {', '.join(_SEARCH_COLUMNS)} FROM watched_searches WHERE next_poll <= ? "
+                    'ORDER BY next_poll LIMIT 1', (now,)
+                ).fetchone()
+                if row is None:
+                    return None
+                search = _search_dict(row)
+                next_poll = now + search['interval'] * random.uniform(0.9, 1.1)
+                claimed = self._conn.execute(
+                    'UPDATE watched_searches SET next_poll = ? WHERE id = ? AND next_poll = ?',
+                    (next_poll, search['id'], search['next_poll'])
+                ).rowcount
+            if claimed:
+                search['next_poll'] = next_poll
+                return search
+
+    def record_poll(
+        self,
+        search_id: str,
+        result: Optional[PollResult] = None,
+        error: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Record the outcome of a poll and append its entries to the feed.
+
+        Args:
+            search_id: Polled search
+            result: Outcome of a successful poll
+            error: Error message of a failed one
+
+        Returns:
+            The entries as added to the feed, with their seq; none if the
+            search was removed meanwhile
+        """
+        now = time.time()
+        added = []
+        with self._lock, self._conn:
+            if result is None:
+                self._conn.execute(
+                    'UPDATE watched_searches SET last_polled = ?, last_error = ?, polls = polls + 1 WHERE id = ?',
+                    (now, error, search_id)
+                )
+                return added
+            updated = self._conn.execute(
+                'UPDATE watched_searches SET last_polled = ?, last_success = ?, last_error = NULL, '
+                'polls = polls + 1, pages = pages + ?, found = found + ? WHERE id = ?',
+                (now, now, result.pages, len(result.entries), search_id)
+            ).rowcount
+            if not updated:
+                return added
+            for entry in result.entries:
+                seq = self._conn.execute(
+                    'INSERT INTO watch_feed (search_id, listing_id, status, price, previous_price, data, observed_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (search_id, entry['listing_id'], entry['status'], entry['price'], entry['previous_price'],
+                     json.dumps(entry['listing']), now)
+                ).lastrowid
+                added.append(dict(entry, seq=seq, search_id=search_id, observed_at=now))
+            self._conn.execute('DELETE FROM watch_feed WHERE observed_at < ?', (now - FEED_RETENTION,))
+            self._conn.execute('DELETE FROM watch_seen WHERE seen_at < ?', (now - FEED_RETENTION,))
+        return added
+
+    def feed(self, since: int = 0, search_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Feed entries after sequence number since, oldest first, optionally of one search."""
+        query = f"SELECT {', '.join(_FEED_COLUMNS)} FROM watch_feed WHERE seq > ?"
+        args: List[Any] = [since]
+        if search_id is not None:
+            query += ' AND search_id = ?'
+            args.append(search_id)
+        query += ' ORDER BY seq LIMIT ?'
+        args.append(max(1, limit))
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        entries = []
+        for row in rows:
+            entry = dict(zip(_FEED_COLUMNS, row))
+            entry['listing'] = json.loads(entry.pop('data'))
+            entries.append(entry)
+        return entries
+
+    def stats(self) -> Dict[str, int]:
+        """Saved searches, how many are due and the feed length (node-wide)."""
+        now = time.time()
+        with self._lock:
+            searches, due = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(next_poll <= ?), 0) FROM watched_searches', (now,)
+            ).fetchone()
+            entries = self._conn.execute('SELECT COUNT(*) FROM watch_feed').fetchone()[0]
+        return {'searches': searches, 'due': due, 'feed_entries': entries}
+
+
+def _search_dict(row) -> Dict[str, Any]:
+    search = dict(zip(_SEARCH_COLUMNS, row))
+    search['params'] = json.loads(search['params'])
+    search['pages_per_poll'] = search['pages'] / search['polls'] if search['polls'] else None
+    return search
+
+
+class Watcher:
+    """Scheduler polling due saved searches, a few at a time."""
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_pages: int = MAX_POLL_PAGES):
+        self.workers = max(1, workers)
+        self.max_pages = max_pages
+        self._slots = threading.Semaphore(self.workers)
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        """Start polling in the background (does nothing if already started)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='watch-poll')
+            self._thread = threading.Thread(target=self._run, name='watch-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the scheduler after the polls in progress."""
+        with self._lock:
+            if self._thread is None:
+                return
+            # The scheduler may still hand a claimed search to the pool, so
+            # the pool is only shut down once the scheduler has exited
+            self._stopped.set()
+            self._thread.join()
+            self._pool.shutdown(wait=True)
+            self._thread = self._pool = None
+
+    def poll(self, search: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Poll one saved search now and record the outcome.
+
+        Returns:
+            {'pages': ..., 'listings': ..., 'baseline': ..., 'entries': [...]}
+            with the entries as added to the feed
+
+        Raises:
+            Exception: Whatever failed the poll, after it was recorded
+        """
+        watches = get_watch_store()
+        baseline = search['last_success'] is None
+        today = time.strftime('%Y-%m-%d')
+        snapshot = baseline or time.strftime('%Y-%m-%d', time.localtime(search['last_success'])) != today
+        try:
+            result = poll_search(search['params'], get_store(), watches, baseline, self.max_pages,
+                                 rollups=get_rollups(), snapshot=snapshot)
+        except Exception as e:
+            WATCH_POLLS.inc(outcome='error')
+            print(f"Polling saved search {search['id']} failed: {e}")
+            watches.record_poll(search['id'], error=str(e))
+            raise
+        WATCH_POLLS.inc(outcome='baseline' if baseline else 'ok')
+        for entry in result.entries:
+            WATCH_FEED_ITEMS.inc(status=entry['status'])
+        entries = watches.record_poll(search['id'], result)
+        print(f"Saved search {search['id']}: " + (
+            f"baseline of {result.listings} listings" if baseline else f"{len(entries)} new or re-priced listings"
+        ) + f" ({result.pages} page{'s' if result.pages != 1 else ''})")
+        return {'pages': result.pages, 'listings': result.listings, 'baseline': baseline, 'entries': entries}
+
+    def run_due(self) -> int:
+        """Poll every search due now, workers at a time; return how many were polled."""
+        watches = get_watch_store()
+        due = []
+        search = watches.claim_due()
+        while search is not None:
+            due.append(search)
+            search = watches.claim_due()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for future in [pool.submit(self.poll, search) for search in due]:
+                try:
+                    future.result()
+                except Exception:
+                    pass  # logged and recorded by poll()
+        return len(due)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            if not self._slots.acquire(timeout=TICK):
+                continue
+            try:
+                search = get_watch_store().claim_due()
+            except sqlite3.Error as e:
+                print(f"Could not look up due saved searches: {e}")
+                search = None
+            if search is None:
+                self._slots.release()
+                self._stopped.wait(TICK)
+                continue
+            self._pool.submit(self._poll_claimed, search)
+
+    def _poll_claimed(self, search: Dict[str, Any]) -> None:
+        try:
+            self.poll(search)
+        except Exception:
+            pass  # logged and recorded by poll()
+        finally:
+            self._slots.release()
+
+
+_watch_store: Optional[WatchStore] = None
+_watcher: Optional[Watcher] = None
+_lock = threading.Lock()
+
+
+def get_watch_store() -> WatchStore:
+    """Return the process-wide saved-search store at DEFAULT_DB_PATH."""
+    global _watch_store
+    if _watch_store is None:
+        with _lock:
+            if _watch_store is None:
+                _watch_store = WatchStore()
+    return _watch_store
+
+
+def set_watch_store(store: WatchStore) -> None:
+    """Replace the process-wide saved-search store (e.g. an in-memory one)."""
+    global _watch_store
+    with _lock:
+        _watch_store = store
+
+
+def get_watcher() -> Watcher:
+    """Return the process-wide scheduler (started by the caller)."""
+    global _watcher
+    if _watcher is None:
+        with _lock:
+            if _watcher is None:
+                _watcher = Watcher()
+    return _watcher
+
+
+def _metric_stats() -> Dict[str, int]:
+    """stats() of the saved-search store for /metrics, once it is open."""
+    return _watch_store.stats() if _watch_store is not None else {}
+
+
+register_stats('otomoto_watch', _metric_stats, ('searches', 'due', 'feed_entries'), 'Saved-search watcher (node-wide)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll saved Otomoto searches for new and re-priced listings")
+    parser.add_argument('--once', action='store_true', help='Poll the searches that are due, then exit')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Searches polled at the same time')
+    parser.add_argument('--max-pages', type=int, default=MAX_POLL_PAGES, help='Most result pages per poll')
+    args = parser.parse_args()
+
+    watcher = Watcher(args.workers, args.max_pages)
+    if args.once:
+        print(f"Polled {watcher.run_due()} saved searches")
+        return
+    print(f"Watching {get_watch_store().stats()['searches']} saved searches (Ctrl+C to stop)")
+    watcher.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+if __name__ == '__main__':
+    main()
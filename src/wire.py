@@ -0,0 +1,279 @@
+"""
+Wire formats for streamed analysis results.
+
+/api/analyze streams one message per event. Clients pick the layout of the
+listing batches through content negotiation:
+
+    - rows (default): NDJSON, each batch a list of listing objects
+    - columnar: NDJSON, each batch one array per field, with fuel, gearbox,
+      drive, region and scrape_date dictionary-encoded (codes + categories)
+      and the price/mileage display texts left out
+      (``Accept: application/x-ndjson; layout=columnar`` or ``?layout=columnar``)
+    - arrow: an Arrow IPC stream with one record batch per page and no
+      progress/analytics messages (``Accept: application/vnd.apache.arrow.stream``)
+
+Any of them can be compressed on the fly with gzip or brotli
+(``Accept-Encoding``), flushed after every message so the browser can
+decode pages as they arrive. JSON is encoded with orjson when installed.
+"""
+
+import io
+import json
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.listing_table import BOOL_COLUMNS, CATEGORICAL_COLUMNS, NUMERIC_COLUMNS, TEXT_COLUMNS, ListingTable
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is the fallback
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow is optional; Arrow IPC is then not offered
+    pa = None
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+LAYOUTS = ('rows', 'columnar', 'arrow')
+ENCODINGS = ('br', 'gzip', 'identity')
+
+# Fixed Arrow schema, so record batches of different pages share it; only
+# their dictionaries differ (the IPC stream carries a replacement per batch)
+if pa is not None:
+    _ARROW_TYPES = {
+        'id': pa.string(),
+        'title': pa.string(),
+        'link': pa.string(),
+        'price_text': pa.string(),
+        'mileage_text': pa.string(),
+        'price': pa.float64(),
+        'mileage': pa.int64(),
+        'year': pa.int32(),
+        'accident_free': pa.bool_(),
+        'first_owner': pa.bool_(),
+    }
+    for _name in CATEGORICAL_COLUMNS:
+        _ARROW_TYPES[_name] = pa.dictionary(pa.int32(), pa.string())
+    ARROW_SCHEMA = pa.schema(list(_ARROW_TYPES.items()))
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize to compact JSON bytes (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def columnar(table: ListingTable, display_texts: bool = False) -> Dict[str, Any]:
+    """
+    Columnar JSON form of a listing table.
+
+    Args:
+        table: Listings to encode
+        display_texts: Also carry the price/mileage display texts, left out
+            of the wire layout; from_columnar() then gives the table back as is
+
+    Returns:
+        {'length': n, 'columns': {...}} where plain columns are value lists
+        and categorical ones are {'codes': [...], 'categories': [...]}
+    """
+    names = TEXT_COLUMNS if display_texts else ('id', 'title', 'link')
+    columns = {}
+    for name in names + tuple(NUMERIC_COLUMNS) + BOOL_COLUMNS:
+        columns[name] = table[name].tolist()
+    for name in CATEGORICAL_COLUMNS:
+        categorical = table[name]
+        columns[name] = {
+            'codes': categorical.codes.tolist(),
+            'categories': np.asarray(categorical.categories, dtype=object).tolist(),
+        }
+    return {'length': len(table), 'columns': columns}
+
+
+def from_columnar(data: Dict[str, Any]) -> ListingTable:
+    """Listing table back from its columnar() form (display texts left out of it come back empty)."""
+    raw = data['columns']
+    columns = {}
+    for name in TEXT_COLUMNS:
+        values = np.empty(data['length'], dtype=object)
+        values[:] = raw[name] if name in raw else [''] * data['length']
+        columns[name] = values
+    for name, dtype in NUMERIC_COLUMNS.items():
+        columns[name] = np.asarray(raw[name], dtype=dtype)
+    for name in BOOL_COLUMNS:
+        columns[name] = np.asarray(raw[name], dtype=bool)
+    for name in CATEGORICAL_COLUMNS:
+        columns[name] = pd.Categorical.from_codes(
+            np.asarray(raw[name]['codes'], dtype=np.int64), categories=raw[name]['categories']
+        )
+    return ListingTable(columns)
+
+
+def arrow_batch(table: ListingTable) -> 'pa.RecordBatch':
+    """Arrow record batch of a listing table, in ARROW_SCHEMA."""
+    arrays = []
+    for field in ARROW_SCHEMA:
+        column = table[field.name]
+        if field.name in CATEGORICAL_COLUMNS:
+            arrays.append(pa.DictionaryArray.from_arrays(
+                pa.array(column.codes.astype(np.int32), mask=column.codes < 0),
+                pa.array(np.asarray(column.categories, dtype=object), type=pa.string())
+            ))
+        else:
+            arrays.append(pa.array(column, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=ARROW_SCHEMA)
+
+
+class ArrowStreamEncoder:
+    """Incremental Arrow IPC stream writer: feed tables, collect bytes."""
+
+    def __init__(self):
+        self._sink = io.BytesIO()
+        self._writer = pa.ipc.new_stream(self._sink, ARROW_SCHEMA)
+
+    def write(self, table: ListingTable) -> bytes:
+        self._writer.write_batch(arrow_batch(table))
+        return self._drain()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._drain()
+
+    def _drain(self) -> bytes:
+        """Hand out what the writer produced so far and empty the buffer."""
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+
+class StreamCompressor:
+    """Streaming compressor that flushes after every chunk (identity passes through)."""
+
+    def __init__(self, encoding: str = 'identity'):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported encoding {encoding!r}")
+        if encoding == 'br' and brotli is None:
+            raise ValueError("brotli is not installed")
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        elif encoding == 'br':
+            self._compressor = brotli.Compressor(quality=5)
+        else:
+            self._compressor = None
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a chunk and flush it, so the client can decode it right away."""
+        if self._compressor is None:
+            return data
+        if self.encoding == 'gzip':
+            return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        if self._compressor is None:
+            return b''
+        if self.encoding == 'gzip':
+            return self._compressor.flush(zlib.Z_FINISH)
+        return self._compressor.finish()
+
+
+class MessageEncoder:
+    """Encodes the /api/analyze event stream in a negotiated layout."""
+
+    def __init__(self, layout: str = 'rows'):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unsupported layout {layout!r}")
+        if layout == 'arrow' and pa is None:
+            raise ValueError("pyarrow is not installed")
+        self.layout = layout
+        self.mimetype = ARROW_MIMETYPE if layout == 'arrow' else NDJSON_MIMETYPE
+        self._arrow = ArrowStreamEncoder() if layout == 'arrow' else None
+
+    def message(self, message: Dict[str, Any]) -> bytes:
+        """One event; 'batch' listings are a ListingTable and get laid out here."""
+        if self._arrow is not None:
+            # The Arrow stream only carries listings
+            return self._arrow.write(message['listings']) if message['type'] == 'batch' else b''
+        if message['type'] == 'batch':
+            table = message['listings']
+            listings = columnar(table) if self.layout == 'columnar' else table.to_records()
+            message = dict(message, listings=listings, layout=self.layout)
+        return dumps(message) + b'\n'
+
+    def close(self) -> bytes:
+        return self._arrow.close() if self._arrow is not None else b''
+
+
+def negotiate(
+    accept: Optional[str],
+    accept_encoding: Optional[str],
+    layout: Optional[str] = None,
+    encoding: Optional[str] = None
+) -> Tuple[str, str]:
+    """
+    Pick the response layout and content encoding.
+
+    Args:
+        accept: Accept header
+        accept_encoding: Accept-Encoding header
+        layout: Explicit layout (e.g. a query parameter), wins over Accept
+        encoding: Explicit encoding, wins over Accept-Encoding
+
+    Returns:
+        Tuple of (layout, encoding), see LAYOUTS and ENCODINGS
+    """
+    if layout not in LAYOUTS or (layout == 'arrow' and pa is None):
+        layout = 'rows'
+        for media_type, params in _parse_header(accept):
+            if media_type == ARROW_MIMETYPE and pa is not None:
+                layout = 'arrow'
+                break
+            if media_type == NDJSON_MIMETYPE and params.get('layout') in LAYOUTS:
+                layout = params['layout']
+                break
+
+    if encoding not in ENCODINGS or (encoding == 'br' and brotli is None):
+        offered = {name: params.get('q', '1') for name, params in _parse_header(accept_encoding)}
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate == 'br' and brotli is None:
+                continue
+            q = offered.get(candidate, offered.get('*'))
+            if q is not None and _quality(q) > 0:
+                encoding = candidate
+                break
+    return layout, encoding
+
+
+def _parse_header(value: Optional[str]):
+    """Split an Accept-style header into (lower-cased token, params) pairs, in order."""
+    items = []
+    for part in (value or '').split(','):
+        pieces = [p.strip() for p in part.split(';')]
+        if not pieces[0]:
+            continue
+        params = {}
+        for piece in pieces[1:]:
+            key, _, val = piece.partition('=')
+            params[key.strip().lower()] = val.strip().strip('"')
+        items.append((pieces[0].lower(), params))
+    return items
+
+
+def _quality(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
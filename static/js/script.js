@@ -2,9 +2,16 @@
 
 let configData = null;
 let charts = {};
-let scrapedListings = [];
 let polandRegions = null;
 
+// Analysis results live server-side; the browser only holds one page of rows
+const PAGE_SIZE = 50;
+let resultId = null;
+let currentPage = 1;
+let resultTotal = 0;
+let streamedCount = 0;
+let previewRows = [];
+
 // Initialize
 document.addEventListener('DOMContentLoaded', async () => {
     await loadConfig();
@@ -139,13 +146,25 @@ function setupEventListeners() {
 
     document.getElementById('analyzeBtn').addEventListener('click', runAnalysis);
 
-    // Client-side mapping for polish terms
+    // Filter changes re-query the server-side result set
     const inputs = ['yearFrom', 'yearTo', 'fuelSelect', 'gearboxSelect', 'driveSelect', 'firstOwner', 'accidentFree'];
     inputs.forEach(id => {
         document.getElementById(id).addEventListener('change', () => {
-            if (scrapedListings.length > 0) applyFilters();
+            currentPage = 1;
+            applyFilters();
         });
     });
+
+    document.getElementById('prevPage').addEventListener('click', () => changePage(-1));
+    document.getElementById('nextPage').addEventListener('click', () => changePage(1));
+}
+
+function changePage(delta) {
+    const lastPage = Math.max(1, Math.ceil(resultTotal / PAGE_SIZE));
+    const page = Math.min(Math.max(1, currentPage + delta), lastPage);
+    if (page === currentPage) return;
+    currentPage = page;
+    applyFilters();
 }
 
 // Sorting Function
@@ -169,7 +188,8 @@ function sortTable(column) {
         }
     });
 
-    applyFilters(); // Re-render with sort
+    currentPage = 1;
+    applyFilters(); // Re-query with sort
 }
 
 // Analysis with Streaming
@@ -179,8 +199,15 @@ async function runAnalysis() {
     const loadingText = document.getElementById('loadingText');
 
     btn.disabled = true;
+    loader.classList.remove('streaming');
     loader.classList.add('active');
     loadingText.textContent = "Initializing scrape...";
+    resultId = null;
+    document.getElementById('exportLink').hidden = true;
+    currentPage = 1;
+    streamedCount = 0;
+    previewRows = [];
+    latestAnalytics = null;
 
     try {
         const payload = {
@@ -196,12 +223,18 @@ async function runAnalysis() {
             gearbox: document.getElementById('gearboxSelect').value || null,
             drive_type: document.getElementById('driveSelect').value || null,
             first_owner: document.getElementById('firstOwner').checked,
-            accident_free: document.getElementById('accidentFree').checked
+            accident_free: document.getElementById('accidentFree').checked,
+            enrich: document.getElementById('enrichDetails').checked
         };
 
+        // Columnar batches are several times smaller than row objects; the
+        // browser also decompresses the gzip/brotli stream transparently
         const response = await fetch('/api/analyze', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'application/x-ndjson; layout=columnar'
+            },
             body: JSON.stringify(payload)
         });
 
@@ -224,9 +257,32 @@ async function runAnalysis() {
 
                     if (msg.type === 'progress') {
                         loadingText.textContent = msg.message;
+                    } else if (msg.type === 'batch') {
+                        // Render as pages arrive; the overlay shrinks to a
+                        // status badge once there is something to look at
+                        const listings = msg.layout === 'columnar' ? decodeColumnar(msg.listings) : msg.listings;
+                        streamedCount += listings.length;
+                        if (previewRows.length < PAGE_SIZE) {
+                            previewRows = previewRows.concat(listings.slice(0, PAGE_SIZE - previewRows.length));
+                        }
+                        loader.classList.add('streaming');
+                        loadingText.textContent = `${streamedCount} listings loaded...`;
+                        scheduleRender();
+                    } else if (msg.type === 'enrichment') {
+                        // Authoritative flags from the listings' detail pages
+                        const details = new Map(msg.listings.map(d => [d.id, d]));
+                        previewRows = previewRows.map(row => {
+                            const d = details.get(row.id);
+                            return d ? { ...row, accident_free: d.accident_free, first_owner: d.first_owner,
+                                         region: d.region || row.region } : row;
+                        });
+                        scheduleRender();
+                    } else if (msg.type === 'analytics') {
+                        latestAnalytics = msg.data;
+                        scheduleRender();
                     } else if (msg.type === 'complete') {
-                        scrapedListings = msg.data.listings;
-                        applyFilters();
+                        resultId = msg.data.result_id;
+                        await applyFilters();
                     } else if (msg.type === 'error') {
                         throw new Error(msg.message);
                     }
@@ -242,153 +298,142 @@ async function runAnalysis() {
         alert('Analysis failed: ' + error.message);
     } finally {
         btn.disabled = false;
-        loader.classList.remove('active');
+        loader.classList.remove('active', 'streaming');
     }
 }
 
-// Client-side Filtering & Display
-function applyFilters() {
-    let results = [...scrapedListings]; // Copy array
-
-    // Filtering logic matching python params
-    const yearFrom = parseInt(document.getElementById('yearFrom').value);
-    const yearTo = parseInt(document.getElementById('yearTo').value);
-
-    // Mappings
-    const fuelMap = {
-        'petrol': 'benzyna', 'diesel': 'diesel', 'electric': 'elektryczny', 'hybrid': 'hybryda', 'lpg': 'lpg'
-    };
-    const gearboxMap = {
-        'manual': 'manualna', 'automatic': 'automatyczna'
-    };
-
-    results = results.filter(item => {
-        const y = parseInt(item.year);
-        if (y < yearFrom || y > yearTo) return false;
-
-        // Check params if set
-        const fuelFilter = document.getElementById('fuelSelect').value;
-        if (fuelFilter) {
-            const mapped = fuelMap[fuelFilter] || fuelFilter;
-            if (!item.fuel || !item.fuel.toLowerCase().includes(mapped)) return false;
-        }
-
-        const gearFilter = document.getElementById('gearboxSelect').value;
-        if (gearFilter) {
-            const mapped = gearboxMap[gearFilter] || gearFilter;
-            if (!item.gearbox || !item.gearbox.toLowerCase().includes(mapped)) return false;
+// Expand a columnar batch ({length, columns}) into listing objects;
+// categorical columns arrive as {codes, categories}
+function decodeColumnar(batch) {
+    const columns = batch.columns;
+    const names = Object.keys(columns);
+    const rows = new Array(batch.length);
+    for (let i = 0; i < batch.length; i++) {
+        const row = {};
+        for (const name of names) {
+            const column = columns[name];
+            row[name] = Array.isArray(column)
+                ? column[i]
+                : (column.codes[i] >= 0 ? column.categories[column.codes[i]] : null);
         }
+        rows[i] = row;
+    }
+    return rows;
+}
 
-        const driveFilter = document.getElementById('driveSelect').value;
-        if (driveFilter) {
-            if (!item.drive || !item.drive.toLowerCase().includes(driveFilter)) return false;
-        }
+// Coalesce re-renders to at most one per animation frame while streaming
+let renderScheduled = false;
+function scheduleRender() {
+    if (renderScheduled) return;
+    renderScheduled = true;
+    requestAnimationFrame(() => {
+        renderScheduled = false;
+        renderStreaming();
+    });
+}
 
-        const firstOwner = document.getElementById('firstOwner').checked;
-        if (firstOwner && !item.first_owner) return false;
+// Latest running aggregates streamed by /api/analyze
+let latestAnalytics = null;
 
-        const accidentFree = document.getElementById('accidentFree').checked;
-        if (accidentFree && !item.accident_free) return false;
+function renderStreaming() {
+    if (resultId) return; // The final result set has taken over
+    updateTable(previewRows);
+    updatePager(streamedCount);
+    if (latestAnalytics && latestAnalytics.count === streamedCount) {
+        renderAnalytics(latestAnalytics);
+    }
+}
 
-        return true;
+// Server-side Filtering, Sorting & Paging
+let queryRequestId = 0;
+
+async function applyFilters() {
+    if (!resultId) return;
+
+    const params = new URLSearchParams({
+        year_from: document.getElementById('yearFrom').value,
+        year_to: document.getElementById('yearTo').value,
+        fuel: document.getElementById('fuelSelect').value,
+        gearbox: document.getElementById('gearboxSelect').value,
+        drive: document.getElementById('driveSelect').value,
+        first_owner: document.getElementById('firstOwner').checked ? '1' : '0',
+        accident_free: document.getElementById('accidentFree').checked ? '1' : '0',
+        page: currentPage,
+        page_size: PAGE_SIZE
     });
+    // The export carries the same filters, without paging or sorting
+    const exportParams = new URLSearchParams(params);
+    exportParams.delete('page');
+    exportParams.delete('page_size');
+    exportParams.set('format', 'csv');
+    const exportLink = document.getElementById('exportLink');
+    exportLink.href = `/api/results/${resultId}/export?${exportParams}`;
+    exportLink.hidden = false;
 
-    // Apply Sorting
     if (sortState.column) {
-        const col = sortState.column;
-        const dir = sortState.direction === 'asc' ? 1 : -1;
-
-        results.sort((a, b) => {
-            let valA = a[col];
-            let valB = b[col];
-
-            // Handle numeric strings or values
-            if (col === 'year' || col === 'price' || col === 'mileage') {
-                valA = parseFloat(valA) || 0;
-                valB = parseFloat(valB) || 0;
-            } else {
-                valA = (valA || '').toString().toLowerCase();
-                valB = (valB || '').toString().toLowerCase();
-            }
-
-            if (valA < valB) return -1 * dir;
-            if (valA > valB) return 1 * dir;
-            return 0;
-        });
+        params.set('sort', sortState.column);
+        params.set('direction', sortState.direction);
     }
 
-    updateUI(results);
-}
-
-function updateUI(data) {
-    if (data.length === 0) {
-        // Show empty state
-        return;
+    const requestId = ++queryRequestId;
+    try {
+        const response = await fetch(`/api/results/${resultId}?${params}`);
+        if (requestId !== queryRequestId) return; // Superseded by a newer query
+        const result = await response.json();
+        if (!response.ok) throw new Error(result.error);
+
+        resultTotal = result.total;
+        updateTable(result.rows);
+        updatePager(result.total);
+        if (result.analytics && result.analytics.price) renderAnalytics(result.analytics);
+    } catch (error) {
+        console.error('Failed to query results:', error);
     }
+}
 
-    // Calculate Stats
-    const prices = data.map(i => i.price).filter(p => p > 0);
-    const avg = prices.reduce((a, b) => a + b, 0) / prices.length;
-    const min = Math.min(...prices);
-    const max = Math.max(...prices);
-
-    // Sort for Median
-    prices.sort((a, b) => a - b);
-    const median = prices[Math.floor(prices.length / 2)];
+function updatePager(total) {
+    const lastPage = Math.max(1, Math.ceil(total / PAGE_SIZE));
+    document.getElementById('pageInfo').textContent =
+        `${total.toLocaleString()} listings · page ${currentPage} of ${lastPage}`;
+    document.getElementById('prevPage').disabled = !resultId || currentPage <= 1;
+    document.getElementById('nextPage').disabled = !resultId || currentPage >= lastPage;
+}
 
+function renderAnalytics(analytics) {
     // Update Cards
-    document.getElementById('statAvg').textContent = Math.round(avg).toLocaleString() + ' PLN';
-    document.getElementById('statMedian').textContent = Math.round(median).toLocaleString() + ' PLN';
-    document.getElementById('statMin').textContent = Math.round(min).toLocaleString() + ' PLN';
-    document.getElementById('statMax').textContent = Math.round(max).toLocaleString() + ' PLN';
-
-    updateCharts(data);
-    updateRegionMap(data);
-    updateTable(data);
+    const stats = analytics.price;
+    if (!stats) return;
+    document.getElementById('statAvg').textContent = Math.round(stats.mean).toLocaleString() + ' PLN';
+    document.getElementById('statMedian').textContent = Math.round(stats.median).toLocaleString() + ' PLN';
+    document.getElementById('statMin').textContent = Math.round(stats.min).toLocaleString() + ' PLN';
+    document.getElementById('statMax').textContent = Math.round(stats.max).toLocaleString() + ' PLN';
+
+    updateCharts(analytics);
+    updateRegionMap(analytics);
 }
 
-function updateRegionMap(data) {
+function updateRegionMap(analytics) {
     if (!polandRegions) return;
 
     const ctx = document.getElementById('chartRegionMap').getContext('2d');
 
-    // Group analysis by region
-    const regionStats = {};
-
-    data.forEach(item => {
-        if (!item.region || item.region === 'N/A') return;
-
-        const regionName = item.region.toLowerCase().trim();
-        if (!regionStats[regionName]) {
-            regionStats[regionName] = { count: 0, totalPrice: 0, prices: [] };
-        }
-        regionStats[regionName].count++;
-        regionStats[regionName].totalPrice += item.price;
-        regionStats[regionName].prices.push(item.price);
-    });
-
-    const regionsList = Object.keys(regionStats);
-    if (regionsList.length === 0) return;
+    // Per-region averages, keyed by lower-cased region name
+    const regionStats = analytics.regions;
+    if (Object.keys(regionStats).length === 0) return;
 
     // Map stats to GeoJSON features
     const chartData = polandRegions.map(feature => {
         const geoName = feature.properties.nazwa.toLowerCase().trim();
-        const stat = regionStats[geoName] || { count: 0, totalPrice: 0 };
+        const stat = regionStats[geoName] || { count: 0, mean: 0 };
         return {
             feature: feature,
-            value: stat.count > 0 ? (stat.totalPrice / stat.count) : 0,
+            value: stat.mean,
             count: stat.count
         };
     });
 
     if (charts.map) charts.map.destroy();
 
-    // Heatmap color scale (Green to Red)
-    // We'll use Chart.js built-in scales or custom Interpolation
-    const values = chartData.map(d => d.value).filter(v => v > 0);
-    const minVal = Math.min(...values) || 0;
-    const maxVal = Math.max(...values) || 1;
-
     charts.map = new Chart(ctx, {
         type: 'choropleth',
         data: {
@@ -457,26 +502,19 @@ function updateRegionMap(data) {
     });
 }
 
-function updateCharts(data) {
+function updateCharts(analytics) {
     const ctxHist = document.getElementById('chartPriceDist').getContext('2d');
     const ctxScatter = document.getElementById('chartPriceMile').getContext('2d');
 
-    // Histogram Logic (Simple bins)
-    const validPrices = data.map(d => d.price).filter(p => p > 0);
-    const binCount = 20;
-    const min = Math.min(...validPrices);
-    const max = Math.max(...validPrices);
-    const step = (max - min) / binCount;
-    const bins = Array(binCount).fill(0);
-    const labels = Array(binCount).fill(0).map((_, i) => Math.round(min + i * step));
-
-    validPrices.forEach(p => {
-        const idx = Math.min(Math.floor((p - min) / step), binCount - 1);
-        bins[idx]++;
-    });
+    // Histogram bins come precomputed; label each bar with its lower edge
+    const bins = analytics.histogram.counts;
+    const labels = analytics.histogram.edges.slice(0, -1).map(e => Math.round(e));
 
-    if (charts.hist) charts.hist.destroy();
-    charts.hist = new Chart(ctxHist, {
+    if (charts.hist) {
+        charts.hist.data.labels = labels;
+        charts.hist.data.datasets[0].data = bins;
+        charts.hist.update('none');
+    } else charts.hist = new Chart(ctxHist, {
         type: 'bar',
         data: {
             labels: labels,
@@ -498,19 +536,23 @@ function updateCharts(data) {
         }
     });
 
-    // Scatter Plot
-    const scatterData = data
-        .filter(d => d.price > 0 && d.mileage > 0)
-        .map(d => ({ x: d.mileage, y: d.price }));
+    // Scatter Plot: raw points, or 2-D bin centres sized by count for large sets
+    const scatterData = analytics.scatter.points;
 
-    if (charts.scatter) charts.scatter.destroy();
-    charts.scatter = new Chart(ctxScatter, {
+    if (charts.scatter) {
+        charts.scatter.data.datasets[0].data = scatterData;
+        charts.scatter.update('none');
+    } else charts.scatter = new Chart(ctxScatter, {
         type: 'scatter',
         data: {
             datasets: [{
                 label: 'Listing',
                 data: scatterData,
-                backgroundColor: '#8b5cf6'
+                backgroundColor: '#8b5cf6',
+                pointRadius: (ctx) => {
+                    const count = ctx.raw && ctx.raw.count;
+                    return count ? Math.min(2 + Math.sqrt(count), 12) : 3;
+                }
             }]
         },
         options: {
@@ -521,6 +563,7 @@ function updateCharts(data) {
                 tooltip: {
                     callbacks: {
                         label: (ctx) => `Price: ${ctx.parsed.y.toLocaleString()} PLN, Mileage: ${ctx.parsed.x.toLocaleString()} km`
+                            + (ctx.raw.count ? ` (${ctx.raw.count} cars)` : '')
                     }
                 }
             },
@@ -540,17 +583,29 @@ function updateCharts(data) {
     });
 }
 
+// Fair price and deviation from it; streamed rows are not scored yet
+function formatDeal(item) {
+    if (item.fair_price == null) return '–';
+    const fair = `${Math.round(item.fair_price).toLocaleString()} PLN`;
+    if (item.price_deviation == null) return fair;
+    const pct = Math.round(item.price_deviation * 100);
+    const cls = item.price_deviation < 0 ? 'deal-below' : 'deal-above';
+    const flag = item.outlier ? ' deal-outlier' : '';
+    return `${fair} <span class="deal ${cls}${flag}">${pct > 0 ? '+' : ''}${pct}%</span>`;
+}
+
 function updateTable(data) {
     const tbody = document.getElementById('tableBody');
     tbody.innerHTML = '';
 
-    data.slice(0, 50).forEach(item => { // Limit to 50 rows for perf
+    data.forEach(item => {
         const tr = document.createElement('tr');
         tr.innerHTML = `
             <td>${item.year}</td>
             <td><a href="${item.link}" target="_blank" class="listing-link">${item.title}</a></td>
             <td>${item.price.toLocaleString()} PLN</td>
             <td>${item.mileage.toLocaleString()} km</td>
+            <td>${formatDeal(item)}</td>
             <td>${item.fuel}</td>
             <td>${item.gearbox}</td>
         `;
@@ -0,0 +1,29 @@
+"""
+Shared fixtures: a local Otomoto stub server and fresh in-memory state.
+
+Tests run the real pipeline against ``benchmarks.stub_server``, with the
+same isolation the benchmark suite uses (in-memory stores, no page cache,
+no rate limit).
+"""
+
+import pytest
+
+from benchmarks.run import isolate
+from benchmarks.stub_server import start_stub_server
+
+
+@pytest.fixture
+def stub():
+    """Start a stub server (keyword arguments as StubServer) with isolated pipeline state."""
+    servers = []
+
+    def start(**kwargs):
+        server = start_stub_server(**kwargs)
+        servers.append(server)
+        isolate(server.base_url)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
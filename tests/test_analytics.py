@@ -0,0 +1,36 @@
+import json
+
+from benchmarks.bench_analytics import synthetic_listings
+from benchmarks.corpus import PAGE_SIZE, YEARS
+from src.analytics import RunningSummary, summarize_arrays
+from src.listing_table import ListingTable
+
+
+def test_running_summary_is_recomputed_geometrically():
+    records = synthetic_listings(PAGE_SIZE * 100)
+    pages = [ListingTable.from_records(records[i:i + PAGE_SIZE]) for i in range(0, len(records), PAGE_SIZE)]
+    running = RunningSummary()
+    partial = [summary for summary in map(running.add, pages) if summary is not None]
+    final = running.flush()
+
+    assert 1 < len(partial) < 25
+    assert partial[0]['count'] == PAGE_SIZE
+    full = ListingTable.from_records(records)
+    assert final == summarize_arrays(full['price'], full['mileage'], full['region'])
+    assert running.flush() is None
+
+
+def test_analyze_stream_ends_with_full_summary(stub):
+    import app as flask_app
+
+    stub(total=PAGE_SIZE * 10)
+    client = flask_app.app.test_client()
+    body = {'make': 'bmw', 'model': 'seria-3', 'year_from': YEARS[0], 'year_to': YEARS[1],
+            'max_pages': 15, 'incremental': False}
+    messages = [json.loads(line) for line in client.post('/api/analyze', json=body).data.splitlines()]
+    types = [m['type'] for m in messages]
+
+    assert types.count('batch') == 10
+    assert 1 < types.count('analytics') < 10
+    assert types[-2:] == ['analytics', 'complete']
+    assert messages[-2]['data']['count'] == PAGE_SIZE * 10
@@ -0,0 +1,47 @@
+import csv
+import io
+
+from benchmarks.corpus import PAGE_SIZE, YEARS
+from src.store import get_store
+
+BODY = {'make': 'bmw', 'model': 'seria-3', 'year_from': YEARS[0], 'year_to': YEARS[1],
+        'max_pages': 15, 'incremental': False}
+
+
+def test_live_export_streams_every_listing(stub):
+    import app as flask_app
+
+    stub(total=PAGE_SIZE * 5)
+    response = flask_app.app.test_client().post('/api/export?format=csv&chunk_rows=50', json=BODY)
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+    assert response.status_code == 200
+    assert len(rows) == PAGE_SIZE * 5 + 1
+
+
+def test_invalid_export_options_are_rejected_before_scraping(stub):
+    import app as flask_app
+
+    server = stub(total=PAGE_SIZE * 5)
+    client = flask_app.app.test_client()
+    for query in ('format=xlsx', 'chunk_rows=0', 'chunk_rows=-5'):
+        response = client.post(f'/api/export?{query}', json=BODY)
+        assert response.status_code == 400, query
+
+    assert server.request_count == 0
+    assert get_store().get_listing('6100000000') is None
+
+
+def test_parquet_carries_the_csv_columns():
+    import pyarrow.parquet as pq
+    from benchmarks.bench_analytics import synthetic_listings
+    from src.export import iter_export
+    from src.listing_table import ListingTable
+
+    record = dict(synthetic_listings(1)[0], price_text='89 900 EUR', mileage_text='120 tys. km')
+    table = ListingTable.from_records([record])
+    header = next(csv.reader(io.StringIO(b''.join(iter_export([table], 'csv')).decode('utf-8'))))
+    parquet = pq.read_table(io.BytesIO(b''.join(iter_export([table], 'parquet'))))
+
+    assert sorted(parquet.column_names) == sorted(header)
+    assert parquet.column('price_text').to_pylist() == ['89 900 EUR']
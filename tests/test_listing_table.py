@@ -0,0 +1,34 @@
+"""ListingTable round trips and row selection."""
+
+from benchmarks.bench_analytics import synthetic_listings
+from src.listing_table import ListingTable
+from src.store import ListingStore
+
+
+def test_take_nothing():
+    table = ListingTable.from_records(synthetic_listings(5))
+
+    assert len(table.take([])) == 0
+    assert len(table.take([False] * 5)) == 0
+    assert table.take([3, 1]).ids.tolist() == [table.ids[3], table.ids[1]]
+
+
+def test_records_keep_the_card_texts():
+    record = dict(synthetic_listings(1)[0], price_text='89 900 EUR', price=89900.0, mileage_text='120 tys. km')
+    store = ListingStore(':memory:')
+    store.upsert_listings(ListingTable.from_records([record]), 'search')
+
+    [stored] = store.get_search_listings('search')
+    [back] = ListingTable.from_records([stored]).to_records()
+
+    assert (back['price_text'], back['mileage_text']) == ('89 900 EUR', '120 tys. km')
+    assert back['price'] == 89900.0
+
+
+def test_missing_year_falls_back_to_year_from():
+    records = [dict(record, year=year) for record, year in zip(synthetic_listings(3), ('2019', None, 'N/A'))]
+
+    table = ListingTable.from_records(records, year_from=2015)
+
+    assert [record['year'] for record in table.to_records()] == ['2019', '2015', '2015']
+    assert [record['year'] for record in ListingTable.from_records(records).to_records()] == ['2019', '', '']
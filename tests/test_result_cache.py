@@ -0,0 +1,19 @@
+"""Result cache round trips."""
+
+from benchmarks.bench_analytics import synthetic_listings
+from src.listing_table import ListingTable
+from src.result_cache import ResultCache
+
+PARAMS = {'make': 'bmw', 'model': 'seria-3', 'year_from': 2015, 'year_to': 2020, 'max_pages': 5}
+
+
+def test_cached_table_matches_the_scraped_one():
+    records = [dict(record, price_text=f"{record['price']:,.0f} EUR", mileage_text='120 tys. km')
+               for record in synthetic_listings(20)]
+    table = ListingTable.from_records(records)
+    cache = ResultCache(':memory:')
+    cache.put(PARAMS, table)
+
+    cached, _ = cache.get(PARAMS)
+
+    assert cached.to_records() == table.to_records()
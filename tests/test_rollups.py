@@ -0,0 +1,55 @@
+"""Price rollups: membership per row key, trend filters and store-filled listings."""
+
+from datetime import datetime
+
+from benchmarks.bench_analytics import synthetic_listings
+from benchmarks.corpus import PAGE_SIZE, YEARS
+from src import scraper
+from src.listing_table import ListingTable
+from src.result_sets import ResultSet
+from src.rollups import RollupStore, get_rollups, set_rollups
+from src.store import get_store
+
+
+def _listings(fuels):
+    records = synthetic_listings(len(fuels))
+    for record, fuel in zip(records, fuels):
+        record['fuel'] = fuel
+        record['price'] = record['price'] or 10000.0
+        record['scrape_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return ListingTable.from_records(records)
+
+
+def test_fuel_filter_matches_like_result_sets():
+    rollups = RollupStore(':memory:')
+    listings = _listings(['Benzyna', 'Benzyna+LPG', 'Diesel', 'Benzyna+LPG'])
+    rollups.add(listings, 'bmw', 'seria-3')
+
+    for fuel in ('petrol', 'lpg', 'diesel', 'LPG'):
+        expected = int(ResultSet(listings).mask(fuel=fuel).sum())
+        assert rollups.trend('bmw', 'seria-3', fuel=fuel)['total']['count'] == expected
+    assert rollups.trend('bmw', 'seria-3', fuel='petrol')['total']['count'] == 3
+
+
+def test_generation_search_after_model_search_is_counted():
+    rollups = RollupStore(':memory:')
+    listings = _listings(['Diesel'] * 6)
+    rollups.add(listings, 'bmw', 'seria-3')
+    rollups.add(listings, 'bmw', 'seria-3', 'g20')
+    rollups.add(listings, 'bmw', 'seria-3', 'g20')
+
+    assert rollups.trend('bmw', 'seria-3', generation='g20')['total']['count'] == 6
+    assert rollups.trend('bmw', 'seria-3')['total']['count'] == 6
+
+
+def test_incremental_fill_is_rolled_up(stub):
+    stub(total=PAGE_SIZE * 5)
+    kwargs = dict(max_pages=10, store=get_store(), incremental=True, rollups=get_rollups())
+    scraper.get_listings('bmw', 'seria-3', YEARS[0], YEARS[1], **kwargs)
+    # As on the next day: nothing rolled up yet, listings known to the store
+    set_rollups(RollupStore(':memory:'))
+
+    listings = scraper.get_listings('bmw', 'seria-3', YEARS[0], YEARS[1], **dict(kwargs, rollups=get_rollups()))
+
+    priced = int((listings['price'] > 0).sum())
+    assert get_rollups().trend('bmw', 'seria-3')['total']['count'] == priced
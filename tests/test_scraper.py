@@ -0,0 +1,86 @@
+"""Search planning and incremental scrapes against the stub server."""
+
+from datetime import datetime, timedelta
+
+from benchmarks.corpus import PAGE_SIZE, YEARS
+from src import scraper, taxonomy
+from src.listing_table import ListingTable
+from src.jobs import normalize_params
+from src.store import INCREMENTAL_WINDOW, ListingStore, get_store, set_store
+
+
+def _scrape(max_pages, incremental=True):
+    return scraper.get_listings(
+        'bmw', 'seria-3', YEARS[0], YEARS[1], max_pages=max_pages, store=get_store(), incremental=incremental
+    )
+
+
+def test_incremental_fill_is_capped_at_max_pages(stub):
+    stub(total=PAGE_SIZE * 10)
+    assert len(_scrape(10)) == PAGE_SIZE * 10
+
+    listings = _scrape(2)
+
+    assert len(listings) == 2 * scraper.DEFAULT_PAGE_SIZE
+    assert len(set(listings.ids)) == len(listings)
+
+
+def test_incremental_fill_skips_listings_outside_window(stub):
+    server = stub(total=PAGE_SIZE * 5)
+    _scrape(10)
+    store = get_store()
+    stale = (datetime.now() - INCREMENTAL_WINDOW - timedelta(hours=1)).isoformat(timespec='seconds')
+    with store._lock, store._conn:
+        store._conn.execute('UPDATE search_listings SET last_seen = ?', (stale,))
+
+    server.request_count = 0
+    listings = _scrape(10)
+
+    # Nothing recent to fill in from, so every page is scraped again
+    assert len(listings) == PAGE_SIZE * 5
+    assert server.request_count > 1
+    server.request_count = 0
+    assert len(_scrape(10)) == PAGE_SIZE * 5
+    assert server.request_count == 1
+
+
+def _analyze(**body):
+    params = normalize_params(dict({'make': 'bmw', 'model': 'seria-3', 'year_from': YEARS[0], 'year_to': YEARS[1]},
+                                   **body))
+    params.pop('enrich')
+    return ListingTable.concat(
+        batch.listings for batch in scraper.iter_listing_pages(**params, store=get_store())
+    )
+
+
+def test_analysis_is_sharded_past_site_page_limit(stub, monkeypatch):
+    server = stub(total=PAGE_SIZE * 40, page_limit=5)
+    monkeypatch.setattr(scraper, 'SITE_PAGE_LIMIT', 5)
+    max_pages = normalize_params({'make': 'bmw', 'model': 'seria-3'})['max_pages']
+
+    for incremental in (False, True):
+        set_store(ListingStore(':memory:'))
+        server.request_count = 0
+        listings = _analyze(incremental=incremental)
+
+        # Past the 5 pages the site serves, within the default page budget
+        assert len(listings) == len(set(listings.ids)) == max_pages * PAGE_SIZE
+        assert server.request_count <= 2 * max_pages
+        assert len(set(listings['year'].tolist())) > 1
+
+    # A repeat incremental analysis stops every shard at its page 1 (probed
+    # by the planner) and fills in the rest from the store
+    first_run = server.request_count
+    server.request_count = 0
+    again = _analyze()
+    assert sorted(again.ids) == sorted(listings.ids)
+    assert server.request_count < first_run
+
+
+def test_unsaved_taxonomy_index_still_returns_models(stub, tmp_path):
+    stub()
+    blocker = tmp_path / 'blocker'
+    blocker.write_text('')
+    taxonomy.set_taxonomy_index(taxonomy.TaxonomyIndex(path=str(blocker / 'taxonomy.json')))
+
+    assert scraper.get_models('bmw')
@@ -0,0 +1,65 @@
+"""AdaptiveController window steps."""
+
+import pytest
+
+from src.throttle import ERROR_DECREASE, LATENCY_DECREASE, AdaptiveController
+
+
+def _request(controller, **outcome):
+    controller.acquire()
+    controller.release(**outcome)
+
+
+def test_error_halves_the_window_once_per_round_trip():
+    controller = AdaptiveController(max_window=16, initial_window=8)
+
+    _request(controller, latency=0.01, status=429)
+    assert controller.window == 8 * ERROR_DECREASE
+
+    # Sets a round trip of a minute: errors within it answer requests sent before the cut
+    _request(controller, latency=60.0, status=200)
+    window = controller.window
+    _request(controller, latency=None, status=503)
+    assert controller.window == window
+    assert controller.stats()['decreases'] == 1
+
+
+def test_window_never_drops_below_min_window():
+    controller = AdaptiveController(max_window=16, initial_window=2)
+
+    for _ in range(5):
+        _request(controller, status=None)
+
+    assert controller.window == 1.0
+
+
+def test_successes_grow_the_window_by_one_per_window():
+    controller = AdaptiveController(max_window=16, initial_window=4)
+
+    for _ in range(4):
+        _request(controller, latency=0.01, status=200)
+    assert 4.5 < controller.window < 5
+    _request(controller, latency=0.01, status=200)
+
+    assert controller.window == pytest.approx(5.12, abs=0.01)
+    assert controller.stats()['increases'] == 1
+
+
+def test_window_is_bounded_by_max_window():
+    controller = AdaptiveController(max_window=5, initial_window=4)
+
+    for _ in range(20):
+        _request(controller, latency=0.01, status=200)
+
+    assert controller.window == 5
+
+
+def test_slow_response_shrinks_the_window():
+    controller = AdaptiveController(max_window=16, initial_window=8)
+    for _ in range(5):
+        _request(controller, latency=0.01, status=200)
+    window = controller.window
+
+    _request(controller, latency=1.0, status=200)
+
+    assert controller.window == pytest.approx(window * LATENCY_DECREASE)
@@ -0,0 +1,94 @@
+"""Saved-search polling against the stub server."""
+
+import time
+import types
+
+from benchmarks.corpus import PAGE_SIZE, YEARS
+from src import http_client, page_cache, scraper, watcher
+from src.jobs import normalize_params
+from src.rollups import get_rollups
+from src.store import get_store
+
+
+def _saved_search():
+    params = normalize_params({'make': 'bmw', 'model': 'seria-3', 'year_from': YEARS[0], 'year_to': YEARS[1]})
+    return watcher.get_watch_store().add(params, watcher.MIN_INTERVAL)
+
+
+def test_poll_after_interval_is_not_served_from_page_cache(stub, tmp_path, monkeypatch):
+    server = stub(total=PAGE_SIZE * 4, promoted=3)
+    http_client.set_page_cache(page_cache.PageCache(str(tmp_path)))
+    poller = watcher.Watcher()
+    poller.poll(_saved_search())
+
+    # One interval later, as the scheduler would poll next
+    clock = types.SimpleNamespace(time=lambda: time.time() + watcher.MIN_INTERVAL)
+    monkeypatch.setattr(page_cache, 'time', clock)
+    server.add_listings(3)
+    result = poller.poll(watcher.get_watch_store().searches()[0])
+
+    assert len(result['entries']) == 3
+    assert all(entry['status'] == 'new' for entry in result['entries'])
+
+
+def test_analysis_between_polls_does_not_hide_new_listings(stub):
+    server = stub(total=PAGE_SIZE * 4, promoted=3)
+    search = _saved_search()
+    poller = watcher.Watcher()
+    poller.poll(search)
+
+    server.add_listings(3)
+    params = normalize_params(search['params'])
+    scraper.get_listings(
+        params['make'], params['model'], params['year_from'], params['year_to'], max_pages=params['max_pages'],
+        store=get_store(), incremental=True
+    )
+    result = poller.poll(watcher.get_watch_store().get(search['id']))
+
+    assert len(result['entries']) == 3
+    assert [entry['listing_id'] for entry in watcher.get_watch_store().feed()] == \
+        [entry['listing_id'] for entry in result['entries']]
+
+
+def test_mark_seen_reports_new_changed_and_unchanged():
+    watches = watcher.WatchStore(':memory:')
+    watches.mark_seen('a', [{'id': '1', 'price': 100.0}, {'id': '2', 'price': 200.0}])
+
+    seen = watches.mark_seen('a', [{'id': '1', 'price': 90.0}, {'id': '2', 'price': 200.0}, {'id': '3', 'price': 5.0}])
+
+    assert seen == {'1': ('changed', 100.0), '2': ('unchanged', None), '3': ('new', None)}
+    assert watches.mark_seen('b', [{'id': '1', 'price': 90.0}]) == {'1': ('new', None)}
+
+
+def test_first_poll_of_the_day_rolls_up_stored_listings(stub):
+    stub(total=PAGE_SIZE * 4)
+    search = _saved_search()
+    params = normalize_params(search['params'])
+    analyzed = scraper.get_listings(
+        params['make'], params['model'], params['year_from'], params['year_to'], max_pages=params['max_pages'],
+        store=get_store()
+    )
+
+    watcher.Watcher().poll(search)
+
+    priced = int((analyzed['price'] > 0).sum())
+    assert get_rollups().trend(params['make'], params['model'])['total']['count'] == priced
+
+
+def test_stop_polls_a_search_claimed_while_stopping(stub, monkeypatch):
+    stub(total=PAGE_SIZE)
+    search = _saved_search()
+    watches = watcher.get_watch_store()
+    poller = watcher.Watcher()
+    claim_due = watches.claim_due
+
+    def claim_once_stopping():
+        poller._stopped.wait()
+        return claim_due()
+
+    monkeypatch.setattr(watches, 'claim_due', claim_once_stopping)
+    poller.start()
+    poller.stop()
+
+    assert watches.get(search['id'])['last_success'] is not None
+    assert not poller.running